@@ -0,0 +1,165 @@
+import os
+import time
+import shutil
+import statistics
+
+import numpy as np
+
+# Inference backend settings (override with env vars when deploying)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
+INFERENCE_IMGSZ = int(os.getenv("INFERENCE_IMGSZ", "640"))
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "0") == "1"
+# Calibration dataset yaml for OpenVINO INT8 export (ultralytics falls back to its sample set)
+INFERENCE_INT8_DATA = os.getenv("INFERENCE_INT8_DATA")
+
+# Backends tried by "auto", in order of preference on ties
+BACKENDS = ("torch", "onnx", "openvino")
+# Backends with an INT8 export: ONNX via onnxruntime dynamic quantization, OpenVINO via NNCF
+INT8_BACKENDS = ("onnx", "openvino")
+# Input sizes evaluate.py compares (multiples of the model stride, 32)
+IMGSZ_VARIANTS = (320, 416, 640)
+
+# ultralytics (torch) is imported on first load/export, not at module import,
+# so the app can start rendering while the model loads in the background
+
+# ultralytics export format name and artifact suffix for each exported backend
+_EXPORTS = {
+    "onnx": ("onnx", ".onnx"),
+    "openvino": ("openvino", "_openvino_model"),
+}
+
+
+def variant_name(backend, imgsz=640, int8=False):
+    """Short label for a model variant, e.g. "onnx-416-int8"."""
+    return f"{backend}-{imgsz}" + ("-int8" if int8 else "")
+
+
+def artifact_path(weights, backend, imgsz=640, int8=False):
+    """Where the exported artifact for `weights` lives (next to the weights file)."""
+    stem, _ = os.path.splitext(weights)
+    return f"{stem}_{imgsz}{'_int8' if int8 else ''}{_EXPORTS[backend][1]}"
+
+
+def _quantize_onnx(source, target):
+    """Dynamically quantize an ONNX model's weights to INT8 (needs onnxruntime)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+
+
+def export_model(weights, backend, imgsz=640, int8=False):
+    """Export `weights` for `backend` once and return the artifact path.
+
+    The artifact is reused on later calls as long as it is newer than the
+    weights file. "torch" needs no export and returns `weights` unchanged.
+    With `int8`, ONNX models are dynamically quantized from the fp32 export
+    and OpenVINO models are exported with NNCF post-training quantization
+    (calibrated on INFERENCE_INT8_DATA).
+    """
+    if backend == "torch":
+        if int8:
+            raise ValueError(f"INT8 needs one of the export backends: {', '.join(INT8_BACKENDS)}")
+        return weights
+    if backend not in _EXPORTS:
+        raise ValueError(f"unknown inference backend: {backend}")
+    target = artifact_path(weights, backend, imgsz, int8)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights):
+        return target
+    if int8 and backend == "onnx":
+        _quantize_onnx(export_model(weights, backend, imgsz), target)
+        return target
+    from ultralytics import YOLO
+    options = {"int8": True, "data": INFERENCE_INT8_DATA} if int8 else {}
+    exported = YOLO(weights).export(format=_EXPORTS[backend][0], imgsz=imgsz,
+                                    **{k: v for k, v in options.items() if v is not None})
+    # os.replace can't overwrite a non-empty directory (the OpenVINO export), so drop the stale one first
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(str(exported), target)
+    return target
+
+
+def set_threads(threads):
+    """Limit the CPU threads used for inference (torch and OpenMP based runtimes)."""
+    if not threads:
+        return
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+
+
+def warmup(model, imgsz=640, runs=2):
+    """Run a few dummy predictions so the first real request isn't slow."""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(runs):
+        model.predict(dummy, imgsz=imgsz, verbose=False)
+
+
+def benchmark(model, imgsz=640, runs=10):
+    """Median latency in milliseconds of a single-image predict on `model`."""
+    dummy = np.random.default_rng(0).integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(dummy, imgsz=imgsz, verbose=False)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def load_artifact(path, imgsz=640, threads=INFERENCE_THREADS, warmup_runs=2):
+    """Load and warm up an already exported artifact (or torch weights) returned by `export_model`."""
+    from ultralytics import YOLO
+    set_threads(threads)
+    model = YOLO(path, task="detect")
+    if warmup_runs:
+        warmup(model, imgsz, warmup_runs)
+    return model
+
+
+def load_backend(weights, backend, imgsz=640, threads=INFERENCE_THREADS, warmup_runs=2, int8=False):
+    """Export (if needed), load and warm up `weights` on `backend`."""
+    return load_artifact(export_model(weights, backend, imgsz, int8), imgsz=imgsz, threads=threads,
+                         warmup_runs=warmup_runs)
+
+
+def select_backend(weights, candidates=BACKENDS, imgsz=640, threads=INFERENCE_THREADS, runs=10, int8=False):
+    """Load every candidate backend, time it and return (name, model, timings_ms).
+
+    Backends that fail to export or load (e.g. openvino not installed) are
+    skipped; their timing is recorded as None. With `int8` only the INT8
+    capable backends are tried.
+    """
+    if int8:
+        candidates = [name for name in candidates if name in INT8_BACKENDS]
+    timings = {}
+    best = None
+    for name in candidates:
+        try:
+            model = load_backend(weights, name, imgsz=imgsz, threads=threads, int8=int8)
+            timings[name] = benchmark(model, imgsz, runs)
+        except Exception:
+            timings[name] = None
+            continue
+        if best is None or timings[name] < timings[best[0]]:
+            best = (name, model)
+    if best is None:
+        raise RuntimeError(f"no inference backend could be loaded for {weights}")
+    return best[0], best[1], timings
+
+
+def load_model(weights="best1.pt", backend=INFERENCE_BACKEND, imgsz=INFERENCE_IMGSZ, threads=INFERENCE_THREADS,
+               int8=INFERENCE_INT8):
+    """Load `weights` through `backend` ("torch", "onnx", "openvino" or "auto").
+
+    Returns (model, backend_name). "auto" runs a short benchmark of every
+    backend on this host and keeps the fastest. INT8 models are reported as
+    "<backend>-int8" so cache keys and logs tell them apart.
+    """
+    if backend == "auto":
+        name, model, _ = select_backend(weights, imgsz=imgsz, threads=threads, int8=int8)
+    else:
+        name, model = backend, load_backend(weights, backend, imgsz=imgsz, threads=threads, int8=int8)
+    return model, f"{name}-int8" if int8 else name
@@ -0,0 +1,272 @@
+"""Headless benchmark of the detection pipeline.
+
+Runs the same stages as streamlit_app.py and webcam_detect.py (decode,
+preprocess, model.predict, box post-processing, auto_map_fruit, save_upload)
+over synthetic and sample images and writes p50/p95/p99 latency, throughput
+and peak RSS per stage to a JSON file, so runs can be compared across commits:
+
+    python benchmark.py --images samples/ --output bench/$(git rev-parse --short HEAD).json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import datetime
+import platform
+import subprocess
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import db
+import backends
+from detection import boxes_to_arrays, build_detected_info, draw_detections, process_prediction
+from preprocess import preprocess_upload
+from recipes import auto_map_fruit
+from class_index import for_names
+
+RESOLUTIONS = ("640x480", "1920x1080", "4032x3024")
+BATCH_SIZES = (1, 4, 8)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux), falling back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as fp:
+            pages = int(fp.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def synthetic_jpeg(width, height, seed=0):
+    """A noisy JPEG with a few fruit-sized blobs, roughly as hard to compress as a photo."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    for _ in range(6):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(min(width, height) // 20 + 1, min(width, height) // 6 + 2))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(img, center, radius, color, -1)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes()
+
+
+def load_inputs(resolutions, images_dir=None):
+    """Return [(label, raw_bytes)] for synthetic resolutions plus any sample images."""
+    inputs = []
+    for i, res in enumerate(resolutions):
+        w, h = (int(v) for v in res.lower().split("x"))
+        inputs.append((f"synthetic_{res}", synthetic_jpeg(w, h, seed=i)))
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(images_dir, name), "rb") as fp:
+                    inputs.append((name, fp.read()))
+    return inputs
+
+
+def measure(fn, repeat, warmup=1):
+    """Call `fn` `warmup + repeat` times; returns (latencies in seconds of the last `repeat`, rss).
+
+    `rss` has the highest current RSS sampled after each call (`rss_mb`) and
+    how far that is above the RSS before the stage started (`rss_delta_mb`),
+    so every stage reports its own memory rather than the process-wide peak.
+    """
+    before = current_rss_mb()
+    high = before
+    for _ in range(warmup):
+        fn()
+        high = max(high, current_rss_mb())
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+        high = max(high, current_rss_mb())
+    delta = round(high - before, 1) if high is not None and before is not None else None
+    return latencies, {"rss_mb": high, "rss_delta_mb": delta}
+
+
+def summarize(stage, label, measured, items_per_call=1, **extra):
+    latencies, rss = measured
+    ms = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    total = float(np.sum(latencies))
+    row = {
+        "stage": stage,
+        "input": label,
+        "calls": len(latencies),
+        "items_per_call": items_per_call,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput_per_s": round(items_per_call * len(latencies) / total, 2) if total > 0 else None,
+        "rss_mb": rss["rss_mb"],
+        "rss_delta_mb": rss["rss_delta_mb"],
+        "process_peak_rss_mb": peak_rss_mb(),
+    }
+    row.update(extra)
+    return row
+
+
+def use_mongomock():
+    """Point db.py at an in-process mongomock client (GridFS included)."""
+    import mongomock
+    import mongomock.gridfs
+    mongomock.gridfs.enable_gridfs_integration()
+    db._clients[db.MONGO_URI] = mongomock.MongoClient()
+
+
+def bench_image(model, label, raw_bytes, args):
+    """Benchmark every per-image stage on one input; returns result rows."""
+    rows = []
+    buf = np.frombuffer(raw_bytes, dtype=np.uint8)
+    frame = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    h, w = frame.shape[:2]
+    meta = {"width": w, "height": h, "bytes": len(raw_bytes)}
+    n = args.repeat
+
+    rows.append(summarize("decode_full", label, measure(lambda: cv2.imdecode(buf, cv2.IMREAD_COLOR), n), **meta))
+    rows.append(summarize("convert_resize", label, measure(
+        lambda: cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), (args.imgsz, args.imgsz)), n), **meta))
+    rows.append(summarize("preprocess_upload", label, measure(
+        lambda: preprocess_upload(raw_bytes, size=args.imgsz), n), **meta))
+
+    prep = preprocess_upload(raw_bytes, size=args.imgsz)
+    for b in args.batch_sizes:
+        batch = [prep["input"]] * b
+        rows.append(summarize("predict", label, measure(
+            lambda: model.predict(batch, conf=args.conf, imgsz=args.imgsz, verbose=False), n),
+            items_per_call=b, batch_size=b, **meta))
+
+    pred = model.predict(prep["input"], conf=args.conf, imgsz=args.imgsz, verbose=False)[0]
+
+    def postprocess():
+        xyxy, cls, conf = boxes_to_arrays(pred)
+        draw_detections(prep["input"].copy(), xyxy, cls, conf, pred.names)
+        return build_detected_info(pred.names, cls, conf)
+
+    detected_info = postprocess()
+    rows.append(summarize("postprocess", label, measure(postprocess, n), boxes=len(detected_info), **meta))
+
+    # every class at once, so the mapping is exercised even when nothing was detected
+    names = pred.names.values() if isinstance(pred.names, dict) else pred.names
+    all_classes = [{"label": name, "conf": 0.9 - 0.01 * i, "cls_id": i} for i, name in enumerate(names)]
+    rows.append(summarize("auto_map_fruit", label, measure(
+        lambda: auto_map_fruit(detected_info + all_classes), n), **meta))
+    index = for_names(pred.names)
+    all_cls = np.array([d["cls_id"] for d in detected_info + all_classes], dtype=np.int64)
+    all_conf = np.array([d["conf"] for d in detected_info + all_classes], dtype=np.float32)
+    rows.append(summarize("class_index_auto_map", label, measure(
+        lambda: index.auto_map(all_cls, all_conf), n), **meta))
+
+    def webcam_frame():
+        f = cv2.flip(frame, 1)
+        p = model.predict(f, conf=args.conf, imgsz=args.imgsz, verbose=False)[0]
+        process_prediction(f, p)
+        return cv2.cvtColor(f, cv2.COLOR_BGR2RGB)
+
+    rows.append(summarize("webcam_frame", label, measure(webcam_frame, n), **meta))
+
+    if args.mongo != "none":
+        # a counter after the JPEG end marker makes every payload a new blob, so each call
+        # pays for the GridFS write instead of taking the content-hash dedup shortcut
+        counter = itertools.count()
+        rows.append(summarize("save_upload", label, measure(
+            lambda: db.save_upload(raw_bytes + str(next(counter)).encode(), label, "apple", detected_info,
+                                   cloudinary_config={}), n), **meta))
+        rows.append(summarize("save_upload_dedup", label, measure(
+            lambda: db.save_upload(raw_bytes, label, "apple", detected_info, cloudinary_config={}), n), **meta))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fruit detection pipeline without a UI")
+    parser.add_argument("--weights", default="best1.pt")
+    parser.add_argument("--backend", default=backends.INFERENCE_BACKEND,
+                        choices=("auto",) + backends.BACKENDS)
+    parser.add_argument("--threads", type=int, default=backends.INFERENCE_THREADS)
+    parser.add_argument("--imgsz", type=int, default=backends.INFERENCE_IMGSZ)
+    parser.add_argument("--int8", action="store_true", default=backends.INFERENCE_INT8,
+                        help="use the INT8-quantized export (onnx/openvino backends)")
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--images", help="directory of sample images to benchmark as well")
+    parser.add_argument("--resolutions", nargs="*", default=list(RESOLUTIONS),
+                        help="synthetic image sizes as WxH")
+    parser.add_argument("--batch-sizes", nargs="*", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per stage")
+    parser.add_argument("--mongo", choices=("mongomock", "uri", "none"), default="mongomock",
+                        help="where save_upload writes: in-process mongomock, MONGO_URI, or skip")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    if args.mongo == "mongomock":
+        use_mongomock()
+
+    start = time.perf_counter()
+    model, backend = backends.load_model(args.weights, backend=args.backend, imgsz=args.imgsz,
+                                         threads=args.threads, int8=args.int8)
+    load_s = time.perf_counter() - start
+
+    rows = []
+    for label, raw_bytes in load_inputs(args.resolutions, args.images):
+        for row in bench_image(model, label, raw_bytes, args):
+            rows.append(row)
+            print(f"{row['stage']:<18} {row['input']:<24} p50={row['p50_ms']:>9.2f}ms "
+                  f"p95={row['p95_ms']:>9.2f}ms p99={row['p99_ms']:>9.2f}ms "
+                  f"{row['throughput_per_s'] or 0:>8.1f}/s rss={row['rss_mb']}MB (+{row['rss_delta_mb']})")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "weights": args.weights,
+            "backend": backend,
+            "threads": args.threads,
+            "imgsz": args.imgsz,
+            "int8": args.int8,
+            "repeat": args.repeat,
+            "mongo": args.mongo,
+            "model_load_s": round(load_s, 3),
+        },
+        "results": rows,
+    }
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"Wrote {len(rows)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
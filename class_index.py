@@ -0,0 +1,72 @@
+import numpy as np
+
+from recipes import extract_fruit_name, match_recipe
+
+
+class ClassIndex:
+    """Per-class lookup tables built once from the model's class names.
+
+    The model's class set is fixed once the weights are loaded, so the regex
+    normalization and difflib matching in recipes.py only need to run once per
+    class. Afterwards mapping detections is an array lookup:
+
+    - `recipe[cls_id]`: recipe key matched by `match_recipe`, or None
+    - `normalized[cls_id]`: `extract_fruit_name` of the label
+    - `fresh[cls_id]`: True when the label says "fresh" (drives box colors)
+    """
+
+    def __init__(self, names):
+        items = list(names.items()) if isinstance(names, dict) else list(enumerate(names))
+        size = max((int(i) for i, _ in items), default=-1) + 1
+        self.labels = [""] * size
+        self.recipe = [None] * size
+        self.normalized = [""] * size
+        self.fresh = np.zeros(size, dtype=bool)
+        for i, label in items:
+            i = int(i)
+            label = str(label)
+            self.labels[i] = label
+            self.recipe[i] = match_recipe(label)
+            self.normalized[i] = extract_fruit_name(label)
+            self.fresh[i] = "fresh" in label.lower()
+        self.has_recipe = np.array([r is not None for r in self.recipe], dtype=bool)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def auto_map(self, cls, conf, conf_thresh=0.3):
+        """Recipe key of the most confident detection (>= `conf_thresh`) that has one, or None.
+
+        Same result as `recipes.auto_map_fruit` on the equivalent detected_info,
+        computed with a mask and an argmax instead of per-detection matching.
+        """
+        cls = np.asarray(cls, dtype=np.int64)
+        conf = np.asarray(conf, dtype=np.float32)
+        if cls.size == 0:
+            return None
+        known = (cls >= 0) & (cls < len(self))
+        mask = known & (conf >= conf_thresh)
+        mask[known] &= self.has_recipe[cls[known]]
+        if not mask.any():
+            return None
+        best = int(np.argmax(np.where(mask, conf, -np.inf)))
+        return self.recipe[cls[best]]
+
+    def first_normalized(self, cls):
+        """`extract_fruit_name` of the first detection's label ("" if none)."""
+        for c in np.asarray(cls, dtype=np.int64).tolist():
+            if 0 <= c < len(self) and self.normalized[c]:
+                return self.normalized[c]
+        return ""
+
+
+_indexes = {}
+
+
+def for_names(names):
+    """Return the (memoized) ClassIndex for a model's `names` mapping."""
+    key = tuple(names.items()) if isinstance(names, dict) else tuple(enumerate(names))
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = ClassIndex(names)
+    return index
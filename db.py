@@ -1,36 +1,121 @@
 import os
 import io
+import atexit
+import hashlib
 import datetime
-from pymongo import MongoClient
-import gridfs
+import threading
+from typing import TYPE_CHECKING
+import cv2
 
-try:
-    import cloudinary
-    import cloudinary.uploader
-except Exception:
-    cloudinary = None
+import metrics
+from preprocess import decode_reduced
+from recipes import fruit_key
+
+# pymongo, gridfs and cloudinary are imported on first use, so importing this
+# module (e.g. at app startup) doesn't pay for clients that aren't needed yet
+if TYPE_CHECKING:
+    import gridfs
+    from pymongo import MongoClient
 
 # MongoDB connection string (override with MONGO_URI env var if needed)
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGO_DB", "rotten_or_not")
 
+# Connection pool settings shared by every client created by get_client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+
+# GridFS / thumbnail settings
+GRIDFS_CHUNK_SIZE = int(os.getenv("GRIDFS_CHUNK_SIZE", str(255 * 1024)))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
 # Cloudinary defaults (override with env vars when deploying)
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
 CLOUDINARY_API_KEY = os.getenv("CLOUDINARY_API_KEY")
 CLOUDINARY_API_SECRET = os.getenv("CLOUDINARY_API_SECRET")
 
 
+# Process-wide registries: one MongoClient per URI, one GridFS handle per database
+_clients = {}
+_gridfs = {}
+_registry_lock = threading.Lock()
+# (uri, db_name) pairs whose uploads indexes have been ensured
+_upload_indexed = set()
+
+
+def get_client(uri: str = None) -> "MongoClient":
+    """Return the shared MongoClient for `uri`, creating it on first use.
+
+    MongoClient is thread-safe and keeps its own connection pool, so one
+    instance per URI is reused by every caller in the process.
+    """
+    uri = uri or MONGO_URI
+    client = _clients.get(uri)
+    if client is not None:
+        return client
+    with _registry_lock:
+        client = _clients.get(uri)
+        if client is None:
+            from pymongo import MongoClient
+            client = MongoClient(
+                uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            )
+            _clients[uri] = client
+    return client
+
+
 def get_db(uri: str = None, db_name: str = None):
     uri = uri or MONGO_URI
     db_name = db_name or DB_NAME
-    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
-    db = client[db_name]
-    return db
+    return get_client(uri)[db_name]
+
+
+def get_gridfs(uri: str = None, db_name: str = None, collection: str = "fs") -> "gridfs.GridFS":
+    """Return the shared GridFS handle for a bucket (`collection`) of the given database."""
+    key = (uri or MONGO_URI, db_name or DB_NAME, collection)
+    fs = _gridfs.get(key)
+    if fs is None:
+        with _registry_lock:
+            fs = _gridfs.get(key)
+            if fs is None:
+                import gridfs
+                fs = gridfs.GridFS(get_db(uri=uri, db_name=db_name), collection=collection)
+                _gridfs[key] = fs
+    return fs
+
+
+def close_clients() -> None:
+    """Close every pooled client and drop cached GridFS handles."""
+    with _registry_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _gridfs.clear()
+        _upload_indexed.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_clients)
 
 
 def upload_to_cloudinary(raw_bytes: bytes, filename: str, cloud_name: str = None, api_key: str = None, api_secret: str = None) -> dict:
     """Upload raw image bytes to Cloudinary and return the upload result dict."""
-    if cloudinary is None:
+    try:
+        import cloudinary
+        import cloudinary.uploader
+    except Exception:
         raise RuntimeError("cloudinary package is not installed")
 
     cloud_name = cloud_name or CLOUDINARY_CLOUD_NAME
@@ -45,20 +130,83 @@ def upload_to_cloudinary(raw_bytes: bytes, filename: str, cloud_name: str = None
     fp = io.BytesIO(raw_bytes)
     fp.name = filename
     # upload as streamed file; resource_type 'image' by default
-    res = cloudinary.uploader.upload(fp, resource_type="image")
+    with metrics.timed("upload_to_cloudinary"):
+        res = cloudinary.uploader.upload(fp, resource_type="image")
     return res
 
 
-def save_upload(raw_bytes: bytes, filename: str, chosen_fruit: str, detected_info: object, uri: str = None, db_name: str = None, cloudinary_config: dict = None) -> dict:
-    """Save an uploaded image and metadata.
+def content_hash(raw_bytes: bytes) -> str:
+    """Hex SHA-256 of the image bytes; used as the GridFS file id for dedup."""
+    return hashlib.sha256(raw_bytes).hexdigest()
 
-    Behavior:
-    - If `cloudinary_config` is provided (or CLOUDINARY_* env vars exist), upload the image to Cloudinary and store the Cloudinary response in metadata.
-    - Otherwise, store the raw image bytes in GridFS and record the file id.
 
-    Returns the metadata document inserted into MongoDB.
+def make_thumbnail(raw_bytes: bytes, size: int = THUMBNAIL_SIZE, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    """JPEG thumbnail with the longer side at most `size` px, or None if the image can't be decoded."""
+    frame, _ = decode_reduced(raw_bytes, target=size)
+    if frame is None:
+        return None
+    h, w = frame.shape[:2]
+    scale = size / max(h, w)
+    if scale < 1:
+        frame = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes() if ok else None
+
+
+def ensure_upload_indexes(uri: str = None, db_name: str = None) -> None:
+    """Create the `uploads` indexes used by dedup and history.py (once per process).
+
+    History pages and analytics always filter or sort on `uploaded_at`, so
+    it is the trailing key of every compound index.
     """
+    key = (uri or MONGO_URI, db_name or DB_NAME)
+    if key in _upload_indexed:
+        return
+    uploads = get_db(uri=uri, db_name=db_name).uploads
+    uploads.create_index("sha256")
+    uploads.create_index([("uploaded_at", -1), ("_id", -1)])
+    uploads.create_index([("chosen_fruit", 1), ("uploaded_at", -1), ("_id", -1)])
+    uploads.create_index([("detected_info.fruit", 1), ("detected_info.fresh", 1), ("uploaded_at", -1)])
+    _upload_indexed.add(key)
+
+
+def put_content_addressed(fs: "gridfs.GridFS", data: bytes, file_id: str, filename: str = None) -> str:
+    """Store `data` under `file_id` unless a file with that id already exists.
+
+    GridFS file ids are unique (`_id`), so two concurrent writers of the same
+    content can't create duplicates: the loser gets FileExists and reuses the
+    stored file.
+    """
+    import gridfs.errors
+    if fs.exists(file_id):
+        metrics.inc("fruit_blob_dedup_total")
+        return file_id
+    try:
+        fs.put(data, _id=file_id, filename=filename, chunkSize=GRIDFS_CHUNK_SIZE)
+    except gridfs.errors.FileExists:
+        metrics.inc("fruit_blob_dedup_total")
+    return file_id
+
+
+def store_blob(raw_bytes: bytes, filename: str, uri: str = None, db_name: str = None, cloudinary_config: dict = None) -> dict:
+    """Store the image bytes (deduplicated by content hash) and its thumbnail.
+
+    Returns the blob fields of the upload document: `sha256`, `thumbnail_id`,
+    and either `cloudinary` (when `cloudinary_config` or the CLOUDINARY_* env
+    vars are available and the upload succeeds) or the GridFS `file_id`.
+    Content that was stored before is never uploaded or written again; only
+    the new metadata row will point at it.
+    """
+    digest = content_hash(raw_bytes)
     db = get_db(uri=uri, db_name=db_name)
+    ensure_upload_indexes(uri=uri, db_name=db_name)
+
+    thumb_fs = get_gridfs(uri=uri, db_name=db_name, collection="thumbs")
+    thumbnail_id = digest if thumb_fs.exists(digest) else None
+    if thumbnail_id is None:
+        thumb = make_thumbnail(raw_bytes)
+        if thumb is not None:
+            thumbnail_id = put_content_addressed(thumb_fs, thumb, digest, filename=filename)
 
     cloud_info = None
     if cloudinary_config is None:
@@ -71,29 +219,129 @@ def save_upload(raw_bytes: bytes, filename: str, chosen_fruit: str, detected_inf
             }
 
     if cloudinary_config:
-        try:
-            cloud_info = upload_to_cloudinary(raw_bytes, filename,
-                                              cloud_name=cloudinary_config.get("cloud_name"),
-                                              api_key=cloudinary_config.get("api_key"),
-                                              api_secret=cloudinary_config.get("api_secret"))
-        except Exception:
-            cloud_info = None
+        prev = db.uploads.find_one({"sha256": digest, "cloudinary": {"$ne": None}}, {"cloudinary": 1})
+        if prev is not None:
+            cloud_info = prev["cloudinary"]
+        else:
+            try:
+                cloud_info = upload_to_cloudinary(raw_bytes, filename,
+                                                  cloud_name=cloudinary_config.get("cloud_name"),
+                                                  api_key=cloudinary_config.get("api_key"),
+                                                  api_secret=cloudinary_config.get("api_secret"))
+            except Exception:
+                cloud_info = None
 
     file_id = None
     if cloud_info is None:
         # fallback to GridFS storage
-        fs = gridfs.GridFS(db)
-        file_id = fs.put(raw_bytes, filename=filename)
+        fs = get_gridfs(uri=uri, db_name=db_name)
+        with metrics.timed("gridfs_put"):
+            file_id = put_content_addressed(fs, raw_bytes, digest, filename=filename)
+    return {"file_id": file_id, "cloudinary": cloud_info, "sha256": digest, "thumbnail_id": thumbnail_id}
+
 
-    meta = {
+def annotate_detections(detected_info: list) -> list:
+    """Copy of `detected_info` with a normalized `fruit` name and a `fresh` flag on each entry.
+
+    Stored alongside the raw label so history.py can filter and aggregate
+    on the server without parsing labels.
+    """
+    out = []
+    for d in detected_info or []:
+        label = str(d.get("label", ""))
+        out.append(dict(d, fruit=fruit_key(label), fresh="fresh" in label.lower()))
+    return out
+
+
+def build_upload_doc(filename: str, chosen_fruit: str, detected_info: object, blob: dict = None, uploaded_at: datetime.datetime = None) -> dict:
+    """Build the metadata document stored in the `uploads` collection."""
+    blob = blob or {}
+    if isinstance(detected_info, list):
+        detected_info = annotate_detections(detected_info)
+    return {
         "filename": filename,
-        "file_id": file_id,
-        "cloudinary": cloud_info,
+        "file_id": blob.get("file_id"),
+        "cloudinary": blob.get("cloudinary"),
+        "sha256": blob.get("sha256"),
+        "thumbnail_id": blob.get("thumbnail_id"),
         "chosen_fruit": chosen_fruit,
         "detected_info": detected_info,
-        "uploaded_at": datetime.datetime.utcnow(),
+        "uploaded_at": uploaded_at or datetime.datetime.utcnow(),
     }
 
-    res = db.uploads.insert_one(meta)
+
+def save_upload(raw_bytes: bytes, filename: str, chosen_fruit: str, detected_info: object, uri: str = None, db_name: str = None, cloudinary_config: dict = None) -> dict:
+    """Save an uploaded image and metadata.
+
+    Behavior:
+    - If `cloudinary_config` is provided (or CLOUDINARY_* env vars exist), upload the image to Cloudinary and store the Cloudinary response in metadata.
+    - Otherwise, store the raw image bytes in GridFS and record the file id.
+    - Images already stored (same SHA-256) are not stored again; a JPEG thumbnail is kept in the `thumbs` GridFS bucket.
+
+    Returns the metadata document inserted into MongoDB.
+    """
+    db = get_db(uri=uri, db_name=db_name)
+
+    blob = store_blob(raw_bytes, filename, uri=uri, db_name=db_name, cloudinary_config=cloudinary_config)
+    meta = build_upload_doc(filename, chosen_fruit, detected_info, blob=blob)
+
+    with metrics.timed("insert_one"):
+        res = db.uploads.insert_one(meta)
     meta["_id"] = res.inserted_id
     return meta
+
+
+def get_thumbnail(thumbnail_id: str, uri: str = None, db_name: str = None) -> bytes:
+    """Return the JPEG thumbnail bytes stored for an upload, or None."""
+    import gridfs.errors
+    try:
+        return get_gridfs(uri=uri, db_name=db_name, collection="thumbs").get(thumbnail_id).read()
+    except gridfs.errors.NoFile:
+        return None
+
+
+# (uri, db_name) pairs whose inference_cache TTL index has been ensured
+_cache_ttl_indexed = set()
+
+
+def ensure_ttl_index(collection, field: str, ttl_seconds: int) -> None:
+    """Create a TTL index on `field`, or change the expiry of an existing one.
+
+    create_index fails with IndexOptionsConflict when the index exists with a
+    different expireAfterSeconds (e.g. after RESULT_CACHE_TTL changed), so the
+    expiry is updated with collMod, or the index is rebuilt where collMod is
+    not available.
+    """
+    from pymongo.errors import OperationFailure
+    try:
+        collection.create_index(field, expireAfterSeconds=ttl_seconds)
+        return
+    except OperationFailure:
+        pass
+    try:
+        collection.database.command({"collMod": collection.name,
+                                     "index": {"keyPattern": {field: 1}, "expireAfterSeconds": ttl_seconds}})
+    except Exception:
+        collection.drop_index(f"{field}_1")
+        collection.create_index(field, expireAfterSeconds=ttl_seconds)
+
+
+def get_cached_result(key: str, uri: str = None, db_name: str = None) -> dict:
+    """Return the cached inference result stored under `key`, or None."""
+    db = get_db(uri=uri, db_name=db_name)
+    return db.inference_cache.find_one({"_id": key})
+
+
+def put_cached_result(key: str, result: dict, ttl_seconds: int = None, uri: str = None, db_name: str = None) -> None:
+    """Store an inference result under `key` (upsert).
+
+    When `ttl_seconds` is given a TTL index on `created_at` lets MongoDB expire
+    old entries on its own.
+    """
+    db = get_db(uri=uri, db_name=db_name)
+    if ttl_seconds and (uri, db_name) not in _cache_ttl_indexed:
+        ensure_ttl_index(db.inference_cache, "created_at", int(ttl_seconds))
+        _cache_ttl_indexed.add((uri, db_name))
+    doc = dict(result)
+    doc["created_at"] = datetime.datetime.utcnow()
+    db.inference_cache.replace_one({"_id": key}, doc, upsert=True)
@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+import metrics
+from class_index import for_names
+
+FRESH_COLOR = (0, 255, 0)
+ROTTEN_COLOR = (0, 0, 255)
+
+
+def _to_numpy(x):
+    # ultralytics keeps boxes as torch tensors; move the whole tensor at once
+    if hasattr(x, "cpu"):
+        x = x.cpu()
+    if hasattr(x, "numpy"):
+        return x.numpy()
+    return np.asarray(x)
+
+
+def boxes_to_arrays(pred):
+    """Convert `pred.boxes` into NumPy arrays in one pass.
+
+    Returns (xyxy, cls, conf): an (N, 4) float32 array of box corners, an (N,)
+    int array of class ids and an (N,) float32 array of confidences. All arrays
+    are empty when there are no detections. Tracker output (tracker.Tracks)
+    already holds these arrays and is returned as is.
+    """
+    if hasattr(pred, "track_ids"):
+        return pred.xyxy, pred.cls, pred.conf
+    boxes = getattr(pred, "boxes", None)
+    if boxes is None or len(boxes) == 0:
+        return (np.empty((0, 4), dtype=np.float32),
+                np.empty((0,), dtype=np.int64),
+                np.empty((0,), dtype=np.float32))
+    xyxy = _to_numpy(boxes.xyxy).astype(np.float32, copy=False)
+    cls = _to_numpy(boxes.cls).astype(np.int64, copy=False)
+    conf = _to_numpy(boxes.conf).astype(np.float32, copy=False)
+    return xyxy, cls, conf
+
+
+def build_detected_info(names, cls, conf, xyxy=None):
+    """Build the `detected_info` list ({label, conf, cls_id} dicts) from arrays.
+
+    When `xyxy` is given each dict also gets its box as `xyxy` (rounded ints).
+    """
+    info = [
+        {"label": names[c], "conf": f, "cls_id": c}
+        for c, f in zip(cls.tolist(), conf.tolist())
+    ]
+    if xyxy is not None:
+        for d, box in zip(info, np.rint(xyxy).astype(np.int32).tolist()):
+            d["xyxy"] = box
+    return info
+
+
+def class_colors(names):
+    """Map each class id to its box color (green for fresh, red otherwise)."""
+    return [FRESH_COLOR if fresh else ROTTEN_COLOR for fresh in for_names(names).fresh.tolist()]
+
+
+def draw_detections(frame, xyxy, cls, conf, names, colors=None, font_scale=0.8, thickness=2, ids=None):
+    """Draw boxes and `label conf` captions onto `frame` in place and return it.
+
+    With `ids` (track ids) captions are prefixed with `#id`.
+    """
+    if colors is None:
+        colors = class_colors(names)
+    prefixes = [f"#{i} " for i in ids.tolist()] if ids is not None else [""] * len(cls)
+    for (x1, y1, x2, y2), c, f, prefix in zip(np.rint(xyxy).astype(np.int32).tolist(), cls.tolist(),
+                                              conf.tolist(), prefixes):
+        color = colors[c] if 0 <= c < len(colors) else ROTTEN_COLOR
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+        cv2.putText(frame,
+                    f"{prefix}{names[c]} {f:.2f}",
+                    (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale,
+                    color,
+                    thickness)
+    return frame
+
+
+def process_prediction(frame, pred, font_scale=0.8):
+    """Convert a prediction to arrays, draw it on `frame` and return `detected_info`."""
+    with metrics.timed("box_loop"):
+        xyxy, cls, conf = boxes_to_arrays(pred)
+        draw_detections(frame, xyxy, cls, conf, pred.names, font_scale=font_scale,
+                        ids=getattr(pred, "track_ids", None))
+        return build_detected_info(pred.names, cls, conf)
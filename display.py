@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+
+import cv2
+
+import metrics
+from detection import process_prediction
+from pipeline import FramePipeline
+
+# Display settings for the browser feed (override with env vars when deploying)
+DISPLAY_MAX_FPS = float(os.getenv("DISPLAY_MAX_FPS", "12"))
+DISPLAY_MAX_KBPS = float(os.getenv("DISPLAY_MAX_KBPS", "3000"))
+DISPLAY_MAX_WIDTH = int(os.getenv("DISPLAY_MAX_WIDTH", "960"))
+DISPLAY_MIN_WIDTH = int(os.getenv("DISPLAY_MIN_WIDTH", "320"))
+DISPLAY_JPEG_QUALITY = int(os.getenv("DISPLAY_JPEG_QUALITY", "80"))
+DISPLAY_MIN_QUALITY = int(os.getenv("DISPLAY_MIN_QUALITY", "40"))
+
+
+class JpegEncoder:
+    """Encode BGR frames to JPEG while keeping each frame near a byte budget.
+
+    The budget is `max_kbps` spread over `fps` frames. When frames come out
+    too large the quality is lowered first, then the width; when they are
+    well under budget the width is restored first, then the quality.
+    """
+
+    def __init__(self, max_kbps=DISPLAY_MAX_KBPS, fps=DISPLAY_MAX_FPS, quality=DISPLAY_JPEG_QUALITY,
+                 max_width=DISPLAY_MAX_WIDTH, min_quality=DISPLAY_MIN_QUALITY, min_width=DISPLAY_MIN_WIDTH):
+        self.budget = max_kbps * 1000 / 8 / max(fps, 1e-3)
+        self.max_quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.max_width = max_width
+        self.min_width = min(min_width, max_width)
+        self.quality = quality
+        self.width = max_width
+        self.last_size = 0
+        self._resized = None
+
+    def encode(self, frame):
+        h, w = frame.shape[:2]
+        if w > self.width:
+            size = (self.width, max(1, h * self.width // w))
+            if self._resized is not None and self._resized.shape[1::-1] != size:
+                self._resized = None
+            self._resized = frame = cv2.resize(frame, size, dst=self._resized, interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return None
+        self.last_size = len(buf)
+        self._adapt(self.last_size, w)
+        return buf.tobytes()
+
+    def _adapt(self, size, source_width):
+        if size > self.budget * 1.1:
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 10)
+            elif self.width > self.min_width:
+                self.width = max(self.min_width, int(min(self.width, source_width) * 0.8))
+        elif size < self.budget * 0.6:
+            if self.width < self.max_width and self.width < source_width:
+                self.width = min(self.max_width, int(self.width * 1.25))
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + 5)
+
+
+class DisplayFeed:
+    """Latest annotated frame, encoded once and shared by every viewer.
+
+    `publish()` encodes at most `max_fps` frames per second and drops the
+    rest. Viewers call `wait()`, which always returns the newest JPEG, so a
+    viewer that falls behind skips the frames it missed instead of queueing them.
+    """
+
+    def __init__(self, max_fps=DISPLAY_MAX_FPS, encoder=None):
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.encoder = encoder or JpegEncoder(fps=max_fps)
+        self.published = 0
+        self.rate_limited = 0
+        self.viewer_skipped = 0
+        self.closed = False
+        self._jpeg = None
+        self._seq = 0
+        self._last = 0.0
+        self._cond = threading.Condition()
+
+    def due(self):
+        """True when enough time has passed since the last published frame."""
+        return time.perf_counter() - self._last >= self.interval
+
+    def publish(self, frame):
+        """Encode and publish `frame` unless the display rate cap says to skip it."""
+        if not self.due():
+            self.rate_limited += 1
+            return False
+        self._last = time.perf_counter()
+        with metrics.timed("display_encode"):
+            jpeg = self.encoder.encode(frame)
+        if jpeg is None:
+            return False
+        metrics.inc("fruit_display_bytes_total", len(jpeg))
+        with self._cond:
+            self._jpeg = jpeg
+            self._seq += 1
+            self.published += 1
+            self._cond.notify_all()
+        return True
+
+    def wait(self, after=0, timeout=1.0):
+        """Return (seq, jpeg) for the newest frame newer than `after`, or (after, None) on timeout/close."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self.closed, timeout)
+            if self._seq <= after:
+                return after, None
+            if after:
+                self.viewer_skipped += self._seq - after - 1
+            return self._seq, self._jpeg
+
+    def frames(self, timeout=1.0):
+        """Yield the newest JPEG each time one is published, until the feed is closed."""
+        seq = 0
+        while not self.closed:
+            seq, jpeg = self.wait(seq, timeout)
+            if jpeg is not None:
+                yield jpeg
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def snapshot(self):
+        return {
+            "published": self.published,
+            "rate_limited": self.rate_limited,
+            "viewer_skipped": self.viewer_skipped,
+            "kb_per_frame": round(self.encoder.last_size / 1024, 1),
+            "quality": self.encoder.quality,
+            "width": self.encoder.width,
+        }
+
+
+class LiveStream:
+    """One camera pipeline shared by every viewer of the webcam page.
+
+    The first `attach()` opens the camera with `open_capture()` and starts a
+    FramePipeline with the `infer` built by `build()`; a render thread draws
+    the detections and publishes them to `feed` at the display rate, so
+    inference never waits on encoding or on slow clients. The pipeline stops
+    when the last viewer detaches.
+
+    `build()` returns a dict with at least `infer`; the whole dict is kept
+    as `context` so callers can report on the gate or tracker it created.
+    """
+
+    def __init__(self, open_capture, max_fps=DISPLAY_MAX_FPS):
+        self.open_capture = open_capture
+        self.max_fps = max_fps
+        self.viewers = 0
+        self.pipe = None
+        self.feed = None
+        self.context = {}
+        self.error = None
+        self._cap = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, build):
+        """Register a viewer (starting the stream if needed) and return the shared DisplayFeed."""
+        with self._lock:
+            if self.pipe is None or not self.pipe.running:
+                self._stop_locked()
+                self.context = build()
+                self.error = None
+                self._cap = self.open_capture()
+                self.feed = DisplayFeed(self.max_fps)
+                self.pipe = FramePipeline(self._cap, self.context["infer"]).start()
+                self._thread = threading.Thread(target=self._render_loop, args=(self.pipe, self.feed),
+                                                name="display", daemon=True)
+                self._thread.start()
+            self.viewers += 1
+            metrics.set_gauge("fruit_display_viewers", self.viewers)
+            return self.feed
+
+    def detach(self):
+        with self._lock:
+            self.viewers = max(0, self.viewers - 1)
+            metrics.set_gauge("fruit_display_viewers", self.viewers)
+            if self.viewers == 0:
+                self._stop_locked()
+
+    def _render_loop(self, pipe, feed):
+        try:
+            for packet in pipe.results():
+                if not feed.due():
+                    feed.rate_limited += 1
+                    continue
+                frame = packet["frame"]
+                process_prediction(frame, packet["pred"])
+                feed.publish(frame)
+        finally:
+            self.error = pipe.error
+            feed.close()
+
+    def _stop_locked(self):
+        if self.pipe is not None:
+            self.pipe.stop()
+        if self._thread is not None:
+            self._thread.join(2.0)
+        if self._cap is not None:
+            self._cap.release()
+        if self.feed is not None:
+            self.feed.close()
+        self.pipe = self._thread = self._cap = None
@@ -0,0 +1,288 @@
+"""Accuracy vs. latency/memory of model variants on a labeled image folder.
+
+    python evaluate.py data/val --output eval/results.json
+
+Every variant (backend x input size x fp32/INT8) is loaded in its own
+process, run over the dataset and timed, so peak RSS is per variant. Two
+dataset layouts are supported:
+
+- YOLO detection layout, `images/` with matching `labels/*.txt`: reports
+  AP@0.5 per class and mAP50
+- one folder per class (`fresh_apple/`, `rotten_banana/`, ...): an image
+  counts as correct when its most confident detection has that label;
+  reports accuracy per class and overall
+
+The variants on the Pareto front (score vs. p50 latency vs. peak RSS) are
+listed, and the fastest one within `--max-drop` of the best score is
+recommended together with the INFERENCE_* settings that select it in
+streamlit_app.py, webcam_detect.py, score.py and benchmark.py.
+"""
+import os
+import json
+import time
+import argparse
+import datetime
+import multiprocessing
+
+import numpy as np
+
+import backends
+from benchmark import git_commit, peak_rss_mb
+from detection import boxes_to_arrays
+from preprocess import preprocess_upload, unletterbox_boxes
+from tracker import iou_matrix
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _norm(label):
+    return str(label).lower().replace("_", " ").replace("-", " ").strip()
+
+
+def load_dataset(root):
+    """Return (kind, items): kind is "detection" or "classification".
+
+    Detection items are (path, boxes) with boxes as (N, 5) [cls, cx, cy, w, h]
+    normalized YOLO rows; classification items are (path, folder label).
+    """
+    images_dir = os.path.join(root, "images")
+    labels_dir = os.path.join(root, "labels")
+    if os.path.isdir(images_dir) and os.path.isdir(labels_dir):
+        items = []
+        for dirpath, _, names in os.walk(images_dir):
+            for name in sorted(names):
+                if not name.lower().endswith(IMAGE_EXTS):
+                    continue
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(os.path.splitext(path)[0], images_dir)
+                label_path = os.path.join(labels_dir, rel + ".txt")
+                rows = np.loadtxt(label_path, ndmin=2) if os.path.exists(label_path) else np.zeros((0, 5))
+                items.append((path, rows.reshape(-1, 5)))
+        return "detection", items
+    items = []
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if os.path.isdir(folder):
+            items.extend((os.path.join(folder, n), label) for n in sorted(os.listdir(folder))
+                         if n.lower().endswith(IMAGE_EXTS))
+    return "classification", items
+
+
+def average_precision(tp, conf, n_gt):
+    """All-point interpolated AP from per-detection true-positive flags and confidences."""
+    if n_gt == 0:
+        return None
+    if len(tp) == 0:
+        return 0.0
+    order = np.argsort(-np.asarray(conf), kind="stable")
+    tp = np.asarray(tp, dtype=np.float64)[order]
+    ctp = np.cumsum(tp)
+    recall = ctp / n_gt
+    precision = ctp / np.arange(1, len(tp) + 1)
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    idx = np.nonzero(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[idx + 1] - mrec[idx]) * mpre[idx + 1]))
+
+
+def _gt_boxes(rows, width, height):
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1), rows[:, 0].astype(np.int64)
+
+
+def score_detection(per_image, names, iou_threshold=0.5):
+    """mAP50 over classes with ground truth, plus AP per class label."""
+    tps, confs, n_gt = {}, {}, {}
+    for (pred_xyxy, pred_cls, pred_conf), (gt_xyxy, gt_cls) in per_image:
+        for c in set(pred_cls.tolist()) | set(gt_cls.tolist()):
+            p = pred_cls == c
+            g = gt_cls == c
+            n_gt[c] = n_gt.get(c, 0) + int(g.sum())
+            order = np.argsort(-pred_conf[p], kind="stable")
+            boxes, scores = pred_xyxy[p][order], pred_conf[p][order]
+            iou = iou_matrix(boxes, gt_xyxy[g])
+            used = np.zeros(int(g.sum()), dtype=bool)
+            for i in range(len(boxes)):
+                hit = False
+                if iou.shape[1]:
+                    j = int(np.argmax(np.where(used, -1.0, iou[i])))
+                    if not used[j] and iou[i, j] >= iou_threshold:
+                        used[j] = hit = True
+                tps.setdefault(c, []).append(hit)
+                confs.setdefault(c, []).append(float(scores[i]))
+    per_class = {}
+    for c, n in n_gt.items():
+        ap = average_precision(tps.get(c, []), confs.get(c, []), n)
+        if ap is not None:
+            per_class[names.get(c, str(c)) if isinstance(names, dict) else names[c]] = round(ap, 4)
+    score = float(np.mean(list(per_class.values()))) if per_class else 0.0
+    return "mAP50", score, per_class
+
+
+def score_classification(per_image, names):
+    """Overall accuracy plus accuracy per folder label."""
+    total, correct = {}, {}
+    for (_, pred_cls, pred_conf), label in per_image:
+        total[label] = total.get(label, 0) + 1
+        if len(pred_cls):
+            top = int(pred_cls[int(np.argmax(pred_conf))])
+            if _norm(names[top]) == _norm(label):
+                correct[label] = correct.get(label, 0) + 1
+    per_class = {label: round(correct.get(label, 0) / n, 4) for label, n in total.items()}
+    score = sum(correct.values()) / max(1, sum(total.values()))
+    return "accuracy", score, per_class
+
+
+def evaluate_variant(variant, dataset, args):
+    """Load one variant and run it over the dataset (called in a fresh process)."""
+    backend, imgsz, int8 = variant["backend"], variant["imgsz"], variant["int8"]
+    row = dict(variant, name=backends.variant_name(backend, imgsz, int8))
+    try:
+        start = time.perf_counter()
+        model = backends.load_backend(args["weights"], backend, imgsz=imgsz, threads=args["threads"], int8=int8)
+        row["load_s"] = round(time.perf_counter() - start, 3)
+        kind, items = dataset
+        latencies, per_image = [], []
+        for path, truth in items:
+            with open(path, "rb") as fp:
+                raw = fp.read()
+            prep = preprocess_upload(raw, size=imgsz)
+            if prep is None:
+                continue
+            start = time.perf_counter()
+            pred = model.predict(prep["input"], conf=args["conf"], imgsz=imgsz, verbose=False)[0]
+            latencies.append(time.perf_counter() - start)
+            xyxy, cls, conf = boxes_to_arrays(pred)
+            xyxy = unletterbox_boxes(xyxy, prep["ratio"], prep["pad"], prep["frame"].shape) * prep["factor"]
+            if kind == "detection":
+                # the decoded frame is EXIF-rotated, unlike the size in the JPEG header
+                h, w = prep["frame"].shape[:2]
+                truth = _gt_boxes(truth, w * prep["factor"], h * prep["factor"])
+            per_image.append(((xyxy, cls, conf), truth))
+        scorer = score_detection if kind == "detection" else score_classification
+        row["metric"], row["score"], row["per_class"] = scorer(per_image, model.names)
+        row["score"] = round(row["score"], 4)
+        ms = np.asarray(latencies) * 1000.0
+        row["images"] = len(latencies)
+        row["p50_ms"] = round(float(np.percentile(ms, 50)), 3) if len(ms) else None
+        row["p95_ms"] = round(float(np.percentile(ms, 95)), 3) if len(ms) else None
+        row["peak_rss_mb"] = peak_rss_mb()
+        row["error"] = None
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def build_variants(backend_names, sizes, int8_modes):
+    return [
+        {"backend": b, "imgsz": s, "int8": q}
+        for b in backend_names for s in sizes for q in int8_modes
+        if not q or b in backends.INT8_BACKENDS
+    ]
+
+
+def pareto_front(rows):
+    """Rows not dominated on (higher score, lower p50 latency, lower peak RSS)."""
+    ok = [r for r in rows if r.get("error") is None and r.get("p50_ms") is not None]
+
+    def key(r):
+        return (-r["score"], r["p50_ms"], r["peak_rss_mb"] or 0.0)
+
+    front = []
+    for r in ok:
+        kr = key(r)
+        dominated = any(
+            all(a <= b for a, b in zip(key(o), kr)) and key(o) != kr for o in ok if o is not r)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r["p50_ms"])
+
+
+def recommend(front, max_drop):
+    """Fastest Pareto variant whose score is within `max_drop` of the best."""
+    if not front:
+        return None
+    best = max(r["score"] for r in front)
+    return min((r for r in front if r["score"] >= best - max_drop), key=lambda r: r["p50_ms"])
+
+
+def settings_for(row):
+    """Environment settings that make the apps load `row`'s variant."""
+    return {
+        "INFERENCE_BACKEND": row["backend"],
+        "INFERENCE_IMGSZ": str(row["imgsz"]),
+        "INFERENCE_INT8": "1" if row["int8"] else "0",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model variants for accuracy, latency and memory")
+    parser.add_argument("dataset", help="YOLO layout (images/ + labels/) or one folder per class")
+    parser.add_argument("--weights", default="best1.pt")
+    parser.add_argument("--backends", nargs="*", default=list(backends.BACKENDS), choices=backends.BACKENDS)
+    parser.add_argument("--imgsz", nargs="*", type=int, default=list(backends.IMGSZ_VARIANTS))
+    parser.add_argument("--no-int8", action="store_true", help="only evaluate fp32 variants")
+    parser.add_argument("--threads", type=int, default=backends.INFERENCE_THREADS)
+    parser.add_argument("--conf", type=float, default=None,
+                        help="confidence threshold (default 0.001 for mAP, 0.25 for accuracy)")
+    parser.add_argument("--max-drop", type=float, default=0.02,
+                        help="largest score drop from the best variant accepted for a faster one")
+    parser.add_argument("--output", default="eval_results.json")
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    kind, items = dataset
+    if not items:
+        raise SystemExit(f"no labeled images found under {args.dataset}")
+    conf = args.conf if args.conf is not None else (0.001 if kind == "detection" else 0.25)
+    config = {"weights": args.weights, "threads": args.threads, "conf": conf}
+    variants = build_variants(args.backends, args.imgsz, (False,) if args.no_int8 else (False, True))
+    print(f"Evaluating {len(variants)} variants on {len(items)} images ({kind})")
+
+    rows = []
+    # one process per variant so peak RSS and thread settings don't leak between variants
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for variant in variants:
+            row = pool.apply(evaluate_variant, (variant, dataset, config))
+            rows.append(row)
+            if row["error"]:
+                print(f"{row['name']:<20} failed: {row['error']}")
+            else:
+                print(f"{row['name']:<20} {row['metric']}={row['score']:.4f} p50={row['p50_ms']:.1f}ms "
+                      f"p95={row['p95_ms']:.1f}ms rss={row['peak_rss_mb']}MB")
+
+    front = pareto_front(rows)
+    best = recommend(front, args.max_drop)
+    print("Pareto front: " + ", ".join(r["name"] for r in front))
+    if best is not None:
+        env = settings_for(best)
+        print(f"Recommended: {best['name']} ({best['metric']}={best['score']:.4f}, p50={best['p50_ms']:.1f}ms)")
+        print("  " + " ".join(f"{k}={v}" for k, v in env.items()))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "dataset": args.dataset,
+            "kind": kind,
+            "images": len(items),
+            "weights": args.weights,
+            "conf": conf,
+            "max_drop": args.max_drop,
+        },
+        "results": rows,
+        "pareto": [r["name"] for r in front],
+        "recommended": dict(name=best["name"], settings=settings_for(best)) if best else None,
+    }
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Read side of the `uploads` collection: paginated history and freshness analytics.
+
+History pages use keyset pagination on (uploaded_at, _id) with a projection
+that leaves out the Cloudinary payload and detection boxes, so every page
+costs the same index range scan no matter how deep it is. Analytics run as
+aggregation pipelines on the server. The per-day numbers shown on dashboards
+come from `daily_rollups`, one document per (day, fruit), which
+`refresh_rollups` keeps current by re-aggregating only the most recent days:
+
+    python history.py --refresh-rollups        # e.g. from cron
+    python history.py --backfill               # annotate uploads saved before rollups existed
+    python history.py --reannotate             # recompute every stored fruit name, rebuild rollups
+"""
+import os
+import time
+import argparse
+import datetime
+
+from bson import ObjectId
+
+import db
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# Days before the last rollup that are re-aggregated on every refresh, to pick
+# up uploads that were persisted late (e.g. replayed from the journal)
+ROLLUP_LOOKBACK_DAYS = int(os.getenv("ROLLUP_LOOKBACK_DAYS", "2"))
+# daily_freshness() refreshes the rollups first when they are older than this
+ROLLUP_MAX_AGE_SECONDS = float(os.getenv("ROLLUP_MAX_AGE_SECONDS", "300"))
+
+CONF_BOUNDARIES = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0001]
+
+HISTORY_PROJECTION = {
+    "filename": 1,
+    "chosen_fruit": 1,
+    "uploaded_at": 1,
+    "sha256": 1,
+    "thumbnail_id": 1,
+    "file_id": 1,
+    "cloudinary.secure_url": 1,
+    "detected_info.label": 1,
+    "detected_info.conf": 1,
+    "detected_info.fruit": 1,
+    "detected_info.fresh": 1,
+}
+
+_rollups_indexed = set()
+
+
+def _day(value):
+    return value.strftime("%Y-%m-%d")
+
+
+def _range_match(since=None, until=None):
+    match = {}
+    if since is not None or until is not None:
+        match["uploaded_at"] = {}
+        if since is not None:
+            match["uploaded_at"]["$gte"] = since
+        if until is not None:
+            match["uploaded_at"]["$lt"] = until
+    return match
+
+
+def encode_cursor(doc):
+    """Opaque page token for the position right after `doc`."""
+    return f"{doc['uploaded_at'].isoformat()}|{doc['_id']}"
+
+
+def decode_cursor(cursor):
+    ts, oid = cursor.split("|", 1)
+    return datetime.datetime.fromisoformat(ts), ObjectId(oid)
+
+
+def history(limit=HISTORY_PAGE_SIZE, cursor=None, fruit=None, since=None, until=None,
+            uri=None, db_name=None):
+    """One page of uploads, newest first; returns (docs, next_cursor).
+
+    Pass the returned `next_cursor` back to get the following page; it is
+    None on the last page. `fruit` filters on `chosen_fruit`.
+    """
+    db.ensure_upload_indexes(uri=uri, db_name=db_name)
+    query = _range_match(since, until)
+    if fruit:
+        query["chosen_fruit"] = fruit
+    if cursor:
+        ts, oid = decode_cursor(cursor)
+        query["$or"] = [{"uploaded_at": {"$lt": ts}}, {"uploaded_at": ts, "_id": {"$lt": oid}}]
+    docs = list(
+        db.get_db(uri=uri, db_name=db_name).uploads
+        .find(query, HISTORY_PROJECTION)
+        .sort([("uploaded_at", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def _freshness_stages():
+    """$unwind + $group stages producing per (day, fruit) freshness counts and a confidence histogram."""
+    conf = "$detected_info.conf"
+    group = {
+        "_id": {
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$uploaded_at"}},
+            "fruit": "$detected_info.fruit",
+        },
+        "detections": {"$sum": 1},
+        "fresh": {"$sum": {"$cond": ["$detected_info.fresh", 1, 0]}},
+        "conf_sum": {"$sum": conf},
+        "uploads": {"$addToSet": "$_id"},
+    }
+    for i, (lo, hi) in enumerate(zip(CONF_BOUNDARIES, CONF_BOUNDARIES[1:])):
+        group[f"b{i}"] = {"$sum": {"$cond": [{"$and": [{"$gte": [conf, lo]}, {"$lt": [conf, hi]}]}, 1, 0]}}
+    return [
+        {"$unwind": "$detected_info"},
+        {"$match": {"detected_info.fruit": {"$nin": [None, ""]}}},
+        {"$group": group},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "fruit": "$_id.fruit",
+            "uploads": {"$size": "$uploads"},
+            "detections": 1,
+            "fresh": 1,
+            "rotten": {"$subtract": ["$detections", "$fresh"]},
+            "conf_sum": 1,
+            "conf_hist": [f"$b{i}" for i in range(len(CONF_BOUNDARIES) - 1)],
+        }},
+    ]
+
+
+def freshness_by_day(since=None, until=None, fruit=None, uri=None, db_name=None):
+    """Fresh/rotten counts and fresh ratio per (day, fruit), aggregated live from `uploads`."""
+    match = _range_match(since, until)
+    if fruit:
+        match["detected_info.fruit"] = fruit
+    pipeline = [{"$match": match}] + _freshness_stages()
+    if fruit:
+        pipeline.append({"$match": {"fruit": fruit}})
+    pipeline.append({"$sort": {"day": 1, "fruit": 1}})
+    rows = list(db.get_db(uri=uri, db_name=db_name).uploads.aggregate(pipeline))
+    for row in rows:
+        row["fresh_ratio"] = row["fresh"] / row["detections"] if row["detections"] else None
+    return rows
+
+
+def confidence_distribution(since=None, until=None, fruit=None, boundaries=CONF_BOUNDARIES,
+                            uri=None, db_name=None):
+    """Detection confidence histogram: [{"_id": lower bound, "count", "fresh"}] per bucket."""
+    match = _range_match(since, until)
+    if fruit:
+        match["detected_info.fruit"] = fruit
+    pipeline = [{"$match": match}, {"$unwind": "$detected_info"}]
+    if fruit:
+        pipeline.append({"$match": {"detected_info.fruit": fruit}})
+    pipeline.append(
+        {"$bucket": {
+            "groupBy": "$detected_info.conf",
+            "boundaries": list(boundaries),
+            "default": "other",
+            "output": {
+                "count": {"$sum": 1},
+                "fresh": {"$sum": {"$cond": ["$detected_info.fresh", 1, 0]}},
+            },
+        }})
+    return list(db.get_db(uri=uri, db_name=db_name).uploads.aggregate(pipeline))
+
+
+def ensure_rollup_indexes(uri=None, db_name=None):
+    key = (uri or db.MONGO_URI, db_name or db.DB_NAME)
+    if key in _rollups_indexed:
+        return
+    db.get_db(uri=uri, db_name=db_name).daily_rollups.create_index([("day", 1), ("fruit", 1)], unique=True)
+    _rollups_indexed.add(key)
+
+
+def refresh_rollups(full=False, uri=None, db_name=None):
+    """Re-aggregate recent days of `uploads` into `daily_rollups` and return the first day rebuilt.
+
+    Only days from `ROLLUP_LOOKBACK_DAYS` before the previous refresh onwards
+    are recomputed and merged (replacing those days' documents), so the cost
+    is bounded by recent traffic, not by collection size. `full=True`
+    rebuilds every day.
+    """
+    database = db.get_db(uri=uri, db_name=db_name)
+    db.ensure_upload_indexes(uri=uri, db_name=db_name)
+    ensure_rollup_indexes(uri=uri, db_name=db_name)
+    now = datetime.datetime.utcnow()
+    state = None if full else database.rollup_state.find_one({"_id": "daily"})
+    since = None
+    if state is not None:
+        last = datetime.datetime.strptime(state["day"], "%Y-%m-%d")
+        since = last - datetime.timedelta(days=ROLLUP_LOOKBACK_DAYS)
+
+    pipeline = [{"$match": _range_match(since)}] + _freshness_stages() + [
+        {"$merge": {"into": "daily_rollups", "on": ["day", "fruit"],
+                    "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    database.uploads.aggregate(pipeline)
+    database.rollup_state.replace_one(
+        {"_id": "daily"}, {"_id": "daily", "day": _day(now), "refreshed_at": time.time()}, upsert=True)
+    return _day(since) if since else None
+
+
+def daily_freshness(days=30, fruit=None, max_age=ROLLUP_MAX_AGE_SECONDS, uri=None, db_name=None):
+    """Per (day, fruit) freshness rows for the last `days` days, read from `daily_rollups`.
+
+    Refreshes the rollups first when they are older than `max_age` seconds
+    (None skips the check). Each row has uploads, detections, fresh, rotten,
+    fresh_ratio, mean_conf and conf_hist (counts per CONF_BOUNDARIES bucket).
+    """
+    database = db.get_db(uri=uri, db_name=db_name)
+    if max_age is not None:
+        state = database.rollup_state.find_one({"_id": "daily"})
+        if state is None or time.time() - state.get("refreshed_at", 0) > max_age:
+            refresh_rollups(uri=uri, db_name=db_name)
+    start = _day(datetime.datetime.utcnow() - datetime.timedelta(days=days - 1))
+    query = {"day": {"$gte": start}}
+    if fruit:
+        query["fruit"] = fruit
+    rows = list(database.daily_rollups.find(query, {"_id": 0}).sort([("day", 1), ("fruit", 1)]))
+    for row in rows:
+        n = row["detections"]
+        row["fresh_ratio"] = row["fresh"] / n if n else None
+        row["mean_conf"] = row.pop("conf_sum") / n if n else None
+    return rows
+
+
+def backfill_detection_fields(batch_size=500, uri=None, db_name=None):
+    """Add `fruit`/`fresh` to detections of uploads saved before they were stored; returns docs updated."""
+    uploads = db.get_db(uri=uri, db_name=db_name).uploads
+    query = {"detected_info.0": {"$exists": True}, "detected_info.fresh": {"$exists": False}}
+    updated = 0
+    while True:
+        docs = list(uploads.find(query, {"detected_info": 1}).limit(batch_size))
+        if not docs:
+            return updated
+        for doc in docs:
+            uploads.update_one({"_id": doc["_id"]},
+                               {"$set": {"detected_info": db.annotate_detections(doc["detected_info"])}})
+        updated += len(docs)
+
+
+def reannotate_detection_fields(batch_size=500, uri=None, db_name=None):
+    """Recompute `fruit`/`fresh` on every annotated upload and save the ones that changed.
+
+    Uploads annotated before fresh and rotten labels shared a fruit name
+    (e.g. "freshapples" and "rottenapples" stored as two fruits) are fixed
+    in place; rebuild the rollups afterwards with `refresh_rollups(full=True)`.
+    Returns the number of uploads updated.
+    """
+    uploads = db.get_db(uri=uri, db_name=db_name).uploads
+    query = {"detected_info.fresh": {"$exists": True}}
+    last_id = None
+    updated = 0
+    while True:
+        page = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        docs = list(uploads.find(page, {"detected_info": 1}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            return updated
+        for doc in docs:
+            annotated = db.annotate_detections(doc["detected_info"])
+            if annotated != doc["detected_info"]:
+                uploads.update_one({"_id": doc["_id"]}, {"$set": {"detected_info": annotated}})
+                updated += 1
+        last_id = docs[-1]["_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain upload history rollups")
+    parser.add_argument("--refresh-rollups", action="store_true")
+    parser.add_argument("--full", action="store_true", help="rebuild every day instead of recent ones")
+    parser.add_argument("--backfill", action="store_true")
+    parser.add_argument("--reannotate", action="store_true",
+                        help="recompute stored fruit names and rebuild every day's rollup")
+    args = parser.parse_args()
+
+    if args.backfill:
+        print(f"Annotated {backfill_detection_fields()} uploads")
+    if args.reannotate:
+        print(f"Re-annotated {reannotate_detection_fields()} uploads")
+        args.full = True
+    if args.refresh_rollups or args.full:
+        start = time.perf_counter()
+        first = refresh_rollups(full=args.full)
+        print(f"Rolled up {'all days' if first is None else 'days from ' + first} "
+              f"in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
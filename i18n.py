@@ -0,0 +1,37 @@
+import os
+import json
+import functools
+
+# One JSON file per language in locales/: {"ui": {key: text}, "recipes": {fruit: {title, content}}}
+LOCALE_DIR = os.getenv("LOCALE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+DEFAULT_LANG = "en"
+LANG_OPTIONS = {"English": "en", "हिन्दी": "hi", "ગુજરાતી": "gu"}
+
+
+@functools.lru_cache(maxsize=None)
+def load_locale(lang):
+    """UI strings and recipes for `lang`, read once per process ({} sections if the file is missing)."""
+    try:
+        with open(os.path.join(LOCALE_DIR, f"{lang}.json"), encoding="utf-8") as fp:
+            data = json.load(fp)
+    except FileNotFoundError:
+        data = {}
+    return {"ui": data.get("ui", {}), "recipes": data.get("recipes", {})}
+
+
+def translate(lang, key, **kwargs):
+    """UI string `key` in `lang`, falling back to English, formatted with `kwargs`."""
+    text = load_locale(lang)["ui"].get(key)
+    if text is None:
+        text = load_locale(DEFAULT_LANG)["ui"].get(key, "")
+    if kwargs:
+        try:
+            return text.format(**kwargs)
+        except Exception:
+            return text
+    return text
+
+
+def recipe(lang, fruit):
+    """Recipe {title, content} for `fruit` in `lang`, falling back to English, or None."""
+    return load_locale(lang)["recipes"].get(fruit) or load_locale(DEFAULT_LANG)["recipes"].get(fruit)
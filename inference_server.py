@@ -0,0 +1,264 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+# Dynamic batching settings (override with env vars when deploying)
+SERVE_MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", "8"))
+SERVE_MAX_WAIT_MS = float(os.getenv("SERVE_MAX_WAIT_MS", "5"))
+SERVE_MAX_QUEUE = int(os.getenv("SERVE_MAX_QUEUE", "64"))
+SERVE_SUBMIT_TIMEOUT = float(os.getenv("SERVE_SUBMIT_TIMEOUT", "5"))
+# StreamClient retry delay while it has no prediction to fall back on (doubles up to the max)
+SERVE_RETRY_BACKOFF = float(os.getenv("SERVE_RETRY_BACKOFF", "0.01"))
+SERVE_RETRY_BACKOFF_MAX = float(os.getenv("SERVE_RETRY_BACKOFF_MAX", "0.2"))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_STREAM = 1
+PRIORITY_BACKGROUND = 2
+
+
+class Overloaded(RuntimeError):
+    """Raised (or set on a future) when a request is rejected or evicted by back-pressure."""
+
+
+class _Request:
+    __slots__ = ("image", "key", "priority", "future", "enqueued")
+
+    def __init__(self, image, key, priority):
+        self.image = image
+        self.key = key
+        self.priority = priority
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class InferenceServer:
+    """Single owner of `model.predict`, batching requests from every caller in the process.
+
+    Callers `submit()` one image and get a Future for its result. A worker
+    thread takes the highest-priority request, waits at most `max_wait_ms`
+    for more requests with the same predict arguments (conf, imgsz), and runs
+    them as one batch of up to `max_batch` images, so batches grow with load
+    and a lone request only pays the short wait.
+
+    Back-pressure: at most `max_queue` requests wait. When the queue is full a
+    new request evicts the newest queued request of a lower priority (its
+    future fails with Overloaded); otherwise the caller blocks up to `timeout`
+    seconds for room and then gets Overloaded.
+    """
+
+    def __init__(self, model, max_batch=SERVE_MAX_BATCH, max_wait_ms=SERVE_MAX_WAIT_MS,
+                 max_queue=SERVE_MAX_QUEUE):
+        self.model = model
+        self.names = model.names
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max(1, max_queue)
+        self.batches = 0
+        self.served = 0
+        self.evicted = 0
+        self.rejected = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="inference-server", daemon=True)
+        self._thread.start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, image, priority=PRIORITY_INTERACTIVE, conf=0.5, imgsz=640, timeout=SERVE_SUBMIT_TIMEOUT):
+        """Queue one image and return a Future resolving to its prediction."""
+        req = _Request(image, (conf, imgsz), priority)
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while len(self._heap) >= self.max_queue and not self._closed:
+                if self._evict_below(priority):
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.rejected += 1
+                    metrics.inc("fruit_serve_rejected_total", priority=priority)
+                    raise Overloaded(f"inference queue full ({self.max_queue} requests)")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise Overloaded("inference server is closed")
+            heapq.heappush(self._heap, (priority, next(self._seq), req))
+            metrics.set_gauge("fruit_serve_queue_depth", len(self._heap))
+            self._cond.notify_all()
+        return req.future
+
+    def predict(self, images, priority=PRIORITY_INTERACTIVE, conf=0.5, imgsz=640, timeout=None):
+        """Submit every image and wait for all results, returned in input order.
+
+        If any image is rejected, the ones already queued are cancelled before
+        Overloaded propagates, so nobody's batch slots go to unread results.
+        """
+        futures = []
+        try:
+            for img in images:
+                futures.append(self.submit(img, priority=priority, conf=conf, imgsz=imgsz))
+        except Overloaded:
+            for f in futures:
+                f.cancel()
+            self._drop_cancelled()
+            raise
+        return [f.result(timeout) for f in futures]
+
+    def try_predict(self, images, priority=PRIORITY_STREAM, conf=0.5, imgsz=640):
+        """Like `predict`, but an image that is rejected or evicted gets None instead of raising."""
+        futures = []
+        for img in images:
+            try:
+                futures.append(self.submit(img, priority=priority, conf=conf, imgsz=imgsz))
+            except Overloaded:
+                futures.append(None)
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result() if f is not None else None)
+            except Overloaded:
+                results.append(None)
+        return results
+
+    def _drop_cancelled(self):
+        """Remove cancelled requests from the queue, making room for waiting submitters."""
+        with self._cond:
+            self._heap = [item for item in self._heap if not item[2].future.cancelled()]
+            heapq.heapify(self._heap)
+            metrics.set_gauge("fruit_serve_queue_depth", len(self._heap))
+            self._cond.notify_all()
+
+    def _evict_below(self, priority):
+        """Drop the newest queued request with a lower priority than `priority`; True if one was found."""
+        victim = None
+        for i, (p, seq, _) in enumerate(self._heap):
+            if p > priority and (victim is None or (p, seq) > self._heap[victim][:2]):
+                victim = i
+        if victim is None:
+            return False
+        _, _, req = self._heap.pop(victim)
+        heapq.heapify(self._heap)
+        self.evicted += 1
+        metrics.inc("fruit_serve_evicted_total", priority=req.priority)
+        req.future.set_exception(Overloaded("evicted by a higher-priority request"))
+        return True
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._heap and not self._closed:
+                self._cond.wait()
+            if not self._heap:
+                return None
+            deadline = self._heap[0][2].enqueued + self.max_wait
+            while len(self._heap) < self.max_batch and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            key = self._heap[0][2].key
+            batch, other = [], []
+            while self._heap and len(batch) < self.max_batch:
+                item = heapq.heappop(self._heap)
+                if item[2].future.cancelled():
+                    continue
+                if item[2].key == key:
+                    batch.append(item[2])
+                else:
+                    other.append(item)
+            for item in other:
+                heapq.heappush(self._heap, item)
+            metrics.set_gauge("fruit_serve_queue_depth", len(self._heap))
+            self._cond.notify_all()  # room for blocked submitters
+        return [req for req in batch if req.future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            now = time.perf_counter()
+            for req in batch:
+                metrics.observe("serve_queue_wait", now - req.enqueued)
+            conf, imgsz = batch[0].key
+            try:
+                with metrics.timed("predict"):
+                    preds = self.model.predict([req.image for req in batch], conf=conf, imgsz=imgsz,
+                                               verbose=False)
+            except Exception as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            for req, pred in zip(batch, preds):
+                req.future.set_result(pred)
+            self.batches += 1
+            self.served += len(batch)
+            metrics.set_gauge("fruit_serve_batch_size", len(batch))
+
+    def close(self):
+        """Stop the worker; queued requests fail with Overloaded."""
+        with self._cond:
+            self._closed = True
+            pending, self._heap = self._heap, []
+            self._cond.notify_all()
+        for _, _, req in pending:
+            if req.future.set_running_or_notify_cancel():
+                req.future.set_exception(Overloaded("inference server is closed"))
+        self._thread.join(2.0)
+
+    def snapshot(self):
+        with self._cond:
+            depth = len(self._heap)
+        return {
+            "queue_depth": depth,
+            "batches": self.batches,
+            "served": self.served,
+            "mean_batch": round(self.served / self.batches, 2) if self.batches else 0.0,
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+        }
+
+
+class StreamClient:
+    """Frame-at-a-time `infer(frame)` for camera loops, submitted at stream priority.
+
+    When a frame is evicted or rejected in favour of interactive requests the
+    previous prediction is returned, so the overlay just lags a frame instead
+    of the camera loop failing. Before the first prediction there is nothing
+    to fall back on, so the frame is retried with an exponential backoff
+    (`backoff` doubling up to `max_backoff` seconds) rather than straight away.
+    """
+
+    def __init__(self, server, priority=PRIORITY_STREAM, conf=0.5, imgsz=640,
+                 backoff=SERVE_RETRY_BACKOFF, max_backoff=SERVE_RETRY_BACKOFF_MAX):
+        self.server = server
+        self.priority = priority
+        self.conf = conf
+        self.imgsz = imgsz
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.last = None
+
+    def __call__(self, frame):
+        delay = self.backoff
+        while True:
+            try:
+                self.last = self.server.submit(frame, priority=self.priority, conf=self.conf,
+                                               imgsz=self.imgsz).result()
+                return self.last
+            except Overloaded:
+                if self.last is not None:
+                    return self.last
+                if self.server.closed:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
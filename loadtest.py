@@ -0,0 +1,332 @@
+"""Concurrent load test of the Streamlit upload flow, with local storage stand-ins.
+
+    python loadtest.py --concurrency 1 2 4 8 16 --resolutions 640x480 1920x1080 --output load/$(git rev-parse --short HEAD).json
+
+Every simulated user is a separate Streamlit session (an AppTest instance)
+running the real streamlit_app.py script in this process, so sessions share
+st.cache_resource (model, inference server, result cache, persistence
+queue) exactly like sessions on one server node. Each request "uploads" a
+fresh image through the single-upload path: decode, inference, recipe
+mapping and the write-behind save.
+
+Storage is local: MongoDB is mongomock (or a real server with --mongo uri,
+e.g. a throwaway local mongod), and db.upload_to_cloudinary is replaced by a
+fake that sleeps for --cloudinary-latency-ms. Uploads are only saved when
+something is detected, so use --images with real fruit photos to exercise
+the save path; synthetic images measure decode + inference only.
+
+For every (image size, concurrency) level the report has throughput,
+latency percentiles, CPU use, RSS, MongoDB connections and how long the
+write-behind queue took to drain. `--baseline` compares against an earlier
+report and exits non-zero when throughput or p99 regressed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import datetime
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+import db
+from i18n import DEFAULT_LANG, translate
+from benchmark import current_rss_mb, git_commit, load_inputs, peak_rss_mb, synthetic_jpeg, use_mongomock
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+UPLOAD_KEY = "_loadtest_upload"
+SERVER_BUSY = translate(DEFAULT_LANG, "server_busy")  # sessions run with the default language
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+RESOLUTIONS = ("640x480", "1920x1080")
+
+
+class FakeUpload:
+    """Just enough of streamlit's UploadedFile for the app's upload path."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.type = "image/jpeg"
+        self.size = len(data)
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def fake_file_uploader(label, *args, accept_multiple_files=False, **kwargs):
+    """Stand-in for st.file_uploader that returns the session's `UPLOAD_KEY` upload."""
+    item = streamlit.session_state.get(UPLOAD_KEY)
+    if item is None:
+        return [] if accept_multiple_files else None
+    upload = FakeUpload(*item)
+    return [upload] if accept_multiple_files else upload
+
+
+def fake_cloudinary(latency_s):
+    """Replacement for db.upload_to_cloudinary that waits `latency_s` and returns a plausible response."""
+    uploaded = []
+
+    def upload(raw_bytes, filename, cloud_name=None, api_key=None, api_secret=None):
+        time.sleep(latency_s)
+        uploaded.append(len(raw_bytes))
+        public_id = f"loadtest/{len(uploaded)}"
+        return {"public_id": public_id, "bytes": len(raw_bytes), "format": "jpg",
+                "secure_url": f"https://res.cloudinary.invalid/{public_id}.jpg"}
+
+    upload.uploaded = uploaded
+    return upload
+
+
+def cpu_seconds():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def mongo_connections(mongo):
+    """Open connections reported by the server, or the number of pooled clients for mongomock."""
+    if mongo == "uri":
+        try:
+            return db.get_client().admin.command("serverStatus")["connections"]["current"]
+        except Exception:
+            return None
+    return len(db._clients)
+
+
+def saved_uploads():
+    return db.get_db().uploads.count_documents({})
+
+
+class Session:
+    """One simulated user: an AppTest session that has loaded the page once."""
+
+    def __init__(self, timeout):
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.app.run()
+        self.saved = set()
+
+    def _note_saves(self):
+        # entries are evicted from the session cache, so collect queued ids after every run
+        cache = self.app.session_state["detection_cache"] if "detection_cache" in self.app.session_state else {}
+        for entry in cache.values():
+            if entry and entry.get("save_res"):
+                self.saved.add(str(entry["save_res"].get("_id")))
+
+    def upload(self, name, data):
+        """Run the script with `data` as the uploaded file; returns (seconds, error or None)."""
+        self.app.session_state[UPLOAD_KEY] = (name, data)
+        start = time.perf_counter()
+        try:
+            self.app.run()
+        except Exception as e:
+            return time.perf_counter() - start, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        if self.app.exception:
+            return elapsed, str(self.app.exception[0].value)
+        if any(w.value == SERVER_BUSY for w in self.app.warning):
+            # the inference server shed the request; the app asked the user to retry
+            return elapsed, "Overloaded: " + SERVER_BUSY
+        self._note_saves()
+        return elapsed, None
+
+
+def payloads(label, raw, width, height, unique):
+    """`make()` returning the bytes for the next request.
+
+    Unique payloads keep every upload a miss in the session, process and
+    MongoDB result caches: synthetic inputs are redrawn, sample images get a
+    per-request trailer after the JPEG/PNG end marker (ignored by decoders,
+    but it changes the content hash).
+    """
+    if not unique:
+        return lambda: raw
+    seq = itertools.count(1)  # shared across levels so no request repeats an earlier one
+    if label.startswith("synthetic_"):
+        return lambda: synthetic_jpeg(width, height, seed=next(seq))
+    return lambda: raw + f"loadtest-{next(seq)}".encode()
+
+
+def run_level(sessions, label, make, requests_per_user):
+    """Drive every session concurrently; returns (latencies, errors, wall seconds)."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(sessions) + 1)
+
+    def user(i, session):
+        barrier.wait()
+        for n in range(requests_per_user):
+            elapsed, error = session.upload(f"{label}-{i}-{n}.jpg", make())
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=user, args=(i, s), daemon=True) for i, s in enumerate(sessions)]
+    for th in threads:
+        th.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for th in threads:
+        th.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def wait_for_saves(expected, timeout):
+    """Seconds until `expected` uploads are in MongoDB (None if it didn't happen within `timeout`)."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if saved_uploads() >= expected:
+            return round(time.perf_counter() - start, 3)
+        time.sleep(0.05)
+    return None
+
+
+def knee(rows, slo_ms):
+    """Highest concurrency per input whose p99 stays within `slo_ms`."""
+    best = {}
+    for row in rows:
+        if row["p99_ms"] is not None and row["p99_ms"] <= slo_ms and not row["errors"]:
+            best[row["input"]] = max(best.get(row["input"], 0), row["concurrency"])
+    return best
+
+
+def compare(rows, baseline_path, tolerance):
+    """Regressions vs. a previous report: throughput down or p99 up by more than `tolerance`."""
+    with open(baseline_path, encoding="utf-8") as fp:
+        baseline = {(r["input"], r["concurrency"]): r for r in json.load(fp)["results"]}
+    regressions = []
+    for row in rows:
+        old = baseline.get((row["input"], row["concurrency"]))
+        if old is None or not old.get("throughput_per_s") or not row.get("throughput_per_s"):
+            continue
+        if row["throughput_per_s"] < old["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{row['input']} x{row['concurrency']}: throughput "
+                               f"{old['throughput_per_s']} -> {row['throughput_per_s']}/s")
+        if old.get("p99_ms") and row["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{row['input']} x{row['concurrency']}: p99 {old['p99_ms']} -> {row['p99_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Streamlit upload flow with concurrent sessions")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=list(CONCURRENCY_LEVELS))
+    parser.add_argument("--resolutions", nargs="*", default=list(RESOLUTIONS),
+                        help="synthetic image sizes as WxH")
+    parser.add_argument("--images", help="directory of real sample images to upload as well")
+    parser.add_argument("--requests", type=int, default=5, help="uploads per simulated user and level")
+    parser.add_argument("--repeat-image", action="store_true",
+                        help="upload the same bytes every time (measures the cached path)")
+    parser.add_argument("--weights", default=os.getenv("MODEL_PATH", "best1.pt"))
+    parser.add_argument("--mongo", choices=("mongomock", "uri"), default="mongomock",
+                        help="in-process mongomock, or the server at MONGO_URI (use a throwaway database)")
+    parser.add_argument("--cloudinary-latency-ms", type=float, default=150.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per script run")
+    parser.add_argument("--drain-timeout", type=float, default=60.0,
+                        help="seconds to wait for the write-behind queue after each level")
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p99 target used to find the knee")
+    parser.add_argument("--baseline", help="earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    # the app reads these when its modules are first imported by the first session
+    os.environ["MODEL_PATH"] = args.weights
+    os.environ.setdefault("PERSIST_JOURNAL_DIR", tempfile.mkdtemp(prefix="loadtest-journal-"))
+    if args.mongo == "mongomock":
+        use_mongomock()
+    fake = fake_cloudinary(args.cloudinary_latency_ms / 1000.0)
+    db.upload_to_cloudinary = fake
+    streamlit.file_uploader = fake_file_uploader
+
+    inputs = []
+    for label, raw in load_inputs(args.resolutions, args.images):
+        w, h = (int(v) for v in label.split("_", 1)[1].lower().split("x")) if label.startswith("synthetic_") else (0, 0)
+        inputs.append((label, payloads(label, raw, w, h, unique=not args.repeat_image)))
+
+    # first session loads the model and warms every shared resource
+    start = time.perf_counter()
+    warm = Session(args.timeout)
+    warm.upload("warmup.jpg", synthetic_jpeg(640, 480, seed=0))
+    print(f"Warm-up took {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    for label, make in inputs:
+        for concurrency in args.concurrency:
+            sessions = [Session(args.timeout) for _ in range(concurrency)]
+            saved_before = saved_uploads()
+            cpu_before = cpu_seconds()
+            latencies, errors, wall = run_level(sessions, label, make, args.requests)
+            cpu_after = cpu_seconds()
+            # only uploads with detections are saved; count what the sessions queued
+            queued = sum(len(s.saved) for s in sessions)
+            drain = wait_for_saves(saved_before + queued, args.drain_timeout) if queued else 0.0
+            ms = np.asarray(latencies) * 1000.0
+            row = {
+                "input": label,
+                "concurrency": concurrency,
+                "requests": len(latencies),
+                "errors": len(errors),
+                "throughput_per_s": round(len(latencies) / wall, 2) if wall > 0 else None,
+                "p50_ms": round(float(np.percentile(ms, 50)), 1) if len(ms) else None,
+                "p95_ms": round(float(np.percentile(ms, 95)), 1) if len(ms) else None,
+                "p99_ms": round(float(np.percentile(ms, 99)), 1) if len(ms) else None,
+                "cpu_cores": round((cpu_after - cpu_before) / wall, 2) if cpu_before is not None and wall > 0 else None,
+                "rss_mb": current_rss_mb(),
+                "process_peak_rss_mb": peak_rss_mb(),
+                "mongo_connections": mongo_connections(args.mongo),
+                "saved": queued,
+                "persist_drain_s": drain,
+                "first_error": errors[0] if errors else None,
+            }
+            rows.append(row)
+            print(f"{label:<22} x{concurrency:<3} {row['throughput_per_s'] or 0:>7.2f}/s "
+                  f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                  f"cpu={row['cpu_cores']} rss={row['rss_mb']}MB mongo={row['mongo_connections']} "
+                  f"errors={row['errors']} drain={drain}s")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "cpu_count": os.cpu_count(),
+            "weights": args.weights,
+            "mongo": args.mongo,
+            "cloudinary_latency_ms": args.cloudinary_latency_ms,
+            "requests_per_user": args.requests,
+            "repeat_image": args.repeat_image,
+            "slo_ms": args.slo_ms,
+            "fake_cloudinary_uploads": len(fake.uploaded),
+        },
+        "results": rows,
+        "knee": knee(rows, args.slo_ms),
+    }
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"Max concurrency within p99 <= {args.slo_ms:.0f}ms: {report['knee']}")
+    print(f"Wrote {len(rows)} results to {args.output}")
+
+    if args.baseline:
+        regressions = compare(rows, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
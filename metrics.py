@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentation is off unless METRICS_ENABLED=1; when off every hook is a no-op
+ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOOP = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_server = None
+
+
+class Histogram:
+    """Cumulative latency histogram with Prometheus-style buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket containing it."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def observe(stage, seconds):
+    """Record one `stage` latency sample (seconds)."""
+    if not ENABLED:
+        return
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = Histogram()
+        hist.observe(seconds)
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timed(stage):
+    """Context manager timing its block into the `stage` histogram."""
+    if not ENABLED:
+        return _NOOP
+    return _Timer(stage)
+
+
+def inc(name, n=1, **labels):
+    if not ENABLED or not n:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def record_pipeline(pipe, source="webcam"):
+    """Publish a FramePipeline's FPS, latency and dropped frame counts as gauges."""
+    if not ENABLED:
+        return
+    for stage, s in pipe.snapshot().items():
+        set_gauge("fruit_pipeline_fps", s["fps"], source=source, stage=stage)
+        set_gauge("fruit_pipeline_latency_ms", s["latency_ms"], source=source, stage=stage)
+        set_gauge("fruit_pipeline_dropped_frames", s["dropped"], source=source, stage=stage)
+    ring = getattr(pipe, "ring", None)
+    if ring is not None:
+        # stays flat once the ring is warm; growth means frames are being reallocated
+        set_gauge("fruit_frame_buffer_allocations", ring.allocations, source=source)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render_prometheus():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = ["# TYPE fruit_stage_seconds histogram"]
+    with _lock:
+        for stage, hist in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f'fruit_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'fruit_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+            lines.append(f'fruit_stage_seconds_sum{{stage="{stage}"}} {hist.sum}')
+            lines.append(f'fruit_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+        typed = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """{stage: {count, mean_ms, p50_ms, p95_ms}} for display (e.g. the Streamlit sidebar)."""
+    with _lock:
+        return {
+            stage: {
+                "count": hist.count,
+                "mean_ms": round(1000.0 * hist.sum / hist.count, 2) if hist.count else 0.0,
+                "p50_ms": 1000.0 * hist.quantile(0.5),
+                "p95_ms": 1000.0 * hist.quantile(0.95),
+            }
+            for stage, hist in sorted(_histograms.items())
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve /metrics on `port` from a daemon thread. Safe to call more than once."""
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
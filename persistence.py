@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import queue
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+
+# Write-behind settings (override with env vars when deploying)
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "256"))
+PERSIST_WORKERS = int(os.getenv("PERSIST_WORKERS", "4"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "32"))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.5"))
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "4"))
+PERSIST_BACKOFF = float(os.getenv("PERSIST_BACKOFF", "0.5"))
+PERSIST_JOURNAL_DIR = os.getenv("PERSIST_JOURNAL_DIR", "persist_journal")
+PERSIST_REPLAY_INTERVAL = float(os.getenv("PERSIST_REPLAY_INTERVAL", "30"))
+
+DUPLICATE_KEY = 11000
+
+
+# bson/pymongo are imported where they are used, so importing this module stays cheap
+def _json_default(value):
+    from bson import ObjectId
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+def _json_hook(obj):
+    from bson import ObjectId
+    if set(obj) == {"$oid"}:
+        return ObjectId(obj["$oid"])
+    if set(obj) == {"$date"}:
+        return datetime.datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+class PersistenceQueue:
+    """Background write-behind persistence for uploads.
+
+    `submit()` returns immediately with the metadata document (its `_id` is
+    assigned up front) and the actual work happens on a dispatcher thread:
+    blobs go to Cloudinary/GridFS concurrently on a thread pool, then the
+    metadata of each batch is written with one `insert_many`. Every step is
+    retried with exponential backoff. Jobs that still fail, or that arrive
+    while the queue is full, are spilled to a journal directory (`<id>.json`
+    plus `<id>.bin` when the blob has not been stored yet) and picked up again
+    by `replay_journal()`, which the dispatcher also calls every
+    `replay_interval` seconds while it is idle, so spilled uploads are saved
+    once the backend recovers.
+    """
+
+    def __init__(self, uri=None, db_name=None, maxsize=PERSIST_QUEUE_SIZE, workers=PERSIST_WORKERS,
+                 batch_size=PERSIST_BATCH_SIZE, flush_interval=PERSIST_FLUSH_INTERVAL,
+                 max_retries=PERSIST_MAX_RETRIES, backoff=PERSIST_BACKOFF, journal_dir=PERSIST_JOURNAL_DIR,
+                 replay_interval=PERSIST_REPLAY_INTERVAL):
+        self.uri = uri
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.journal_dir = journal_dir
+        self.replay_interval = replay_interval
+        self.stats = {"submitted": 0, "persisted": 0, "spilled": 0, "replayed": 0}
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="persist")
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="persist-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout=10.0):
+        """Stop accepting work, drain what is queued and spill anything left over."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        while True:
+            try:
+                self._spill(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._pool.shutdown(wait=True)
+
+    def submit(self, raw_bytes, filename, chosen_fruit, detected_info, cloudinary_config=None):
+        """Queue an upload for saving and return its metadata document without waiting."""
+        from bson import ObjectId
+        meta = db.build_upload_doc(filename, chosen_fruit, detected_info)
+        meta["_id"] = ObjectId()
+        job = {"meta": meta, "raw_bytes": raw_bytes, "cloudinary_config": cloudinary_config}
+        self._count("submitted")
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._spill(job)
+        return meta
+
+    def pending(self):
+        return self._queue.qsize()
+
+    # -- dispatcher -------------------------------------------------------
+
+    def _run(self):
+        last_replay = time.monotonic()
+        while not (self._stop.is_set() and self._queue.empty()):
+            jobs = self._next_batch()
+            if jobs:
+                self._process(jobs)
+            elif not self._stop.is_set() and time.monotonic() - last_replay >= self.replay_interval:
+                # idle: retry whatever was spilled while the backend was down
+                last_replay = time.monotonic()
+                try:
+                    self.replay_journal()
+                except OSError:
+                    pass
+
+    def _next_batch(self):
+        try:
+            jobs = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(jobs) < self.batch_size:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _retry(self, fn):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def _store_blob(self, job):
+        if job["raw_bytes"] is None:
+            # blob already stored (replayed metadata-only job)
+            return
+        meta = job["meta"]
+        blob = self._retry(lambda: db.store_blob(
+            job["raw_bytes"], meta["filename"], uri=self.uri, db_name=self.db_name,
+            cloudinary_config=job["cloudinary_config"]))
+        meta.update(blob)
+        job["raw_bytes"] = None
+
+    def _insert(self, docs):
+        from pymongo.errors import BulkWriteError
+        try:
+            with metrics.timed("insert_many"):
+                db.get_db(uri=self.uri, db_name=self.db_name).uploads.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # a retried batch may already be partly written; duplicates are fine
+            if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+                raise
+
+    def _process(self, jobs):
+        futures = [(job, self._pool.submit(self._store_blob, job)) for job in jobs]
+        stored = []
+        for job, fut in futures:
+            try:
+                fut.result()
+                stored.append(job)
+            except Exception:
+                self._spill(job)
+        if not stored:
+            return
+        try:
+            self._retry(lambda: self._insert([job["meta"] for job in stored]))
+            self._count("persisted", len(stored))
+        except Exception:
+            for job in stored:
+                self._spill(job)
+
+    # -- journal ----------------------------------------------------------
+
+    def _spill(self, job):
+        meta = job["meta"]
+        base = os.path.join(self.journal_dir, str(meta["_id"]))
+        with self._journal_lock:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            if job["raw_bytes"] is not None:
+                with open(base + ".bin", "wb") as fp:
+                    fp.write(job["raw_bytes"])
+            # credentials are not written to disk; replayed blobs use the CLOUDINARY_* env vars or GridFS
+            record = {"meta": meta}
+            tmp = base + ".json.tmp"
+            with open(tmp, "w", encoding="utf-8") as fp:
+                json.dump(record, fp, default=_json_default)
+            os.replace(tmp, base + ".json")
+        self._count("spilled")
+        metrics.inc("fruit_persist_spilled_total")
+
+    def replay_journal(self):
+        """Re-queue every spilled job. Returns the number of jobs replayed."""
+        if not os.path.isdir(self.journal_dir):
+            return 0
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(".json"):
+                continue
+            base = os.path.join(self.journal_dir, name[:-len(".json")])
+            with self._journal_lock:
+                with open(base + ".json", encoding="utf-8") as fp:
+                    record = json.load(fp, object_hook=_json_hook)
+                raw_bytes = None
+                if os.path.exists(base + ".bin"):
+                    with open(base + ".bin", "rb") as fp:
+                        raw_bytes = fp.read()
+                    os.remove(base + ".bin")
+                os.remove(base + ".json")
+            job = {"meta": record["meta"], "raw_bytes": raw_bytes, "cloudinary_config": None}
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._spill(job)
+                break
+            replayed += 1
+        self._count("replayed", replayed)
+        return replayed
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["pending"] = self.pending()
+        return stats
@@ -0,0 +1,479 @@
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+def put_latest(q, item, on_drop=None):
+    """Put `item` on a bounded queue, discarding the oldest entries if it is full.
+
+    Each discarded entry is passed to `on_drop`, if given. Returns the number
+    of entries that were dropped to make room.
+    """
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stale = q.get_nowait()
+                dropped += 1
+                if on_drop is not None:
+                    on_drop(stale)
+            except queue.Empty:
+                pass
+
+
+class FrameRing:
+    """Preallocated frame buffers reused by a capture loop.
+
+    `read(cap)` decodes straight into a free buffer (via a scratch buffer
+    and `cv2.flip(dst=...)` when mirroring), so a steady stream allocates
+    nothing per frame. A buffer stays out of the ring until whoever holds the
+    frame calls `release(frame)`; when every buffer is still in use
+    `available()` is False and the capture loop should drop the frame
+    (`cap.grab()`) rather than read, so a frame is never overwritten while a
+    later stage still reads it.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.allocations = 0
+        self._buffers = [None] * self.size
+        self._scratch = None
+        self._free = collections.deque(range(self.size))
+        self._lock = threading.Lock()
+
+    def available(self):
+        with self._lock:
+            return bool(self._free)
+
+    def release(self, frame):
+        """Return the buffer holding `frame` to the ring; frames not from this ring are ignored."""
+        with self._lock:
+            for i, buf in enumerate(self._buffers):
+                if buf is frame and i not in self._free:
+                    self._free.append(i)
+                    return
+
+    def _read(self, cap, buf):
+        ret, frame = cap.read(buf) if buf is not None else cap.read()
+        if ret and frame is not buf:
+            # first frame or the stream changed size: OpenCV allocated a new array
+            self.allocations += 1
+        return ret, frame
+
+    def read(self, cap, flip=False):
+        """Return the next frame from `cap` in a free buffer, or None when the read fails.
+
+        Raises RuntimeError if every buffer is still held; check `available()` first.
+        """
+        with self._lock:
+            if not self._free:
+                raise RuntimeError("no free frame buffer")
+            i = self._free.popleft()
+        frame = self._read_into(cap, i, flip)
+        if frame is None:
+            with self._lock:
+                self._free.appendleft(i)
+        return frame
+
+    def _read_into(self, cap, i, flip):
+        if not flip:
+            ret, frame = self._read(cap, self._buffers[i])
+            if not ret:
+                return None
+            self._buffers[i] = frame
+            return frame
+        ret, raw = self._read(cap, self._scratch)
+        if not ret:
+            return None
+        self._scratch = raw
+        dst = self._buffers[i]
+        if dst is None or dst.shape != raw.shape:
+            dst = np.empty_like(raw)
+            self.allocations += 1
+        self._buffers[i] = cv2.flip(raw, 1, dst=dst)
+        return self._buffers[i]
+
+
+class StageStats:
+    """Thread-safe FPS / latency counters for one pipeline stage."""
+
+    def __init__(self, smoothing=0.9):
+        self.smoothing = smoothing
+        self.count = 0
+        self.dropped = 0
+        self.fps = 0.0
+        self.latency_ms = 0.0
+        self._last = None
+        self._lock = threading.Lock()
+
+    def record(self, latency_s):
+        now = time.perf_counter()
+        with self._lock:
+            self.count += 1
+            a = self.smoothing
+            if self._last is not None:
+                interval = now - self._last
+                if interval > 0:
+                    fps = 1.0 / interval
+                    self.fps = fps if self.count == 2 else a * self.fps + (1 - a) * fps
+            self._last = now
+            ms = latency_s * 1000.0
+            self.latency_ms = ms if self.count == 1 else a * self.latency_ms + (1 - a) * ms
+
+    def add_dropped(self, n):
+        if n:
+            with self._lock:
+                self.dropped += n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "dropped": self.dropped,
+                "fps": round(self.fps, 1),
+                "latency_ms": round(self.latency_ms, 1),
+            }
+
+
+class FramePipeline:
+    """Capture -> inference -> render pipeline for live camera streams.
+
+    A capture thread keeps only the newest frame, an inference thread runs
+    `infer(frame)` on whatever frame is newest when it becomes free, and the
+    caller renders results from `results()` on its own thread (Streamlit and
+    cv2.imshow both need the main thread). Stages are joined by queues of size
+    `queue_size` that drop stale entries instead of blocking, so the overlay
+    always tracks the live scene.
+
+    Each yielded packet is a dict with `frame`, `pred`, `captured_at` and
+    `inferred_at` (time.perf_counter() timestamps). Frames live in a
+    FrameRing: a packet's buffer goes back to the ring when the packet is
+    dropped or when the caller asks for the next packet, and while every
+    buffer is in use the capture thread drops camera frames instead.
+    """
+
+    STAGES = ("capture", "inference", "render", "end_to_end")
+
+    def __init__(self, cap, infer, flip=True, queue_size=1):
+        self.cap = cap
+        self.infer = infer
+        self.flip = flip
+        # alive at once: one being captured, queue_size queued, one in inference,
+        # queue_size waiting for the renderer and one being rendered
+        self.ring = FrameRing(2 * queue_size + 3)
+        self.stats = {name: StageStats() for name in self.STAGES}
+        self.error = None
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._out = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+        ]
+        for th in self._threads:
+            th.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for th in self._threads:
+            th.join(timeout)
+        self._threads = []
+
+    def _release(self, packet):
+        self.ring.release(packet["frame"])
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            if not self.ring.available():
+                # every buffer is still queued, inferred or rendered: skip this camera frame
+                if not self.cap.grab():
+                    self.error = "capture failed"
+                    self._stop.set()
+                    break
+                self.stats["capture"].add_dropped(1)
+                metrics.inc("fruit_frames_dropped_total", stage="capture")
+                continue
+            frame = self.ring.read(self.cap, self.flip)
+            if frame is None:
+                self.error = "capture failed"
+                self._stop.set()
+                break
+            now = time.perf_counter()
+            self.stats["capture"].record(now - start)
+            dropped = put_latest(self._frames, {"frame": frame, "captured_at": now}, self._release)
+            self.stats["capture"].add_dropped(dropped)
+            metrics.inc("fruit_frames_dropped_total", dropped, stage="capture")
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            try:
+                packet = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                packet["pred"] = self.infer(packet["frame"])
+            except Exception as e:
+                self.error = f"inference failed: {e}"
+                self._stop.set()
+                break
+            packet["inferred_at"] = time.perf_counter()
+            self.stats["inference"].record(packet["inferred_at"] - start)
+            dropped = put_latest(self._out, packet, self._release)
+            self.stats["inference"].add_dropped(dropped)
+            metrics.inc("fruit_frames_dropped_total", dropped, stage="inference")
+
+    def results(self, timeout=0.1):
+        """Yield inference packets, newest first, until the pipeline stops.
+
+        Render time and end-to-end latency are recorded when the caller asks
+        for the next packet, so they include whatever the caller did with it.
+        The packet's frame is reused after that, so keep a copy if it must
+        outlive the loop iteration.
+        """
+        while self.running or not self._out.empty():
+            try:
+                packet = self._out.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            yield packet
+            now = time.perf_counter()
+            self._release(packet)
+            self.stats["render"].record(now - start)
+            self.stats["end_to_end"].record(now - packet["captured_at"])
+
+    def snapshot(self):
+        """Return a {stage: {count, dropped, fps, latency_ms}} dict."""
+        return {name: s.snapshot() for name, s in self.stats.items()}
+
+
+def format_stats(snapshot):
+    """One-line human readable summary of `FramePipeline.snapshot()`."""
+    return " | ".join(
+        f"{name}: {s['fps']:.1f} fps, {s['latency_ms']:.0f} ms" for name, s in snapshot.items()
+    )
+
+
+def open_source(source, device_api=None):
+    """cv2.VideoCapture for a device index (int or digit string) or a video file / stream URL."""
+    if isinstance(source, int) or str(source).isdigit():
+        if device_api is None:
+            return cv2.VideoCapture(int(source))
+        return cv2.VideoCapture(int(source), device_api)
+    return cv2.VideoCapture(str(source))
+
+
+class _Source:
+    """Capture state and stats for one MultiCameraPipeline input."""
+
+    def __init__(self, name, cap, gate=None, realtime=True, queue_size=1):
+        self.name = name
+        self.cap = cap
+        self.gate = gate
+        # held at once: the latest slot, one in inference, queue_size ticks
+        # waiting for the renderer and one being rendered, plus one spare to capture into
+        self.ring = FrameRing(queue_size + 4)
+        self.stats = {stage: StageStats() for stage in MultiCameraPipeline.STAGES}
+        self.frame = None
+        self.captured_at = None
+        self.seq = 0
+        self.consumed = 0
+        self.last_pred = None
+        self.done = False
+        # video files are read at their own frame rate, like a camera, instead of as fast as possible
+        is_file = cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        fps = cap.get(cv2.CAP_PROP_FPS) if realtime and is_file else 0
+        self.interval = 1.0 / fps if fps and fps > 0 else 0.0
+
+    def snapshot(self):
+        return {stage: s.snapshot() for stage, s in self.stats.items()}
+
+
+class MultiCameraPipeline:
+    """Several cameras or video files sharing one model, with one batched predict per tick.
+
+    Each source gets a capture thread that keeps only its newest frame. The
+    inference thread wakes when any source has a new frame, takes the newest
+    frame of every source that has one and passes them to
+    `predict_batch(frames)` in a single call, so N cameras cost one model and
+    one predict call per tick instead of N competing loops. With `gates` (one
+    MotionGate or None per source) a static source reuses its last prediction
+    and is left out of the batch. `predict_batch` may return None for a frame
+    it could not run (e.g. the inference server shed it); the source then
+    keeps its previous prediction.
+
+    `results()` yields one list of packets per tick; each packet is a dict
+    with `source` (index), `name`, `frame`, `pred`, `captured_at` and
+    `inferred_at`; `pred` is None until the source's first prediction. The
+    pipeline stops when every source has ended.
+    """
+
+    STAGES = ("capture", "inference", "end_to_end")
+
+    def __init__(self, caps, predict_batch, names=None, gates=None, flip=False, realtime=True,
+                 queue_size=1):
+        names = names or [str(i) for i in range(len(caps))]
+        gates = gates or [None] * len(caps)
+        self.sources = [_Source(n, c, g, realtime, queue_size) for n, c, g in zip(names, caps, gates)]
+        self.predict_batch = predict_batch
+        self.flip = flip
+        self.batch = StageStats()
+        self.error = None
+        self._out = queue.Queue(maxsize=queue_size)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._capture_loop, args=(src,), name=f"capture-{src.name}",
+                                          daemon=True) for src in self.sources]
+        self._threads.append(threading.Thread(target=self._inference_loop, name="inference", daemon=True))
+        for th in self._threads:
+            th.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for th in self._threads:
+            th.join(timeout)
+        self._threads = []
+
+    def _capture_loop(self, src):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            if not src.ring.available():
+                # every buffer is still in inference or waiting to be rendered: skip this frame
+                if not src.cap.grab():
+                    break
+                src.stats["capture"].add_dropped(1)
+                metrics.inc("fruit_frames_dropped_total", stage="capture", source=src.name)
+                if src.interval:
+                    time.sleep(max(0.0, src.interval - (time.perf_counter() - start)))
+                continue
+            frame = src.ring.read(src.cap, self.flip)
+            if frame is None:
+                break
+            now = time.perf_counter()
+            src.stats["capture"].record(now - start)
+            with self._cond:
+                if src.seq > src.consumed:
+                    # the previous frame was never taken by inference
+                    src.ring.release(src.frame)
+                    src.stats["capture"].add_dropped(1)
+                    metrics.inc("fruit_frames_dropped_total", stage="capture", source=src.name)
+                src.frame, src.captured_at = frame, now
+                src.seq += 1
+                self._cond.notify_all()
+            if src.interval:
+                time.sleep(max(0.0, src.interval - (time.perf_counter() - start)))
+        with self._cond:
+            src.done = True
+            self._cond.notify_all()
+
+    def _take_ready(self):
+        """Newest unconsumed frame of every source, or None once all sources have ended."""
+        with self._cond:
+            while not self._stop.is_set():
+                ready = [src for src in self.sources if src.seq > src.consumed]
+                if ready:
+                    for src in ready:
+                        src.consumed = src.seq
+                    return [(src, src.frame, src.captured_at) for src in ready]
+                if all(src.done for src in self.sources):
+                    return None
+                self._cond.wait(0.1)
+        return None
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            taken = self._take_ready()
+            if taken is None:
+                break
+            # the gate only moves its reference once the frame's prediction comes back
+            todo = [(src, frame) for src, frame, _ in taken
+                    if src.gate is None or src.gate.should_infer(frame, commit=False)]
+            start = time.perf_counter()
+            if todo:
+                try:
+                    preds = self.predict_batch([frame for _, frame in todo])
+                except Exception as e:
+                    self.error = f"inference failed: {e}"
+                    break
+                for (src, _), pred in zip(todo, preds):
+                    if pred is not None:
+                        src.last_pred = pred
+                        if src.gate is not None:
+                            src.gate.mark_inferred()
+                self.batch.record(time.perf_counter() - start)
+                metrics.set_gauge("fruit_multicam_batch_size", len(todo))
+            now = time.perf_counter()
+            packets = []
+            for src, frame, captured_at in taken:
+                src.stats["inference"].record(now - start)
+                packets.append({"source": self.sources.index(src), "name": src.name, "frame": frame,
+                                "pred": src.last_pred, "captured_at": captured_at, "inferred_at": now})
+            dropped = put_latest(self._out, packets, self._release)
+            self.batch.add_dropped(dropped)
+            metrics.inc("fruit_frames_dropped_total", dropped, stage="inference")
+        self._stop.set()
+
+    def _release(self, packets):
+        for packet in packets:
+            self.sources[packet["source"]].ring.release(packet["frame"])
+
+    def results(self, timeout=0.1):
+        """Yield one list of packets per inference tick until the pipeline stops.
+
+        The frames go back to their source's ring when the caller asks for the
+        next tick, so keep a copy if one must outlive the loop iteration.
+        """
+        while self.running or not self._out.empty():
+            try:
+                packets = self._out.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            yield packets
+            now = time.perf_counter()
+            self._release(packets)
+            for packet in packets:
+                self.sources[packet["source"]].stats["end_to_end"].record(now - packet["captured_at"])
+
+    def snapshot(self):
+        """{source name: {stage: {count, dropped, fps, latency_ms}}}, plus the shared `batch` stage."""
+        snap = {src.name: src.snapshot() for src in self.sources}
+        snap["batch"] = {"predict": self.batch.snapshot()}
+        return snap
+
+    def record_metrics(self):
+        for src in self.sources:
+            metrics.record_pipeline(src, source=src.name)
+
+
+def format_multi_stats(snapshot):
+    """Multi-line summary of `MultiCameraPipeline.snapshot()`, one line per source."""
+    return "\n".join(f"[{name}] {format_stats(stages)}" for name, stages in snapshot.items())
@@ -0,0 +1,125 @@
+import struct
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Decode flags for each supported reduction factor
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+LETTERBOX_COLOR = (114, 114, 114)
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic variants)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_image_size(raw_bytes):
+    """Return (width, height) from a JPEG or PNG header without decoding, or None."""
+    if raw_bytes[:8] == b"\x89PNG\r\n\x1a\n" and len(raw_bytes) >= 24:
+        return struct.unpack(">II", raw_bytes[16:24])
+    if raw_bytes[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    n = len(raw_bytes)
+    while i + 9 < n:
+        if raw_bytes[i] != 0xFF:
+            i += 1
+            continue
+        marker = raw_bytes[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            h, w = struct.unpack(">HH", raw_bytes[i + 5:i + 9])
+            return w, h
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", raw_bytes[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+
+def choose_reduction(size, target=640):
+    """Largest reduction factor (1/2/4/8) that keeps the longer side >= `target`."""
+    if size is None:
+        return 1
+    longest = max(size)
+    factor = 1
+    for f in (2, 4, 8):
+        if longest // f >= target:
+            factor = f
+    return factor
+
+
+def decode_reduced(raw_bytes, target=640):
+    """Decode image bytes at the smallest resolution still at least `target` on the long side.
+
+    JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale by libjpeg, which skips
+    most of the work of a full decode. Returns (bgr_frame, factor) where
+    original coordinates = frame coordinates * factor, or (None, 1) if the
+    bytes can't be decoded.
+    """
+    buf = np.frombuffer(raw_bytes, dtype=np.uint8)
+    factor = choose_reduction(read_image_size(raw_bytes), target)
+    with metrics.timed("decode"):
+        frame = cv2.imdecode(buf, REDUCED_FLAGS[factor])
+        if frame is None and factor != 1:
+            factor = 1
+            frame = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    return frame, factor
+
+
+def letterbox(frame, size=640, color=LETTERBOX_COLOR):
+    """Resize `frame` to fit a `size` x `size` square keeping its aspect ratio, padding the rest.
+
+    Returns (padded, ratio, (pad_x, pad_y)).
+    """
+    h, w = frame.shape[:2]
+    ratio = min(size / h, size / w)
+    nw, nh = int(round(w * ratio)), int(round(h * ratio))
+    with metrics.timed("resize"):
+        if (nw, nh) != (w, h):
+            interp = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+            frame = cv2.resize(frame, (nw, nh), interpolation=interp)
+        pad_x = (size - nw) // 2
+        pad_y = (size - nh) // 2
+        padded = cv2.copyMakeBorder(frame, pad_y, size - nh - pad_y, pad_x, size - nw - pad_x,
+                                    cv2.BORDER_CONSTANT, value=color)
+    return padded, ratio, (pad_x, pad_y)
+
+
+def unletterbox_boxes(xyxy, ratio, pad, shape):
+    """Map (N, 4) boxes from letterboxed model input back onto the frame passed to `letterbox`.
+
+    `shape` is that frame's (height, width); boxes are clipped to it.
+    """
+    out = np.asarray(xyxy, dtype=np.float32).copy()
+    out[:, [0, 2]] -= pad[0]
+    out[:, [1, 3]] -= pad[1]
+    out /= ratio
+    h, w = shape[:2]
+    out[:, [0, 2]] = out[:, [0, 2]].clip(0, w)
+    out[:, [1, 3]] = out[:, [1, 3]].clip(0, h)
+    return out
+
+
+def preprocess_upload(raw_bytes, size=640):
+    """Reduced decode + letterbox for an uploaded image.
+
+    Returns a dict with `frame` (reduced BGR image, used for display), `input`
+    (letterboxed BGR model input), `ratio`, `pad` and `factor`, or None if the
+    bytes can't be decoded. No full-resolution copy is ever made for JPEGs
+    larger than 2x the model size.
+    """
+    frame, factor = decode_reduced(raw_bytes, target=size)
+    if frame is None:
+        return None
+    model_input, ratio, pad = letterbox(frame, size)
+    return {"frame": frame, "input": model_input, "ratio": ratio, "pad": pad, "factor": factor}
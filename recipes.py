@@ -0,0 +1,95 @@
+import re
+import difflib
+import functools
+
+from i18n import DEFAULT_LANG, load_locale
+
+# Recipe database (extend locales/en.json; translations live in locales/<lang>.json)
+RECIPES = load_locale(DEFAULT_LANG)["recipes"]
+
+def extract_fruit_name(label: str) -> str:
+    """Normalize model label to a fruit name key used in RECIPES."""
+    s = label.lower()
+    s = s.replace("_", " ")
+    # remove words indicating freshness
+    s = re.sub(r"\b(fresh|rotten|ripe|unripe|good|bad)\b", "", s)
+    s = re.sub(r"[^a-z\s]", "", s)
+    s = s.strip()
+    # if label contains multiple words, pick the last as likely fruit (common model patterns)
+    parts = s.split()
+    if len(parts) == 0:
+        return ""
+    # try to find a known fruit in parts
+    for p in parts:
+        if p in RECIPES:
+            return p
+    # fallback to last token
+    return parts[-1]
+
+
+_FRESHNESS_PREFIX = re.compile(r"^\s*(fresh|rotten)[\s_-]*")
+
+
+@functools.lru_cache(maxsize=256)
+def fruit_key(label: str) -> str:
+    """Fruit a label is about, the same for its fresh and rotten variants.
+
+    Glued labels like "freshapples"/"rottenapples" defeat the word-boundary
+    match in `extract_fruit_name`, so the fresh/rotten prefix is stripped
+    first; the rest goes through `match_recipe`, falling back to the
+    normalized name for fruits without a recipe.
+    """
+    name = _FRESHNESS_PREFIX.sub("", label.lower())
+    return match_recipe(name) or extract_fruit_name(name)
+
+
+def match_recipe(label: str):
+    """Map a single model label to a recipe key, or None.
+
+    Tries, in order: the normalized label as an exact key, any key that is a
+    substring of the label, a fuzzy match of the whole label, and a fuzzy match
+    of each token.
+    """
+    label = label.lower()
+    keys = list(RECIPES.keys())
+    name = extract_fruit_name(label)
+    if name in RECIPES:
+        return name
+    # substring
+    for k in keys:
+        if k in label:
+            return k
+    # fuzzy match against full label
+    match = difflib.get_close_matches(label, keys, n=1, cutoff=0.6)
+    if match:
+        return match[0]
+    # try tokens
+    for token in label.split():
+        match = difflib.get_close_matches(token, keys, n=1, cutoff=0.7)
+        if match:
+            return match[0]
+    return None
+
+
+def auto_map_fruit(detected_info, conf_thresh=0.3):
+    """Try to auto-map model detections to a known recipe key.
+
+    Checks detections in order of decreasing confidence with `match_recipe`
+    and returns the first reasonable match or None. For per-frame use prefer
+    `ClassIndex.auto_map` (class_index.py), which precomputes the matches.
+    """
+    if not detected_info:
+        return None
+
+    # sort by confidence desc
+    items = sorted(detected_info, key=lambda x: x.get("conf", 0), reverse=True)
+
+    for it in items:
+        conf = float(it.get("conf", 0))
+        if conf < conf_thresh:
+            continue
+        match = match_recipe(it.get("label", ""))
+        if match:
+            return match
+
+    return None
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import db
+
+
+def encode_result(xyxy, cls, conf, names):
+    """Pack detection arrays into a plain dict that MongoDB can store."""
+    items = names.items() if isinstance(names, dict) else enumerate(names)
+    return {
+        "xyxy": np.asarray(xyxy).tolist(),
+        "cls": np.asarray(cls).tolist(),
+        "conf": np.asarray(conf).tolist(),
+        "names": {str(k): v for k, v in items},
+    }
+
+
+def decode_result(doc):
+    """Inverse of `encode_result`: returns (xyxy, cls, conf, names)."""
+    xyxy = np.asarray(doc["xyxy"], dtype=np.float32).reshape(-1, 4)
+    cls = np.asarray(doc["cls"], dtype=np.int64)
+    conf = np.asarray(doc["conf"], dtype=np.float32)
+    names = {int(k): v for k, v in doc["names"].items()}
+    return xyxy, cls, conf, names
+
+
+class ResultCache:
+    """Process-wide inference result cache with LRU + TTL eviction.
+
+    Keys are content-addressed (see `detection_key` in streamlit_app.py) so the
+    same image uploaded from different sessions shares one entry. Values are
+    `encode_result` dicts. With `persistent=True` misses fall through to the
+    `inference_cache` collection in MongoDB and hits there are promoted into
+    memory; database errors are counted and otherwise ignored.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, persistent=False, uri=None, db_name=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.uri = uri
+        self.db_name = db_name
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_memory(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, *names):
+        # sessions and server threads share one cache, so counters are updated under the lock
+        with self._lock:
+            for name in names:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        value = self._get_memory(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        if self.persistent:
+            try:
+                value = db.get_cached_result(key, uri=self.uri, db_name=self.db_name)
+            except Exception:
+                self._count("errors")
+                value = None
+            if value is not None:
+                value.pop("_id", None)
+                value.pop("created_at", None)
+                self._put_memory(key, value)
+                self._count("hits", "persistent_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def put(self, key, value):
+        self._put_memory(key, value)
+        if self.persistent:
+            try:
+                db.put_cached_result(key, value, ttl_seconds=self.ttl, uri=self.uri, db_name=self.db_name)
+            except Exception:
+                self._count("errors")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size, hits, persistent_hits = len(self._entries), self.hits, self.persistent_hits
+            misses, errors = self.misses, self.errors
+        total = hits + misses
+        return {
+            "size": size,
+            "hits": hits,
+            "persistent_hits": persistent_hits,
+            "misses": misses,
+            "errors": errors,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
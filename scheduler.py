@@ -0,0 +1,116 @@
+import os
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Motion gating settings (override with env vars when deploying)
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "4.0"))
+MOTION_EVERY_N = int(os.getenv("MOTION_EVERY_N", "1"))
+MOTION_MAX_SKIP = int(os.getenv("MOTION_MAX_SKIP", "150"))
+MOTION_SIZE = (64, 48)
+
+
+class MotionGate:
+    """Decide per frame whether to run the detector or reuse the last detections.
+
+    Each frame is shrunk to a tiny grayscale thumbnail and compared with the
+    thumbnail of the last frame that was actually inferred; the mean absolute
+    difference (0-255) is the motion score.
+
+    - score < `threshold`: the scene is static, reuse the last result
+    - otherwise: run the detector every `every_n`-th moving frame
+    - never reuse one result for more than `max_skip` frames in a row
+      (0 disables the limit), so slow changes like lighting are picked up
+    """
+
+    def __init__(self, threshold=MOTION_THRESHOLD, every_n=MOTION_EVERY_N, max_skip=MOTION_MAX_SKIP,
+                 size=MOTION_SIZE):
+        self.threshold = threshold
+        self.every_n = max(1, every_n)
+        self.max_skip = max_skip
+        self.size = size
+        self.frames = 0
+        self.inferred = 0
+        self.last_score = 0.0
+        self._reference = None
+        self._pending = None
+        # reused thumbnail buffers; the gray one not holding the reference is the scratch
+        self._small = None
+        self._grays = [None, None]
+        self._since_infer = 0
+        self._moving = 0
+        self._last = None
+
+    def motion_score(self, frame):
+        self._small = small = cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            slot = 1 if self._grays[0] is self._reference and self._reference is not None else 0
+            self._grays[slot] = gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self._grays[slot])
+        else:
+            gray = small.copy()
+        if self._reference is None:
+            return float("inf"), gray
+        return float(cv2.absdiff(gray, self._reference).mean()), gray
+
+    def should_infer(self, frame, commit=True):
+        """Return True when `frame` needs a fresh detection (and take it as the new reference).
+
+        With `commit=False` the frame only becomes the reference once
+        `mark_inferred()` is called, for callers whose detection can still be
+        dropped (e.g. shed by the inference server); until then the gate keeps
+        comparing against the last frame that really was inferred.
+        """
+        self._pending = None
+        self.frames += 1
+        score, gray = self.motion_score(frame)
+        self.last_score = score
+        self._since_infer += 1
+        run = False
+        if not self.inferred or (self.max_skip and self._since_infer > self.max_skip):
+            run = True
+        elif score >= self.threshold:
+            self._moving += 1
+            run = self._moving % self.every_n == 0
+        if run:
+            self._pending = gray
+            if commit:
+                self.mark_inferred()
+        return run
+
+    def mark_inferred(self):
+        """Take the frame of the last positive `should_infer(commit=False)` as the new reference."""
+        if self._pending is None:
+            return
+        self._reference, self._pending = self._pending, None
+        self._since_infer = 0
+        self._moving = 0
+        self.inferred += 1
+
+    def run(self, frame, infer):
+        """Return `infer(frame)`, or the previous result when the frame can be skipped."""
+        if self.should_infer(frame):
+            self._last = infer(frame)
+        metrics.set_gauge("fruit_motion_skip_fraction", self.skip_fraction)
+        return self._last
+
+    @property
+    def skip_fraction(self):
+        return 1.0 - self.inferred / self.frames if self.frames else 0.0
+
+    def snapshot(self):
+        return {
+            "frames": self.frames,
+            "inferred": self.inferred,
+            "skipped": self.frames - self.inferred,
+            "skip_fraction": round(self.skip_fraction, 3),
+            "motion_score": round(self.last_score, 2) if np.isfinite(self.last_score) else None,
+        }
+
+
+def gated(infer, gate=None):
+    """Wrap `infer(frame)` so it goes through `gate` (returned unchanged when gate is None)."""
+    if gate is None:
+        return infer
+    return lambda frame: gate.run(frame, infer)
@@ -0,0 +1,329 @@
+"""Headless bulk scoring of image folders and recorded videos.
+
+    python score.py archive/2024-06 conveyor.mp4 --output-dir scores/ --workers 4
+
+Files are sharded across worker processes, each with its own model. The
+backend is chosen (including the "auto" benchmark) and exported once in the
+parent, and every worker loads that artifact. Inside a
+worker a pool of decoder threads streams images and video frames into a
+bounded queue, the main thread batches them into model.predict and appends the
+results to `part-<worker>.jsonl` (or Parquet) as it goes, so memory stays flat.
+Progress is checkpointed per worker after every batch; re-running the same
+command skips finished files and resumes videos after the last scored frame.
+Results are written before the checkpoint, so an interrupted run may repeat
+at most one batch.
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+
+import cv2
+
+import backends
+from class_index import for_names
+from detection import boxes_to_arrays, build_detected_info
+from preprocess import letterbox, preprocess_upload, unletterbox_boxes
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+VIDEO_EXTS = (".mp4", ".avi", ".mov", ".mkv", ".m4v")
+
+_DONE = "done"
+
+
+def iter_sources(paths):
+    """Sorted list of image and video files under `paths` (files or directories)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names)
+        else:
+            files.append(path)
+    return sorted(f for f in files if f.lower().endswith(IMAGE_EXTS + VIDEO_EXTS))
+
+
+class Checkpoint:
+    """Append-only progress log: {path: last scored frame or "done"}.
+
+    Each worker appends to its own file but reads every `checkpoint-*.jsonl`
+    in the output directory, so a resume still works if the worker count changes.
+    """
+
+    def __init__(self, out_dir, worker_id):
+        self.state = {}
+        for name in sorted(os.listdir(out_dir)):
+            if name.startswith("checkpoint-") and name.endswith(".jsonl"):
+                self._load(os.path.join(out_dir, name))
+        self._fp = open(os.path.join(out_dir, f"checkpoint-{worker_id}.jsonl"), "a", encoding="utf-8")
+
+    def _load(self, path):
+        with open(path, encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                prev = self.state.get(rec["path"])
+                if prev == _DONE or (prev is not None and rec["frame"] != _DONE and prev > rec["frame"]):
+                    continue
+                self.state[rec["path"]] = rec["frame"]
+
+    def is_done(self, path):
+        return self.state.get(path) == _DONE
+
+    def next_frame(self, path):
+        last = self.state.get(path)
+        return 0 if last is None or last == _DONE else last + 1
+
+    def mark(self, path, frame):
+        self.state[path] = frame
+        self._fp.write(json.dumps({"path": path, "frame": frame}) + "\n")
+
+    def flush(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def close(self):
+        self._fp.close()
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def write(self, records):
+        for rec in records:
+            self._fp.write(json.dumps(rec) + "\n")
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def close(self):
+        self._fp.close()
+
+
+class ParquetWriter:
+    """Streams record batches to Parquet row groups (needs pyarrow).
+
+    Parquet files can't be appended to, so every run writes a new part file.
+    """
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._schema = pa.schema([
+            ("source", pa.string()), ("frame", pa.int64()), ("width", pa.int32()),
+            ("height", pa.int32()), ("fruit", pa.string()), ("detections", pa.string()),
+        ])
+        base, ext = os.path.splitext(path)
+        self._writer = pq.ParquetWriter(f"{base}-{int(time.time())}{ext}", self._schema)
+
+    def write(self, records):
+        rows = [dict(rec, detections=json.dumps(rec["detections"])) for rec in records]
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _decode_file(path, checkpoint, stride, imgsz, out):
+    """Decode one file into `out` as (path, frame_idx, prep) items, then a (path, None, None) sentinel."""
+    if path.lower().endswith(VIDEO_EXTS):
+        cap = cv2.VideoCapture(path)
+        idx = checkpoint.next_frame(path)
+        if idx:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if idx % stride == 0:
+                    model_input, ratio, pad = letterbox(frame, imgsz)
+                    out.put((path, idx, {"frame": frame, "input": model_input, "ratio": ratio,
+                                         "pad": pad, "factor": 1}))
+                idx += 1
+        finally:
+            cap.release()
+    else:
+        with open(path, "rb") as fp:
+            prep = preprocess_upload(fp.read(), size=imgsz)
+        if prep is not None:
+            out.put((path, None, prep))
+    out.put((path, None, None))
+
+
+def prefetch(files, checkpoint, decoders, depth, stride, imgsz):
+    """Yield decoded items from `decoders` threads through a queue of at most `depth` items."""
+    todo = queue.Queue()
+    for f in files:
+        todo.put(f)
+    out = queue.Queue(maxsize=depth)
+    remaining = [decoders]
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            try:
+                path = todo.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                _decode_file(path, checkpoint, stride, imgsz, out)
+            except Exception as e:
+                print(f"skipping {path}: {e}")
+                out.put((path, None, None))
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                out.put(None)
+
+    for _ in range(decoders):
+        threading.Thread(target=run, daemon=True).start()
+    while True:
+        item = out.get()
+        if item is None:
+            return
+        yield item
+
+
+def _score_batch(model, batch, args, index):
+    preds = model.predict([prep["input"] for _, _, prep in batch], conf=args["conf"],
+                          imgsz=args["imgsz"], verbose=False)
+    records = []
+    for (path, frame_idx, prep), pred in zip(batch, preds):
+        xyxy, cls, conf = boxes_to_arrays(pred)
+        xyxy = unletterbox_boxes(xyxy, prep["ratio"], prep["pad"], prep["frame"].shape) * prep["factor"]
+        h, w = prep["frame"].shape[:2]
+        records.append({
+            "source": path,
+            "frame": frame_idx,
+            "width": w * prep["factor"],
+            "height": h * prep["factor"],
+            "fruit": index.auto_map(cls, conf),
+            "detections": build_detected_info(pred.names, cls, conf, xyxy=xyxy),
+        })
+    return records
+
+
+def run_worker(worker_id, files, args, progress):
+    """Score `files` in one process and report per-batch item counts on `progress`."""
+    out_dir = args["output_dir"]
+    checkpoint = Checkpoint(out_dir, worker_id)
+    files = [f for f in files if not checkpoint.is_done(f)]
+    if not files:
+        checkpoint.close()
+        return
+    model = backends.load_artifact(args["artifact"], imgsz=args["imgsz"], threads=args["threads"])
+    index = for_names(model.names)
+    ext = "parquet" if args["format"] == "parquet" else "jsonl"
+    writer_cls = ParquetWriter if ext == "parquet" else JsonlWriter
+    writer = writer_cls(os.path.join(out_dir, f"part-{worker_id}.{ext}"))
+
+    batch = []
+    finished = []
+
+    def flush():
+        if batch:
+            writer.write(_score_batch(model, batch, args, index))
+            last = {}
+            for path, frame_idx, _ in batch:
+                if frame_idx is not None:
+                    last[path] = max(frame_idx, last.get(path, -1))
+            for path, frame_idx in last.items():
+                checkpoint.mark(path, frame_idx)
+            progress.put(len(batch))
+        # files whose sentinel came before the end of this batch are fully written now
+        for path in finished:
+            checkpoint.mark(path, _DONE)
+        checkpoint.flush()
+        batch.clear()
+        finished.clear()
+
+    try:
+        items = prefetch(files, checkpoint, args["decoders"], args["prefetch"],
+                         args["video_stride"], args["imgsz"])
+        for path, frame_idx, prep in items:
+            if prep is None:
+                finished.append(path)
+                continue
+            batch.append((path, frame_idx, prep))
+            if len(batch) >= args["batch_size"]:
+                flush()
+        flush()
+    finally:
+        writer.close()
+        checkpoint.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score image folders and videos for fruit freshness")
+    parser.add_argument("paths", nargs="+", help="image/video files or directories")
+    parser.add_argument("--output-dir", default="scores")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="worker processes, each with its own model")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="inference threads per worker (default: cpu_count / workers)")
+    parser.add_argument("--decoders", type=int, default=2, help="decoder threads per worker")
+    parser.add_argument("--prefetch", type=int, default=32, help="decoded items buffered per worker")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--video-stride", type=int, default=1, help="score every Nth video frame")
+    parser.add_argument("--weights", default="best1.pt")
+    parser.add_argument("--backend", default=backends.INFERENCE_BACKEND,
+                        choices=("auto",) + backends.BACKENDS)
+    parser.add_argument("--imgsz", type=int, default=backends.INFERENCE_IMGSZ)
+    parser.add_argument("--int8", action="store_true", default=backends.INFERENCE_INT8,
+                        help="use the INT8-quantized export (onnx/openvino backends)")
+    parser.add_argument("--conf", type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    files = iter_sources(args.paths)
+    workers = max(1, min(args.workers, len(files)))
+    config = vars(args).copy()
+    config["threads"] = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    # resolve and export here: workers exporting concurrently would race on the same artifact path
+    backend = args.backend
+    if backend == "auto":
+        backend, _, timings = backends.select_backend(args.weights, imgsz=args.imgsz, threads=config["threads"],
+                                                      int8=args.int8)
+        print(f"Selected backend {backend} ({timings})")
+    config["backend"] = backend
+    config["artifact"] = backends.export_model(args.weights, backend, args.imgsz, args.int8)
+    print(f"Scoring {len(files)} files with {workers} workers ({backends.variant_name(backend, args.imgsz, args.int8)})")
+
+    ctx = multiprocessing.get_context("spawn")
+    progress = ctx.Queue()
+    procs = [ctx.Process(target=run_worker, args=(i, files[i::workers], config, progress), daemon=True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+
+    start = last_report = time.perf_counter()
+    scored = 0
+    while any(p.is_alive() for p in procs) or not progress.empty():
+        try:
+            scored += progress.get(timeout=1.0)
+        except queue.Empty:
+            pass
+        now = time.perf_counter()
+        if now - last_report >= 5.0:
+            print(f"{scored} items, {scored / (now - start):.1f} items/s")
+            last_report = now
+    for p in procs:
+        p.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {scored} items in {elapsed:.1f}s ({scored / max(elapsed, 1e-6):.1f} items/s)")
+    failed = [i for i, p in enumerate(procs) if p.exitcode != 0]
+    if failed:
+        raise SystemExit(f"workers {failed} failed; re-run the same command to resume")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import sys
+import threading
+import time
+
+import metrics
+
+# Reference point for the startup report: when this module was first imported
+# (streamlit_app.py imports it before anything else)
+STARTED_AT = time.perf_counter()
+
+_phases = {}
+_lock = threading.Lock()
+
+
+def mark(phase):
+    """Record the seconds from STARTED_AT to the first time `phase` is reached in this process."""
+    with _lock:
+        if phase in _phases:
+            return
+        seconds = time.perf_counter() - STARTED_AT
+        _phases[phase] = seconds
+    metrics.set_gauge("fruit_startup_seconds", round(seconds, 3), phase=phase)
+    print(f"startup: {phase} after {seconds:.2f}s", file=sys.stderr, flush=True)
+
+
+def report():
+    """{phase: seconds since startup} for every phase reached so far, in order."""
+    with _lock:
+        return {phase: round(s, 3) for phase, s in sorted(_phases.items(), key=lambda kv: kv[1])}
+
+
+class BackgroundLoader:
+    """Run `load()` once on a daemon thread so the UI can render meanwhile.
+
+    `ready` tells whether it finished; `result()` waits for it and returns
+    its value (re-raising its exception). When done, `phase` is marked in the
+    startup report.
+    """
+
+    def __init__(self, load, phase="model_ready"):
+        self.load = load
+        self.phase = phase
+        self.seconds = None
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"load-{phase}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self._value = self.load()
+        except BaseException as e:
+            self._error = e
+        self.seconds = time.perf_counter() - start
+        self._done.set()
+        if self._error is None:
+            mark(self.phase)
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    @property
+    def failed(self):
+        return self._done.is_set() and self._error is not None
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.phase} not reached after {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._value
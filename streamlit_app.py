@@ -1,347 +1,353 @@
+import startup
 import streamlit as st
-from ultralytics import YOLO
 import cv2
-import numpy as np
 import time
-import re
-import difflib
-from db import save_upload
+import atexit
+import hashlib
+from collections import OrderedDict
+from persistence import PersistenceQueue
+from detection import boxes_to_arrays, build_detected_info, draw_detections, process_prediction
+from result_cache import ResultCache, decode_result, encode_result
+from pipeline import FrameRing, MultiCameraPipeline, format_multi_stats, format_stats, open_source
+from display import DisplayFeed, LiveStream
+from inference_server import InferenceServer, Overloaded, StreamClient, PRIORITY_INTERACTIVE, PRIORITY_STREAM, SERVE_MAX_BATCH
+from scheduler import MotionGate, gated
+from tracker import TrackingDetector
+from preprocess import decode_reduced, preprocess_upload, unletterbox_boxes
+import backends
+import metrics
+from recipes import RECIPES
+from class_index import for_names
+from i18n import LANG_OPTIONS, recipe, translate
 import os
 
+startup.mark("imports")
+
 # ---------------- PAGE SETUP ----------------
 st.set_page_config(page_title="Rotten or Not 🍎", layout="wide")
 
 # ---------------- LOAD MODEL ----------------
+MODEL_PATH = os.getenv("MODEL_PATH", "best1.pt")
+
+# Inference parameters for uploads (part of the detection cache key);
+# INFERENCE_IMGSZ / INFERENCE_INT8 select a variant recommended by evaluate.py
+CONF = 0.5
+IMGSZ = backends.INFERENCE_IMGSZ
+
+def _load_model():
+    model, backend = backends.load_model(MODEL_PATH, backend=backends.INFERENCE_BACKEND, imgsz=IMGSZ)
+    # build the class-id -> recipe tables once, while the model loads
+    for_names(model.names)
+    return model, backend
+
 @st.cache_resource
+def get_model_loader():
+    """Load and warm up the model (INFERENCE_BACKEND, may be "auto") on a background thread.
+
+    The page renders while this runs; only the first inference waits for it.
+    """
+    return startup.BackgroundLoader(_load_model).start()
+
+class ModelUnavailable(RuntimeError):
+    """The background model load failed; only cached results can be served."""
+
 def load_model():
-    return YOLO("best1.pt")
+    """(model, backend name), waiting for the background load if it hasn't finished.
+
+    Raises ModelUnavailable if the load failed.
+    """
+    try:
+        return get_model_loader().result()
+    except Exception as e:
+        raise ModelUnavailable(str(e)) from e
+
+def backend_name():
+    """Name of the backend serving predictions; the configured one if the model failed to load."""
+    try:
+        return load_model()[1]
+    except ModelUnavailable:
+        return backends.INFERENCE_BACKEND + ("-int8" if backends.INFERENCE_INT8 else "")
 
-model = load_model()
+@st.cache_resource
+def model_fingerprint(path=MODEL_PATH):
+    """Short SHA-256 of the weights file, used to key cached detections."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return path
+    return h.hexdigest()[:16]
+
+get_model_loader()
 
+@st.cache_resource
+def get_inference_server():
+    """The only caller of model.predict: batches requests from every session and webcam loop."""
+    return InferenceServer(load_model()[0])
 
-# --- Multilingual support ---
-LANG_OPTIONS = {"English": "en", "हिन्दी": "hi", "ગુજરાતી": "gu"}
+@st.cache_resource
+def get_result_cache():
+    """Inference results shared by every session in this process."""
+    return ResultCache(
+        max_entries=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+        ttl=int(os.getenv("RESULT_CACHE_TTL", "3600")),
+        persistent=os.getenv("RESULT_CACHE_PERSIST", "0") == "1",
+    )
+
+# Number of images submitted to the inference server at once in batch upload mode;
+# the server never runs more than SERVE_MAX_BATCH per predict, so larger values don't help
+BATCH_SIZE = min(int(os.getenv("BATCH_SIZE", "8")), SERVE_MAX_BATCH)
+GRID_COLUMNS = 3
+
+# Max number of uploads whose detections are kept in session state; each keeps its boxes
+# and a JPEG of the annotated image (at most IMGSZ px on the longer side), not decoded frames
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "32"))
+SESSION_THUMBNAIL_QUALITY = int(os.getenv("SESSION_THUMBNAIL_QUALITY", "85"))
+
+
+def predict_batches(frames, batch_size=BATCH_SIZE, conf=CONF):
+    """Run the model over `frames` through the shared inference server, `batch_size` at a time.
+
+    The server may merge these requests with other sessions' into larger
+    batches. Returns one result per input frame, in the same order. Raises
+    Overloaded when the server's queue stays full past its back-pressure timeout.
+    """
+    if not frames:
+        return []
+    server = get_inference_server()
+    preds = []
+    for i in range(0, len(frames), batch_size):
+        preds.extend(server.predict(frames[i:i + batch_size], priority=PRIORITY_INTERACTIVE,
+                                    conf=conf, imgsz=IMGSZ))
+    return preds
+
+
+# --- Multilingual support (strings and recipes load from locales/<lang>.json, once per language) ---
 lang_choice = st.selectbox("Language / भाषा / ભાષા", list(LANG_OPTIONS.keys()), index=0)
 LANG = LANG_OPTIONS.get(lang_choice, "en")
 
-TRANSLATIONS = {
-    "app_title": {
-        "en": "🍓 Fruit Freshness Detector",
-        "hi": "🍓 फल ताज़गी डिटेक्टर",
-        "gu": "🍓 ફળ તાજગી ડિટેક્ટર"
-    },
-    "app_subtitle": {
-        "en": "Detect whether a fruit is **fresh** or **rotten** using YOLO",
-        "hi": "YOLO का उपयोग करके पता करें कि फल ताज़ा है या सड़ा हुआ",
-        "gu": "YOLO નો ઉપયોગ કરીને ફળ તाजा છે કે સુંકી ગયું છે તે શોધો"
-    },
-    "upload_header": {
-        "en": "📤 Upload Fruit Image",
-        "hi": "📤 फल की तस्वीर अपलोड करें",
-        "gu": "📤 ફળની છબી અપલોડ કરો"
-    },
-    "upload_label": {
-        "en": "Upload Image",
-        "hi": "इमेज अपलोड करें",
-        "gu": "ચિત્ર અપલોડ કરો"
-    },
-    "uploaded_caption": {
-        "en": "Uploaded Image",
-        "hi": "अपलोड की गई इमेज",
-        "gu": "અપલોડ કરેલ છબી"
-    },
-    "detection_caption": {
-        "en": "Detection Result",
-        "hi": "डिटेक्शन परिणाम",
-        "gu": "ડિટેક્શન પરિણામ"
-    },
-    "no_fruit": {
-        "en": "⚠️ No fruit detected.",
-        "hi": "⚠️ कोई फल नहीं मिला.",
-        "gu": "⚠️ કોઈ ફળ શોધાયું નથી."
-    },
-    "webcam_header": {
-        "en": "🎥 Live Webcam Detection",
-        "hi": "🎥 लाइव वेबकैम डिटेक्शन",
-        "gu": "🎥 લાઈવ વેબકેમ ડિટેક્શન"
-    },
-    "start_webcam": {
-        "en": "Start Webcam",
-        "hi": "वेबकैम शुरू करें",
-        "gu": "વેબકેમ શરૂ કરો"
-    },
-    "stop_webcam": {
-        "en": "Stop Webcam",
-        "hi": "वेबकैम रोकें",
-        "gu": "વેબકેમ બંધ કરો"
-    },
-    "webcam_stopped": {
-        "en": "🛑 Webcam stopped.",
-        "hi": "🛑 वेबकैम रुकी।",
-        "gu": "🛑 વેબકેમ બંધ થઈ ગઈ."
-    },
-    "camera_error": {
-        "en": "Camera error.",
-        "hi": "कैमरा त्रुटि.",
-        "gu": "કેમેરા ભૂલ."
-    },
-    "recipes_header": {
-        "en": "Recipe Ideas",
-        "hi": "रेसिपी सुझाव",
-        "gu": "રીસપી વિચારો"
-    },
-    "no_recipe_for": {
-        "en": "No recipe found for {name}.",
-        "hi": "{name} के लिए कोई रेसिपी नहीं मिली.",
-        "gu": "{name} માટે રેસપી મળી નથી."
-    },
-    "model_loaded": {
-        "en": "✅ Model loaded successfully!",
-        "hi": "✅ मॉडल सफलतापूर्वक लोड हुआ!",
-        "gu": "✅ મોડલ સફળતાપૂર્વક લોડ થયું!"
-    }
-    ,
-    "detection_details": {
-        "en": "Detection details",
-        "hi": "डिटेक्शन विवरण",
-        "gu": "ડિટેક્શન વિગતો"
-    },
-    "select_recipe": {
-        "en": "Select fruit for recipe (override)",
-        "hi": "रेसिपी के लिए फल चुनें (ओवरराइड)",
-        "gu": "રીસપી માટે ફળ પસંદ કરો (ઓવરરાઈડ)"
-    }
-    ,
-    "auto_map": {
-        "en": "Auto-select best match",
-        "hi": "सबसे अच्छा मेल स्वचालित रूप से चुनें",
-        "gu": "સરસ મૅચ આપમેળે પસંદ કરો"
-    },
-    "confidence_threshold": {
-        "en": "Confidence threshold",
-        "hi": "विश्वास सीमा",
-        "gu": "વિશ્વાસ થ્રેશોલ્ડ"
-    },
-    "auto_map_info": {
-        "en": "Auto-mapping uses label normalization, substring and fuzzy match.",
-        "hi": "ऑटो-मैपिंग लेबल सामान्यीकरण, सबस्ट्रिंग और फजी मिलान का उपयोग करता है।",
-        "gu": "આપમેળે મેપિંગ લેબલ નોર્મલાઈઝેશન, સબસ્ટ્રિંગ અને ફઝી મેચનો ઉપયોગ કરે છે."
-    },
-    "auto_map_failed": {
-        "en": "Auto-mapping couldn't find a good match; please select manually.",
-        "hi": "ऑटो-मैपिंग में अच्छा मेल नहीं मिला; कृपया मैन्युअली चुनें।",
-        "gu": "આપમેળે શોધી શક્યું નહી; કૃપા કરી મેન્યુઅલી પસંદ કરો."
-    }
-}
 
 def t(key, **kwargs):
-    entry = TRANSLATIONS.get(key, {})
-    text = entry.get(LANG, entry.get("en", ""))
-    if kwargs:
-        try:
-            return text.format(**kwargs)
-        except Exception:
-            return text
-    return text
+    return translate(LANG, key, **kwargs)
 
 # show translated title/subtitle
 st.title(t("app_title"))
 st.markdown(t("app_subtitle"))
-st.success(t("model_loaded"))
-
-# Simple recipe database (extend as needed)
-RECIPES = {
-    "apple": {
-        "title": "Apple Crumble",
-        "content": "Ingredients:\n- 4 apples\n- 100g flour\n- 75g butter\n- 75g brown sugar\n\nSteps:\n1. Slice apples and place in a baking dish.\n2. Mix flour, butter and sugar into crumbs and sprinkle over apples.\n3. Bake at 180°C for 30-35 minutes until golden."
-    },
-    "banana": {
-        "title": "Banana Smoothie",
-        "content": "Ingredients:\n- 2 ripe bananas\n- 250ml milk (or plant milk)\n- 1 tbsp honey\n\nSteps:\n1. Blend all ingredients until smooth.\n2. Serve chilled."
-    },
-    "mango": {
-        "title": "Mango Salsa",
-        "content": "Ingredients:\n- 1 ripe mango\n- 1/2 red onion\n- Juice of 1 lime\n- Handful cilantro\n\nSteps:\n1. Dice mango and onion.\n2. Mix with lime juice and chopped cilantro.\n3. Serve with chips or grilled fish."
-    },
-    "orange": {
-        "title": "Orange Granita",
-        "content": "Ingredients:\n- 500ml fresh orange juice\n- 50g sugar\n\nSteps:\n1. Dissolve sugar into juice.\n2. Freeze in a shallow tray, scraping every 30 minutes until flaky."
-    },
-    "strawberry": {
-        "title": "Strawberry Salad",
-        "content": "Ingredients:\n- 250g strawberries\n- Handful of spinach\n- Balsamic vinaigrette\n\nSteps:\n1. Halve strawberries and toss with spinach.\n2. Drizzle with vinaigrette and serve."
-    }
-    ,
-    "cucumber": {
-        "title": "Cucumber Raita",
-        "content": "Ingredients:\n- 1 large cucumber\n- 250g plain yogurt\n- 1/2 tsp roasted cumin powder\n- Salt to taste\n- Fresh cilantro or mint (optional)\n\nSteps:\n1. Peel and grate or finely chop the cucumber.\n2. Mix cucumber with yogurt, cumin powder and salt.\n3. Garnish with chopped cilantro or mint and serve chilled as a side."
-    }
-}
-
-# Translations for recipes (Hindi and Gujarati)
-RECIPES_TRANSLATIONS = {
-    "hi": {
-        "apple": {
-            "title": "एप्पल क्रम्बल",
-            "content": "सामग्री:\n- 4 सेब\n- 100g मैदा\n- 75g मक्खन\n- 75g ब्राउन शुगर\n\nविधि:\n1. सेब काटकर बेकिंग डिश में रखें।\n2. मैदा, मक्खन और शुगर मिलाकर क्रम्बल बनाकर सेब पर छिड़कें।\n3. 180°C पर 30-35 मिनट बेक करें।"
-        },
-        "banana": {
-            "title": "केला स्मूदी",
-            "content": "सामग्री:\n- 2 पके केले\n- 250ml दूध (या प्लांट-मिल्क)\n- 1 बड़ा चम्मच शहद\n\nविधि:\n1. सभी सामग्री ब्लेंड करें।\n2. ठंडा परोसें।"
-        },
-        "mango": {
-            "title": "मैंगो सालसा",
-            "content": "सामग्री:\n- 1 पका आम\n- 1/2 लाल प्याज\n- 1 नींबू का रस\n- थोड़ी हरी धनिया\n\nविधि:\n1. आम और प्याज को काटें।\n2. नींबू का रस और धनिया मिलाकर परोसें।"
-        },
-        "orange": {
-            "title": "संतरे की ग्रैनिटा",
-            "content": "सामग्री:\n- 500ml ताजा संतरे का रस\n- 50g चीनी\n\nविधि:\n1. चीनी घोलकर रस में मिलाएं।\n2. एक शैलो ट्रे में फ्रीज करें और हर 30 मिनट में खुरचें जब तक फलेक जैसा ना हो।"
-        },
-        "strawberry": {
-            "title": "स्ट्रॉबेरी सलाद",
-            "content": "सामग्री:\n- 250g स्ट्रॉबेरी\n- कुछ पालक\n- बेलसामिक विनेग्रेट\n\nविधि:\n1. स्ट्रॉबेरी आधी करें और पालक के साथ मिलाएं।\n2. विनेग्रेट डालें और परोसें।"
-        },
-        "cucumber": {
-            "title": "खीरे की रायता",
-            "content": "सामग्री:\n- 1 बड़ा खीरा\n- 250g दही\n- 1/2 चम्मच भुना जीरा पाउडर\n- स्वादानुसार नमक\n- हरा धनिया या पुदीना\n\nविधि:\n1. खीरा कद्दूकस या बारीक काटें।\n2. दही में मिलाकर मसाले डालें और ठंडा परोसें।"
-        }
-    },
-    "gu": {
-        "apple": {
-            "title": "એપલ ક્રંબલ",
-            "content": "સામગ્રી:\n- 4 સફરજન\n- 100g મેંદો\n- 75g માખણ\n- 75g બ્રાઉન ખાંડ\n\nરીત:\n1. સફરજન કાપીને બેકિંગ ડિશમાં મૂકો.\n2. મેંદો, માખણ અને ખાંડ મિક્સ કરીને છાંટો.\n3. 180°C પર 30-35 મિનિટ બેક કરો."
-        },
-        "banana": {
-            "title": "બનાના સ્મૂદી",
-            "content": "સામગ્રી:\n- 2 પેલા કેળા\n- 250ml દૂધ (અથવા પ્લાન્ટ મિલ્ક)\n- 1 વડી ચમચી મધ\n\nરીત:\n1. તમામ સામગ્રી બ્લેન્ડ કરો.\n2. ઠંડુ પરોછો."
-        },
-        "mango": {
-            "title": "કેરી સલસા",
-            "content": "સામગ્રી:\n- 1 પકડેલ કેરી\n- 1/2 લાલ ડુંગળી\n- 1 લાઇમ નો રસ\n- થોડું ધ્નિયાનો પત્તો\n\nરીત:\n1. કેરી અને ડુંગળી કાપો.\n2. લાઇમ રસ અને ધ્નિયા સાથે મિક્સ કરો."
-        },
-        "orange": {
-            "title": "સંટારા ગ્રાનિતા",
-            "content": "સામગ્રી:\n- 500ml તાજું સંતરાનો રસ\n- 50g ખાંડ\n\nરીત:\n1. ખાંડ ગળાવો અને રસમાં મિક્સ કરો.\n2. પટલા ટ્રેમાં ફ્રીઝ કરો અને દર 30 મિનિટે ખુરચો."
-        },
-        "strawberry": {
-            "title": "સ્ટ્રોબેરી સલાડ",
-            "content": "સામગ્રી:\n- 250g સ્ટ્રોબેરી\n- થોડો સ્પિનેચ\n- બેલસાયમિક વિનેગ્રેટ\n\nરીત:\n1. સ્ટ્રોબેરી કાપી સ્પિનેચ સાથે મિક્સ કરો.\n2. વિનેગ્રેટ ઉમેરો અને સર્વ કરો."
-        },
-        "cucumber": {
-            "title": "કાકડીનું રાયতা",
-            "content": "સામગ્રી:\n- 1 મોટી કાકડી\n- 250g દહીં\n- 1/2 ચમચી ભુનો જીરુ પાવડર\n- સ્વાદ માટે મીઠું\n- ધનિયા અથવા પુદીના પત્તા\n\nરીત:\n1. કાકડી છીલીને કાપો અથવા કુરજુ કરો.\n2. દહીંમાં મિક્સ કરો અને મસાલા ઉમેરો. ઠંડું સર્વ કરો."
-        }
+model_loader = get_model_loader()
+if model_loader.failed:
+    try:
+        model_loader.result()
+    except Exception as e:
+        st.error(t("model_load_failed", error=e))
+elif model_loader.ready:
+    st.success(t("model_loaded"))
+    st.sidebar.caption(f"Inference backend: {load_model()[1]}")
+else:
+    st.info(t("model_loading"))
+
+
+def detection_key(raw_bytes):
+    """Cache key for an upload: content hash plus model identity and inference params."""
+    digest = hashlib.sha256(raw_bytes).hexdigest()
+    return f"{digest}:{model_fingerprint()}:{backend_name()}:{CONF}:{IMGSZ}:letterbox"
+
+
+def draw_entry(entry, frame, factor):
+    """Draw the entry's boxes (original-image coordinates) on a decoded frame and keep it as a JPEG `thumbnail`."""
+    with metrics.timed("box_loop"):
+        draw_detections(frame, entry["xyxy"] / factor, entry["cls"], entry["conf"], entry["names"])
+    h, w = frame.shape[:2]
+    scale = IMGSZ / max(h, w)
+    if scale < 1:
+        frame = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, SESSION_THUMBNAIL_QUALITY])
+    entry["thumbnail"] = buf.tobytes() if ok else None
+
+
+def make_entry(xyxy, cls, conf, names, prep=None):
+    """Build a cache entry; with `prep` the boxes are drawn on its decoded frame right away.
+
+    Without it (a result-cache hit) nothing is decoded here; the thumbnail is
+    drawn when `annotated_image()` is first called.
+    """
+    with metrics.timed("box_loop"):
+        detected_info = build_detected_info(names, cls, conf, xyxy=xyxy)
+    entry = {
+        "thumbnail": None,
+        "detected_info": detected_info,
+        "names": names,
+        "xyxy": xyxy,
+        "cls": cls,
+        "conf": conf,
     }
-}
-
-def extract_fruit_name(label: str) -> str:
-    """Normalize model label to a fruit name key used in RECIPES."""
-    s = label.lower()
-    s = s.replace("_", " ")
-    # remove words indicating freshness
-    s = re.sub(r"\b(fresh|rotten|ripe|unripe|good|bad)\b", "", s)
-    s = re.sub(r"[^a-z\s]", "", s)
-    s = s.strip()
-    # if label contains multiple words, pick the last as likely fruit (common model patterns)
-    parts = s.split()
-    if len(parts) == 0:
-        return ""
-    # try to find a known fruit in parts
-    for p in parts:
-        if p in RECIPES:
-            return p
-    # fallback to last token
-    return parts[-1]
-
-
-def auto_map_fruit(detected_info, conf_thresh=0.3):
-    """Try to auto-map model detections to a known recipe key.
-
-    Strategy (in order of checking per detection sorted by confidence):
-    - Normalize label and check exact recipe key
-    - Check if any recipe key is substring of label
-    - Fuzzy match label against recipe keys using difflib
-    Returns the first reasonable match or None.
+    if prep is not None:
+        draw_entry(entry, prep["frame"], prep["factor"])
+    return entry
+
+
+def annotated_image(entry, raw_bytes):
+    """JPEG bytes of the upload with the entry's boxes drawn, decoding `raw_bytes` on first use."""
+    if entry["thumbnail"] is None:
+        frame, factor = decode_reduced(raw_bytes, target=IMGSZ)
+        if frame is None:
+            return None
+        draw_entry(entry, frame, factor)
+    return entry["thumbnail"]
+
+
+def cached_detections(raw_list, batch_size=BATCH_SIZE):
+    """Return one detection entry per upload, running the model only on uploads not seen before.
+
+    Entries live in `st.session_state` so widget changes (which rerun the whole
+    script) don't re-decode, re-run inference or re-save the upload. Each entry
+    is a dict with `detected_info` (boxes in original-image coordinates) and
+    `names`; `annotated_image(entry, raw)` returns the image with boxes drawn.
+    `save_res` is added once the upload has been persisted. Uploads are only
+    decoded when no cache has their result; ones that can't be decoded get None.
+    Raises Overloaded (from `predict_batches`) when the inference server is busy.
     """
-    if not detected_info:
-        return None
+    cache = st.session_state.setdefault("detection_cache", OrderedDict())
+    keys = [detection_key(raw) for raw in raw_list]
+
+    # second level: results computed by any session in this process (or stored in MongoDB),
+    # checked on the content hash before anything is decoded
+    result_cache = get_result_cache()
+    todo_keys = []
+    todo_preps = []
+    for key, raw in zip(keys, raw_list):
+        if key in cache or key in todo_keys:
+            continue
+        hit = result_cache.get(key)
+        if hit is not None:
+            xyxy, cls, conf, names = decode_result(hit)
+            cache[key] = make_entry(xyxy, cls, conf, names)
+            continue
+        prep = preprocess_upload(raw, size=IMGSZ)
+        if prep is not None:
+            todo_keys.append(key)
+            todo_preps.append(prep)
+
+    preds = predict_batches([prep["input"] for prep in todo_preps], batch_size=batch_size)
+    for key, prep, pred in zip(todo_keys, todo_preps, preds):
+        xyxy, cls, conf = boxes_to_arrays(pred)
+        # letterboxed model input -> decoded frame -> original image
+        xyxy = unletterbox_boxes(xyxy, prep["ratio"], prep["pad"], prep["frame"].shape) * prep["factor"]
+        result_cache.put(key, encode_result(xyxy, cls, conf, pred.names))
+        cache[key] = make_entry(xyxy, cls, conf, pred.names, prep=prep)
+
+    entries = []
+    for key in keys:
+        if key in cache:
+            cache.move_to_end(key)
+        entries.append(cache.get(key))
+    while len(cache) > max(SESSION_CACHE_SIZE, len(keys)):
+        cache.popitem(last=False)
+    return entries
+
+@st.cache_resource
+def get_persistence():
+    """Write-behind queue shared by all sessions; replays anything left in the journal and drains on exit."""
+    persist = PersistenceQueue().start()
+    # registered after db's client cleanup, so it runs first and can still write
+    atexit.register(persist.close)
+    persist.replay_journal()
+    return persist
+
+@st.cache_resource
+def start_metrics_server():
+    return metrics.start_http_server()
 
-    # sort by confidence desc
-    items = sorted(detected_info, key=lambda x: x.get("conf", 0), reverse=True)
-    keys = list(RECIPES.keys())
+if metrics.ENABLED:
+    start_metrics_server()
+    if st.sidebar.checkbox("Show metrics", value=False):
+        st.sidebar.dataframe(metrics.summary())
 
-    for it in items:
-        conf = float(it.get("conf", 0))
-        if conf < conf_thresh:
-            continue
-        label = it.get("label", "").lower()
-        name = extract_fruit_name(label)
-        if name in RECIPES:
-            return name
-        # substring
-        for k in keys:
-            if k in label:
-                return k
-        # fuzzy match against full label
-        match = difflib.get_close_matches(label, keys, n=1, cutoff=0.6)
-        if match:
-            return match[0]
-        # try tokens
-        for token in label.split():
-            match = difflib.get_close_matches(token, keys, n=1, cutoff=0.7)
-            if match:
-                return match[0]
-
-    return None
+st.sidebar.caption("Result cache: " + ", ".join(f"{k}={v}" for k, v in get_result_cache().stats().items()))
+if model_loader.ready and not model_loader.failed:
+    st.sidebar.caption("Inference server: " + ", ".join(f"{k}={v}" for k, v in get_inference_server().snapshot().items()))
 
 # ===
 # =====================================================
 st.header(t("upload_header"))
 
-uploaded_file = st.file_uploader(
-    t("upload_label"),
-    type=["jpg", "jpeg", "png"]
-)
+batch_mode = st.checkbox(t("batch_mode"), value=False)
+
+if batch_mode:
+    uploaded_files = st.file_uploader(
+        t("batch_upload_label"),
+        type=["jpg", "jpeg", "png"],
+        accept_multiple_files=True
+    )
+    batch_size = st.slider(t("batch_size"), 1, SERVE_MAX_BATCH, BATCH_SIZE)
+    uploaded_file = None
+else:
+    uploaded_file = st.file_uploader(
+        t("upload_label"),
+        type=["jpg", "jpeg", "png"]
+    )
+    uploaded_files = []
+
+if uploaded_files:
+    names = [getattr(f, "name", "upload") for f in uploaded_files]
+    raw_list = [f.getvalue() for f in uploaded_files]
+
+    start = time.perf_counter()
+    try:
+        entries = cached_detections(raw_list, batch_size=batch_size)
+    except Overloaded:
+        st.warning(t("server_busy"))
+        entries = []
+    except ModelUnavailable as e:
+        st.error(t("model_load_failed", error=e))
+        entries = []
+    elapsed = time.perf_counter() - start
+    count = sum(e is not None for e in entries)
+    if count:
+        st.caption(t("batch_summary", count=count, seconds=elapsed,
+                     rate=count / max(elapsed, 1e-6)))
+
+    cols = st.columns(GRID_COLUMNS)
+    idx = 0
+    for name, raw, entry in zip(names, raw_list, entries):
+        if entry is None:
+            st.warning(t("decode_failed", name=name))
+            continue
+
+        with cols[idx % GRID_COLUMNS]:
+            st.image(annotated_image(entry, raw), caption=name, width="stretch")
+            if entry["detected_info"]:
+                with st.expander(t("detection_details")):
+                    st.write(entry["detected_info"])
+            else:
+                st.caption(t("no_fruit"))
+        idx += 1
 
 if uploaded_file is not None:
     # read raw bytes once so we can both decode and save them
-    raw_bytes = uploaded_file.read()
-    file_bytes = np.asarray(bytearray(raw_bytes), dtype=np.uint8)
-    frame = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-    # resize large images
-    frame_resized = cv2.resize(frame_rgb, (640, 640))
-
-    st.image(frame_rgb, caption=t("uploaded_caption"), width="stretch")
-
-    results = model.predict(frame_resized, conf=0.5, verbose=False)
-    pred = results[0]
-
-    if pred.boxes is not None and len(pred.boxes) > 0:
-        detected_labels = []
-        detected_info = []
-        for box in pred.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            label = pred.names[cls_id]
-            detected_labels.append(label)
-            detected_info.append({"label": label, "conf": float(conf), "cls_id": int(cls_id)})
-
-            color = (0,255,0) if "fresh" in label.lower() else (0,0,255)
-
-            cv2.rectangle(frame_resized,(x1,y1),(x2,y2),color,2)
-            cv2.putText(frame_resized,
-                        f"{label} {conf:.2f}",
-                        (x1,y1-10),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.8,
-                        color,
-                        2)
-
-        st.image(frame_resized,
+    raw_bytes = uploaded_file.getvalue()
+    # (st.warning / st.error, message) when the upload couldn't be run; nothing is shown or saved for it
+    problem = None
+    try:
+        entry = cached_detections([raw_bytes])[0]
+    except Overloaded:
+        entry, problem = None, (st.warning, t("server_busy"))
+    except ModelUnavailable as e:
+        entry, problem = None, (st.error, t("model_load_failed", error=e))
+
+    st.image(raw_bytes, caption=t("uploaded_caption"), width="stretch")
+
+    if problem is not None:
+        show, message = problem
+        show(message)
+    elif entry is None:
+        st.warning(t("decode_failed", name=getattr(uploaded_file, "name", "upload")))
+    elif entry["detected_info"]:
+        detected_info = entry["detected_info"]
+        index = for_names(entry["names"])
+
+        st.image(annotated_image(entry, raw_bytes),
              caption=t("detection_caption"),
              width="stretch")
 
@@ -354,7 +360,7 @@ if uploaded_file is not None:
             st.write(detected_info)
             st.write("Model class mapping (id -> name):")
             try:
-                st.write(pred.names)
+                st.write(entry["names"])
             except Exception:
                 st.write("(no mapping available)")
 
@@ -369,7 +375,8 @@ if uploaded_file is not None:
         options = sorted(RECIPES.keys())
         chosen_fruit = None
         if auto:
-            auto_choice = auto_map_fruit(detected_info, conf_thresh=conf_thresh)
+            with metrics.timed("auto_map_fruit"):
+                auto_choice = index.auto_map(entry["cls"], entry["conf"], conf_thresh=conf_thresh)
             if auto_choice:
                 chosen_fruit = auto_choice
                 st.success(f"Auto-selected: {chosen_fruit}")
@@ -379,43 +386,41 @@ if uploaded_file is not None:
         # If not auto-selected, show manual selector (default to first detected normalized)
         if not chosen_fruit:
             # Build default selection (first normalized detected fruit if any)
-            fruit_keys = []
-            for lab in detected_labels:
-                name = extract_fruit_name(lab)
-                if name:
-                    fruit_keys.append(name)
+            first_fruit = index.first_normalized(entry["cls"])
 
             default_idx = 0
-            if len(fruit_keys) > 0 and fruit_keys[0] in options:
-                default_idx = options.index(fruit_keys[0])
+            if first_fruit in options:
+                default_idx = options.index(first_fruit)
 
             chosen_fruit = st.selectbox(t("select_recipe"), options, index=default_idx)
 
         st.header(t("recipes_header"))
-        if LANG in RECIPES_TRANSLATIONS and chosen_fruit in RECIPES_TRANSLATIONS[LANG]:
-            r = RECIPES_TRANSLATIONS[LANG][chosen_fruit]
-            st.subheader(r.get("title", chosen_fruit.title()))
-            st.text(r.get("content", ""))
-        elif chosen_fruit in RECIPES:
-            r = RECIPES[chosen_fruit]
+        r = recipe(LANG, chosen_fruit)
+        if r:
             st.subheader(r.get("title", chosen_fruit.title()))
             st.text(r.get("content", ""))
         else:
             st.info(t("no_recipe_for", name=chosen_fruit))
 
-        # Try saving upload + detection metadata to MongoDB and Cloudinary (non-fatal)
-        try:
-            cloud_cfg = {
-                "cloud_name": os.getenv("CLOUDINARY_CLOUD_NAME", "dgosjbdx7"),
-                "api_key": os.getenv("CLOUDINARY_API_KEY", "764318225397556"),
-                "api_secret": os.getenv("CLOUDINARY_API_SECRET", "2_tKwqV7ZpG0d-nfgADM6jBXHnQ"),
-            }
-            save_res = save_upload(raw_bytes, getattr(uploaded_file, "name", "upload"), chosen_fruit, detected_info, cloudinary_config=cloud_cfg)
-            st.caption(f"Saved upload to database: {str(save_res.get('_id'))}")
-            if save_res.get("cloudinary"):
-                st.markdown(f"Uploaded to Cloudinary: {save_res['cloudinary'].get('secure_url')}")
-        except Exception as e:
-            st.warning(f"Could not save upload to database/cloud: {e}")
+        # Queue upload + detection metadata for saving to MongoDB and Cloudinary (non-fatal).
+        # Saved once per upload; the write happens in the background so the page doesn't wait on storage.
+        if "save_res" not in entry:
+            try:
+                cloud_cfg = {
+                    "cloud_name": os.getenv("CLOUDINARY_CLOUD_NAME", "dgosjbdx7"),
+                    "api_key": os.getenv("CLOUDINARY_API_KEY", "764318225397556"),
+                    "api_secret": os.getenv("CLOUDINARY_API_SECRET", "2_tKwqV7ZpG0d-nfgADM6jBXHnQ"),
+                }
+                entry["save_res"] = get_persistence().submit(raw_bytes, getattr(uploaded_file, "name", "upload"), chosen_fruit, detected_info, cloudinary_config=cloud_cfg)
+                entry["save_error"] = None
+            except Exception as e:
+                entry["save_res"] = None
+                entry["save_error"] = e
+        save_res = entry["save_res"]
+        if save_res is not None:
+            st.caption(f"Queued upload for saving: {str(save_res.get('_id'))}")
+        else:
+            st.warning(f"Could not save upload to database/cloud: {entry['save_error']}")
 
     else:
         st.warning("⚠️ No fruit detected.")
@@ -426,44 +431,128 @@ if uploaded_file is not None:
 # =====================================================
 st.header(t("webcam_header"))
 
+pipelined = st.checkbox(t("pipelined_mode"), value=True)
+motion_gating = st.checkbox(t("motion_gating"), value=True)
+tracking = st.checkbox(t("tracking"), value=True)
+camera_sources = [src.strip() for src in st.text_input(t("camera_sources"), value="0").split(",") if src.strip()]
 start_detection = st.button(t("start_webcam"))
 FRAME_WINDOW = st.image([], width="stretch")
+STATS_WINDOW = st.empty()
+
+def build_webcam_infer():
+    # stream priority: uploads go first, and a dropped frame reuses the last prediction
+    predict_frame = StreamClient(get_inference_server(), conf=0.5, imgsz=IMGSZ)
+    gate = MotionGate() if motion_gating else None
+    infer = gated(predict_frame, gate)
+    tracked = TrackingDetector(infer) if tracking else None
+    return {"infer": infer if tracked is None else tracked, "gate": gate, "tracked": tracked}
+
 
-if start_detection:
+@st.cache_resource
+def get_live_stream():
+    # one camera pipeline for every session; viewers share its encoded frames
+    return LiveStream(lambda: cv2.VideoCapture(0))
+
+
+def webcam_stats(pipe=None, gate=None, tracked=None, feed=None):
+    parts = []
+    if pipe is not None:
+        parts.append(format_stats(pipe.snapshot()))
+    if gate is not None:
+        parts.append(f"skipped {gate.skip_fraction:.0%} of frames")
+    if tracked is not None:
+        snap = tracked.snapshot()
+        parts.append(f"detector on {snap['detector_calls']}/{snap['frames']} frames, counts: {snap['counts']}")
+    if feed is not None:
+        snap = feed.snapshot()
+        parts.append(f"display: {snap['kb_per_frame']} KB/frame at q{snap['quality']} {snap['width']}px")
+    return " | ".join(parts)
+
+
+if start_detection and camera_sources != ["0"]:
+    # several cameras/files: one pipeline, one batched predict per tick for all of them
+    stop_button = st.button(t("stop_webcam"))
+    server = get_inference_server()
+    caps = [open_source(src) for src in camera_sources]
+    gates = [MotionGate() if motion_gating else None for _ in caps]
+    pipe = MultiCameraPipeline(
+        caps, lambda frames: server.try_predict(frames, priority=PRIORITY_STREAM, conf=0.5, imgsz=IMGSZ),
+        names=camera_sources, gates=gates).start()
+    cols = st.columns(min(len(caps), GRID_COLUMNS))
+    windows = [cols[i % len(cols)].empty() for i in range(len(caps))]
+    feeds = [DisplayFeed() for _ in caps]
+    try:
+        for i, packets in enumerate(pipe.results()):
+            for packet in packets:
+                feed = feeds[packet["source"]]
+                if not feed.due():
+                    continue
+                frame = packet["frame"]
+                if packet["pred"] is not None:
+                    process_prediction(frame, packet["pred"])
+                if feed.publish(frame):
+                    windows[packet["source"]].image(feed.wait()[1], caption=packet["name"], width="stretch")
+            if i % 15 == 0:
+                STATS_WINDOW.text(format_multi_stats(pipe.snapshot()))
+                pipe.record_metrics()
+            if stop_button:
+                break
+    finally:
+        pipe.stop()
+        for cap in caps:
+            cap.release()
+    if pipe.error:
+        st.error(t("camera_error"))
+    st.warning(t("webcam_stopped"))
+
+elif start_detection and pipelined:
+    stop_button = st.button(t("stop_webcam"))
+
+    stream = get_live_stream()
+    feed = stream.attach(build_webcam_infer)
+    try:
+        for i, jpeg in enumerate(feed.frames()):
+            # already-encoded JPEG bytes are sent as-is, without re-encoding per session
+            FRAME_WINDOW.image(jpeg, width="stretch")
+            pipe = stream.pipe
+            if i % 15 == 0 and pipe is not None:
+                STATS_WINDOW.caption(webcam_stats(pipe, stream.context.get("gate"),
+                                                  stream.context.get("tracked"), feed))
+                metrics.record_pipeline(pipe)
+            if stop_button:
+                break
+    finally:
+        stream.detach()
+    if stream.error:
+        st.error(t("camera_error"))
+    st.warning(t("webcam_stopped"))
+
+elif start_detection:
     cap = cv2.VideoCapture(0)
     stop_button = st.button(t("stop_webcam"))
+    ctx = build_webcam_infer()
+    infer, gate, tracked = ctx["infer"], ctx["gate"], ctx["tracked"]
+    feed = DisplayFeed()
+    ring = FrameRing(1)  # released before the next read
 
+    i = 0
     while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+        frame = ring.read(cap, flip=True)
+        if frame is None:
             st.error(t("camera_error"))
             break
 
-        frame = cv2.flip(frame, 1)
-
-        results = model.predict(frame, conf=0.5, verbose=False)
-        pred = results[0]
+        pred = infer(frame)
 
-        if pred.boxes is not None and len(pred.boxes) > 0:
-            for box in pred.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                cls_id = int(box.cls[0])
-                conf = float(box.conf[0])
-                label = pred.names[cls_id]
+        process_prediction(frame, pred)
+        metrics.inc("fruit_webcam_frames_total")
+        if (gate is not None or tracked is not None) and i % 15 == 0:
+            STATS_WINDOW.caption(webcam_stats(gate=gate, tracked=tracked))
+        i += 1
 
-                color = (0,255,0) if "fresh" in label.lower() else (0,0,255)
-
-                cv2.rectangle(frame,(x1,y1),(x2,y2),color,2)
-                cv2.putText(frame,
-                            f"{label} {conf:.2f}",
-                            (x1,y1-10),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.8,
-                            color,
-                            2)
-
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        FRAME_WINDOW.image(frame, width="stretch")
+        if feed.publish(frame):
+            FRAME_WINDOW.image(feed.wait()[1], width="stretch")
+        ring.release(frame)
 
         if stop_button:
             break
@@ -472,3 +561,6 @@ if start_detection:
 
     cap.release()
     st.warning(t("webcam_stopped"))
+
+startup.mark("first_render")
+st.sidebar.caption("Startup: " + ", ".join(f"{k} {v:.2f}s" for k, v in startup.report().items()))
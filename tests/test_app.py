@@ -0,0 +1,75 @@
+"""Upload flow of streamlit_app.py, run headless through streamlit's AppTest."""
+import hashlib
+import os
+
+import pytest
+
+st = pytest.importorskip("streamlit")
+cv2 = pytest.importorskip("cv2")
+mongomock = pytest.importorskip("mongomock")
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+import backends
+import db
+import preprocess
+from result_cache import encode_result
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+UPLOAD_KEY = "_test_upload"
+
+
+class FakeUpload:
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def fake_file_uploader(label, *args, accept_multiple_files=False, **kwargs):
+    item = st.session_state.get(UPLOAD_KEY)
+    if item is None:
+        return [] if accept_multiple_files else None
+    return [FakeUpload(*item)] if accept_multiple_files else FakeUpload(*item)
+
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    weights = str(tmp_path / "missing.pt")  # the background load fails: nothing can be predicted
+    monkeypatch.setenv("MODEL_PATH", weights)
+    monkeypatch.setenv("RESULT_CACHE_PERSIST", "1")
+    monkeypatch.setenv("PERSIST_JOURNAL_DIR", str(tmp_path / "journal"))
+    client = mongomock.MongoClient()
+    monkeypatch.setitem(db._clients, db.MONGO_URI, client)
+    monkeypatch.setattr(db, "upload_to_cloudinary", lambda *a, **k: {"secure_url": "https://example.invalid/x.jpg"})
+    monkeypatch.setattr(st, "file_uploader", fake_file_uploader)
+    return weights, client
+
+
+def test_result_cache_hit_skips_decode_and_predict(app_env, monkeypatch):
+    weights, _ = app_env
+    ok, buf = cv2.imencode(".jpg", np.full((1200, 1600, 3), 90, np.uint8))
+    raw = buf.tobytes()
+    # what an earlier run (another process) stored for this image
+    key = (f"{hashlib.sha256(raw).hexdigest()}:{weights}:{backends.INFERENCE_BACKEND}:0.5:"
+           f"{backends.INFERENCE_IMGSZ}:letterbox")
+    db.put_cached_result(key, encode_result([[10, 20, 200, 300]], [0], [0.9], {0: "freshapples"}))
+
+    def no_preprocess(*args, **kwargs):
+        raise AssertionError("a result-cache hit must not be preprocessed for the model")
+
+    monkeypatch.setattr(preprocess, "preprocess_upload", no_preprocess)
+    app = AppTest.from_file(APP_PATH, default_timeout=30)
+    app.session_state[UPLOAD_KEY] = ("apple.jpg", raw)
+    app.run()
+    assert not app.exception
+    # only the page's own "could not load the model" banner; the upload itself was served
+    assert len(app.error) == 1
+    entry = next(iter(app.session_state["detection_cache"].values()))
+    assert entry["detected_info"][0]["label"] == "freshapples"
+    # decoded once, for display only; the session keeps a JPEG of at most IMGSZ px, not the frame
+    thumb = cv2.imdecode(np.frombuffer(entry["thumbnail"], np.uint8), cv2.IMREAD_COLOR)
+    assert max(thumb.shape[:2]) <= backends.INFERENCE_IMGSZ
+    assert not any(isinstance(v, np.ndarray) and v.ndim == 3 for v in entry.values())
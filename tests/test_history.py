@@ -0,0 +1,26 @@
+import datetime
+
+import mongomock
+
+import db
+import history
+
+
+def test_fresh_and_rotten_labels_share_a_fruit():
+    info = db.annotate_detections([{"label": "freshapples"}, {"label": "rottenapples"}, {"label": "rotten kiwi"}])
+    assert [d["fruit"] for d in info] == ["apple", "apple", "kiwi"]
+    assert [d["fresh"] for d in info] == [True, False, False]
+
+
+def test_reannotate_fixes_rows_split_by_freshness(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(db, "get_db", lambda uri=None, db_name=None: database)
+    now = datetime.datetime.utcnow()
+    database.uploads.insert_many([
+        {"uploaded_at": now, "detected_info": [{"label": "freshapples", "fruit": "freshapples", "fresh": True}]},
+        {"uploaded_at": now, "detected_info": [{"label": "rottenapples", "fruit": "rottenapples", "fresh": False}]},
+        {"uploaded_at": now, "detected_info": [{"label": "freshbanana", "fruit": "banana", "fresh": True}]},
+    ])
+    assert history.reannotate_detection_fields(batch_size=1) == 2
+    assert history.reannotate_detection_fields() == 0
+    assert sorted(database.uploads.distinct("detected_info.fruit")) == ["apple", "banana"]
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from inference_server import (PRIORITY_INTERACTIVE, PRIORITY_STREAM, InferenceServer, Overloaded,
+                              StreamClient)
+
+
+class FakeModel:
+    """Returns (image, conf, imgsz) per input and records every batch; blocks while `gate` is clear."""
+
+    names = {0: "freshapples"}
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def predict(self, images, conf=0.5, imgsz=640, verbose=False):
+        self.entered.set()
+        self.gate.wait()
+        self.batches.append(list(images))
+        return [(img, conf, imgsz) for img in images]
+
+
+def blocked_server(**kwargs):
+    """A server whose worker is stuck inside predict on a first "warm" request."""
+    model = FakeModel()
+    model.gate.clear()
+    server = InferenceServer(model, max_wait_ms=0, **kwargs)
+    server.submit("warm")
+    assert model.entered.wait(1.0)
+    return model, server
+
+
+def test_batches_group_by_key_and_run_in_priority_order():
+    model, server = blocked_server(max_batch=8)
+    try:
+        stream = [server.submit(f"s{i}", priority=PRIORITY_STREAM) for i in range(2)]
+        upload = [server.submit(f"u{i}", priority=PRIORITY_INTERACTIVE) for i in range(2)]
+        other = server.submit("small", priority=PRIORITY_INTERACTIVE, imgsz=320)
+        model.gate.set()
+        assert [f.result(1.0)[0] for f in upload] == ["u0", "u1"]
+        assert other.result(1.0) == ("small", 0.5, 320)
+        assert [f.result(1.0)[0] for f in stream] == ["s0", "s1"]
+    finally:
+        server.close()
+    # interactive requests jump the queue; the batch takes every request sharing the first one's key
+    assert model.batches == [["warm"], ["u0", "u1", "s0", "s1"], ["small"]]
+
+
+def test_full_queue_evicts_lower_priority_then_rejects():
+    model, server = blocked_server(max_queue=2)
+    try:
+        shed = [server.submit(f"s{i}", priority=PRIORITY_STREAM) for i in range(2)]
+        kept = server.submit("u0", priority=PRIORITY_INTERACTIVE)
+        with pytest.raises(Overloaded):
+            shed[1].result(1.0)
+        server.submit("u1", priority=PRIORITY_INTERACTIVE)
+        with pytest.raises(Overloaded):
+            shed[0].result(1.0)
+        with pytest.raises(Overloaded):
+            server.submit("u2", priority=PRIORITY_INTERACTIVE, timeout=0.05)
+        assert server.snapshot()["evicted"] == 2
+        assert server.snapshot()["rejected"] == 1
+        model.gate.set()
+        assert kept.result(1.0)[0] == "u0"
+    finally:
+        server.close()
+
+
+def test_predict_cancels_queued_images_when_one_is_rejected():
+    model, server = blocked_server(max_queue=2)
+    submit = server.submit
+    server.submit = lambda image, **kwargs: submit(image, timeout=0, **kwargs)
+    try:
+        with pytest.raises(Overloaded):
+            server.predict(["a", "b", "c"], timeout=1.0)
+        model.gate.set()
+        assert server.predict(["d"], timeout=1.0)[0][0] == "d"
+    finally:
+        server.close()
+    assert all("a" not in batch and "b" not in batch for batch in model.batches)
+
+
+def test_close_fails_queued_requests():
+    model, server = blocked_server()
+    queued = server.submit("x")
+    server.close()
+    with pytest.raises(Overloaded):
+        queued.result(1.0)
+    with pytest.raises(Overloaded):
+        server.submit("y")
+    model.gate.set()
+
+
+def test_stream_client_backs_off_while_shed_without_a_prediction():
+    model, server = blocked_server(max_queue=1)
+    attempts = []
+    submit = server.submit
+
+    def counting_submit(image, **kwargs):
+        attempts.append(time.perf_counter())
+        return submit(image, timeout=0, **kwargs)
+
+    server.submit = counting_submit
+    server.submit("u0", priority=PRIORITY_INTERACTIVE)  # fills the queue
+    client = StreamClient(server, backoff=0.01, max_backoff=0.05)
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("pred", client("frame")), daemon=True)
+    thread.start()
+    time.sleep(0.3)
+    try:
+        # 10 + 20 + 40 + 50 + 50 ... ms between attempts, not a busy loop
+        assert 3 <= len(attempts) <= 12
+        model.gate.set()
+        thread.join(1.0)
+        assert result["pred"][0] == "frame"
+    finally:
+        server.close()
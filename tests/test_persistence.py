@@ -0,0 +1,64 @@
+import time
+
+import mongomock
+
+import db
+from persistence import PersistenceQueue
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+def make_backend(monkeypatch):
+    """mongomock database and a blob store that fails while `state["down"]` is set."""
+    database = mongomock.MongoClient().db
+    state = {"down": True}
+
+    def store_blob(raw_bytes, filename, **kwargs):
+        if state["down"]:
+            raise ConnectionError("backend unavailable")
+        return {"file_id": "f-" + filename, "cloudinary": None, "sha256": "x", "thumbnail_id": None}
+
+    monkeypatch.setattr(db, "get_db", lambda uri=None, db_name=None: database)
+    monkeypatch.setattr(db, "store_blob", store_blob)
+    return database, state
+
+
+def make_queue(tmp_path, **kwargs):
+    opts = dict(journal_dir=str(tmp_path / "journal"), flush_interval=0.02, max_retries=0, backoff=0,
+                replay_interval=0.1)
+    opts.update(kwargs)
+    return PersistenceQueue(**opts)
+
+
+def test_spilled_upload_is_retried_after_backend_recovers(tmp_path, monkeypatch):
+    database, state = make_backend(monkeypatch)
+    persist = make_queue(tmp_path).start()
+    try:
+        meta = persist.submit(b"jpeg", "apple.jpg", "apple", [])
+        assert wait_for(lambda: persist.snapshot()["spilled"] == 1)
+        assert database.uploads.count_documents({}) == 0
+
+        state["down"] = False
+        assert wait_for(lambda: persist.snapshot()["persisted"] == 1)
+        doc = database.uploads.find_one({"_id": meta["_id"]})
+        assert doc["file_id"] == "f-apple.jpg"
+        assert list((tmp_path / "journal").iterdir()) == []
+    finally:
+        persist.close()
+
+
+def test_close_spills_queued_uploads(tmp_path, monkeypatch):
+    make_backend(monkeypatch)
+    persist = make_queue(tmp_path)  # never started: nothing is processed
+    persist.submit(b"jpeg", "pear.jpg", "pear", [])
+    persist.close()
+    names = sorted(p.name for p in (tmp_path / "journal").iterdir())
+    assert len(names) == 2 and names[0].endswith(".bin") and names[1].endswith(".json")
+    assert persist.snapshot()["spilled"] == 1
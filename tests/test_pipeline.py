@@ -0,0 +1,144 @@
+import threading
+import time
+
+import numpy as np
+
+from pipeline import FramePipeline, MultiCameraPipeline
+
+
+class FakeCamera:
+    """Fills every frame with its sequence number, at roughly `interval` seconds per frame."""
+
+    def __init__(self, interval=0.005, limit=None):
+        self.interval = interval
+        self.limit = limit
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        time.sleep(self.interval)
+        with self._lock:
+            if self.limit is not None and self.seq >= self.limit:
+                return None
+            self.seq += 1
+            return self.seq
+
+    def read(self, image=None):
+        seq = self._next()
+        if seq is None:
+            return False, None
+        if image is None:
+            image = np.empty((8, 8, 3), np.uint8)
+        # write the frame in two halves, like a decoder filling a buffer
+        image[:4] = seq % 256
+        image[4:] = seq % 256
+        return True, image
+
+    def grab(self):
+        return self._next() is not None
+
+    def get(self, prop):
+        return 0
+
+
+def slow_infer(frame, overwritten, delay=0.08):
+    before = frame.copy()
+    time.sleep(delay)
+    if not np.array_equal(before, frame):
+        overwritten.append(int(before[0, 0, 0]))
+    return int(before[0, 0, 0])
+
+
+def test_frame_pipeline_does_not_overwrite_frames_in_use():
+    overwritten, mismatched, rendered = [], [], 0
+    pipe = FramePipeline(FakeCamera(), lambda f: slow_infer(f, overwritten), flip=False).start()
+    deadline = time.perf_counter() + 1.0
+    try:
+        for packet in pipe.results():
+            time.sleep(0.02)  # render
+            if int(packet["frame"][0, 0, 0]) != packet["pred"]:
+                mismatched.append(packet["pred"])
+            rendered += 1
+            if time.perf_counter() > deadline:
+                break
+    finally:
+        pipe.stop()
+    assert pipe.error is None
+    assert rendered > 3
+    assert overwritten == []
+    assert mismatched == []
+    assert pipe.snapshot()["capture"]["dropped"] > 0
+
+
+def test_multi_camera_pipeline_does_not_overwrite_frames_in_use():
+    overwritten, mismatched, rendered = [], [], 0
+
+    def predict_batch(frames):
+        before = [f.copy() for f in frames]
+        time.sleep(0.08)
+        for b, f in zip(before, frames):
+            if not np.array_equal(b, f):
+                overwritten.append(int(b[0, 0, 0]))
+        return [int(b[0, 0, 0]) for b in before]
+
+    pipe = MultiCameraPipeline([FakeCamera(), FakeCamera()], predict_batch, realtime=False).start()
+    deadline = time.perf_counter() + 1.0
+    try:
+        for packets in pipe.results():
+            time.sleep(0.02)  # render
+            for packet in packets:
+                if int(packet["frame"][0, 0, 0]) != packet["pred"]:
+                    mismatched.append(packet["pred"])
+                rendered += 1
+            if time.perf_counter() > deadline:
+                break
+    finally:
+        pipe.stop()
+    assert pipe.error is None
+    assert rendered > 3
+    assert overwritten == []
+    assert mismatched == []
+
+
+def test_multi_camera_pipeline_ends_with_its_sources():
+    pipe = MultiCameraPipeline([FakeCamera(limit=5), FakeCamera(limit=3)], lambda frames: [0] * len(frames),
+                               realtime=False).start()
+    ticks = list(pipe.results())
+    pipe.stop()
+    assert ticks
+    assert not pipe.running
+
+
+class SceneCamera(FakeCamera):
+    """Shows scene 0 for `switch_at` frames, then scene 100 (no noise, so the gate sees no motion within a scene)."""
+
+    def __init__(self, switch_at, **kwargs):
+        super().__init__(**kwargs)
+        self.switch_at = switch_at
+
+    def read(self, image=None):
+        ret, image = super().read(image)
+        if ret:
+            image[:] = 0 if self.seq <= self.switch_at else 100
+        return ret, image
+
+
+def test_multi_camera_gate_retries_a_shed_frame():
+    from scheduler import MotionGate
+
+    calls = []
+
+    def predict_batch(frames):
+        value = int(frames[0][0, 0, 0])
+        calls.append(value)
+        # the server sheds the first frame of the new scene
+        if value == 100 and calls.count(100) == 1:
+            return [None]
+        return [value]
+
+    cam = SceneCamera(switch_at=5, interval=0.005, limit=40)
+    pipe = MultiCameraPipeline([cam], predict_batch, gates=[MotionGate(max_skip=0)], realtime=False).start()
+    preds = [packets[0]["pred"] for packets in pipe.results()]
+    pipe.stop()
+    assert calls.count(100) >= 2
+    assert preds[-1] == 100
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+from preprocess import choose_reduction, letterbox, preprocess_upload, read_image_size, unletterbox_boxes
+
+
+def jpeg(width, height):
+    ok, buf = cv2.imencode(".jpg", np.full((height, width, 3), 128, np.uint8))
+    return buf.tobytes()
+
+
+@pytest.mark.parametrize("size, factor", [
+    (None, 1),
+    ((640, 480), 1),
+    ((1279, 720), 1),
+    ((1280, 720), 2),
+    ((1920, 1080), 2),
+    ((3024, 4032), 4),
+    ((6000, 4000), 8),
+])
+def test_choose_reduction_keeps_long_side_at_least_target(size, factor):
+    assert choose_reduction(size, 640) == factor
+
+
+@pytest.mark.parametrize("width, height", [(640, 480), (1920, 1080), (1080, 1920), (4032, 3024), (1280, 1280)])
+def test_boxes_round_trip_to_original_pixels(width, height):
+    raw = jpeg(width, height)
+    assert read_image_size(raw) == (width, height)
+    prep = preprocess_upload(raw, size=640)
+    factor = prep["factor"]
+    assert factor == choose_reduction((width, height), 640)
+    assert prep["frame"].shape[:2] == (height // factor, width // factor)
+    assert prep["input"].shape[:2] == (640, 640)
+
+    # boxes in original-image pixels, as the model would see them in the letterboxed input
+    boxes = np.array([[0, 0, width, height], [width * 0.25, height * 0.1, width * 0.5, height * 0.9]],
+                     dtype=np.float32)
+    in_input = boxes / factor * prep["ratio"]
+    in_input[:, [0, 2]] += prep["pad"][0]
+    in_input[:, [1, 3]] += prep["pad"][1]
+
+    back = unletterbox_boxes(in_input, prep["ratio"], prep["pad"], prep["frame"].shape) * factor
+    np.testing.assert_allclose(back, boxes, atol=1e-2)
+
+
+def test_letterbox_centres_and_pads():
+    frame = np.zeros((100, 200, 3), np.uint8)
+    padded, ratio, (pad_x, pad_y) = letterbox(frame, 64)
+    assert padded.shape == (64, 64, 3)
+    assert ratio == pytest.approx(0.32)
+    assert (pad_x, pad_y) == (0, 16)
+    assert padded[0, 0].tolist() == [114, 114, 114] and padded[32, 32].tolist() == [0, 0, 0]
+
+
+def test_unletterbox_clips_to_frame():
+    out = unletterbox_boxes(np.array([[-10, -10, 700, 700]], np.float32), 1.0, (0, 0), (480, 640))
+    assert out.tolist() == [[0, 0, 640, 480]]
@@ -0,0 +1,72 @@
+import mongomock
+
+import db
+import result_cache
+from result_cache import ResultCache, decode_result, encode_result
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def value(n):
+    return encode_result([[0, 0, n, n]], [0], [0.9], {0: "freshapples"})
+
+
+def use_mongomock(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(db, "get_db", lambda uri=None, db_name=None: database)
+    monkeypatch.setattr(db, "_cache_ttl_indexed", set())
+    return database
+
+
+def test_lru_keeps_the_most_recently_used_entries():
+    cache = ResultCache(max_entries=2, ttl=0)
+    cache.put("a", value(1))
+    cache.put("b", value(2))
+    assert cache.get("a") is not None
+    cache.put("c", value(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(result_cache.time, "monotonic", clock)
+    cache = ResultCache(ttl=60)
+    cache.put("a", value(1))
+    clock.now += 59
+    assert cache.get("a") is not None
+    clock.now += 2
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+
+
+def test_persistent_tier_serves_misses_and_promotes_them(monkeypatch):
+    use_mongomock(monkeypatch)
+    ResultCache(persistent=True).put("a", value(5))
+
+    fresh = ResultCache(persistent=True)  # e.g. another process: empty memory tier
+    xyxy, cls, conf, names = decode_result(fresh.get("a"))
+    assert xyxy.tolist() == [[0, 0, 5, 5]] and names == {0: "freshapples"}
+    assert fresh.get("a") is not None
+    stats = fresh.stats()
+    assert (stats["hits"], stats["persistent_hits"], stats["errors"]) == (2, 1, 0)
+
+
+def test_changed_ttl_updates_the_existing_index(monkeypatch):
+    database = use_mongomock(monkeypatch)
+    ResultCache(ttl=60, persistent=True).put("a", value(1))
+    db._cache_ttl_indexed.clear()  # a restart with a different RESULT_CACHE_TTL
+
+    cache = ResultCache(ttl=120, persistent=True)
+    cache.put("b", value(2))
+    assert cache.stats()["errors"] == 0
+    assert database.inference_cache.count_documents({}) == 2
+    assert database.inference_cache.index_information()["created_at_1"]["expireAfterSeconds"] == 120
@@ -0,0 +1,56 @@
+import numpy as np
+
+from scheduler import MotionGate
+
+
+def solid(value):
+    return np.full((48, 64, 3), value, np.uint8)
+
+
+def test_uncommitted_frame_does_not_become_the_reference():
+    gate = MotionGate(threshold=4.0, every_n=1, max_skip=0)
+    assert gate.should_infer(solid(0), commit=False)
+    gate.mark_inferred()
+    assert not gate.should_infer(solid(0), commit=False)
+    # motion, but the prediction for it is shed: no mark_inferred()
+    assert gate.should_infer(solid(100), commit=False)
+    # the same scene is still new compared with the last frame that was inferred
+    assert gate.should_infer(solid(100), commit=False)
+    gate.mark_inferred()
+    assert not gate.should_infer(solid(100), commit=False)
+    assert gate.inferred == 2
+
+
+def test_static_frames_below_threshold_reuse_the_result():
+    gate = MotionGate(threshold=4.0, every_n=1, max_skip=0)
+    assert gate.should_infer(solid(0))
+    assert not gate.should_infer(solid(3))
+    assert gate.should_infer(solid(4))
+    assert gate.frames == 3 and gate.inferred == 2
+
+
+def test_every_n_runs_on_every_nth_moving_frame():
+    gate = MotionGate(threshold=4.0, every_n=3, max_skip=0)
+    assert gate.should_infer(solid(0))
+    assert [gate.should_infer(solid(100)) for _ in range(3)] == [False, False, True]
+    # the third moving frame became the reference, so the scene is static again
+    assert not gate.should_infer(solid(100))
+
+
+def test_max_skip_forces_a_refresh():
+    gate = MotionGate(threshold=4.0, every_n=1, max_skip=3)
+    assert gate.should_infer(solid(0))
+    assert [gate.should_infer(solid(0)) for _ in range(4)] == [False, False, False, True]
+    assert gate.skip_fraction == 0.6
+
+
+def test_run_returns_the_previous_result_while_skipping():
+    gate = MotionGate(threshold=4.0, every_n=1, max_skip=0)
+    calls = []
+
+    def infer(frame):
+        calls.append(int(frame[0, 0, 0]))
+        return len(calls)
+
+    assert [gate.run(solid(v), infer) for v in (0, 1, 50, 51)] == [1, 1, 2, 2]
+    assert calls == [0, 50]
@@ -0,0 +1,83 @@
+import numpy as np
+
+from tracker import Tracker, TrackingDetector, greedy_match, iou_matrix
+
+NAMES = {0: "freshapples", 1: "rottenapples"}
+
+
+class FakeBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = np.asarray(xyxy, np.float32).reshape(-1, 4)
+        self.cls = np.asarray(cls, np.float32)
+        self.conf = np.asarray(conf, np.float32)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class FakePrediction:
+    def __init__(self, xyxy, cls, conf):
+        self.boxes = FakeBoxes(xyxy, cls, conf)
+        self.names = NAMES
+
+
+def boxes(*rows):
+    return np.array(rows, np.float32).reshape(-1, 4)
+
+
+def test_iou_matrix():
+    a = boxes([0, 0, 10, 10], [20, 20, 30, 30])
+    b = boxes([0, 0, 10, 10], [5, 0, 15, 10], [100, 100, 110, 110])
+    iou = iou_matrix(a, b)
+    assert iou.shape == (2, 3)
+    np.testing.assert_allclose(iou[0], [1.0, 50 / 150, 0.0], rtol=1e-6)
+    np.testing.assert_allclose(iou[1], [0.0, 0.0, 0.0])
+    assert iou_matrix(a, boxes()).shape == (2, 0)
+
+
+def test_greedy_match_takes_the_best_pairs_first():
+    iou = np.array([[0.9, 0.8],
+                    [0.85, 0.1],
+                    [0.2, 0.25]], np.float32)
+    # row 0 takes column 0, so row 1 (best on column 0) is left unmatched
+    assert greedy_match(iou, 0.3) == [(0, 0)]
+    assert sorted(greedy_match(iou, 0.2)) == [(0, 0), (2, 1)]
+    assert greedy_match(np.zeros((0, 3), np.float32), 0.3) == []
+
+
+def test_tracks_age_out_after_max_age_missed_keyframes():
+    tracker = Tracker(iou_threshold=0.3, max_age=2, count_hits=2)
+    tracker.update(boxes([0, 0, 10, 10]), [0], [0.9], NAMES)
+    first = tracker.result(NAMES).track_ids.tolist()
+    for _ in range(2):
+        tracker.update(boxes(), [], [], NAMES)
+        assert len(tracker) == 1
+        assert len(tracker.result(NAMES)) == 0
+    tracker.update(boxes(), [], [], NAMES)
+    assert len(tracker) == 0
+    # a box in the same place now starts a new track
+    tracker.update(boxes([0, 0, 10, 10]), [0], [0.9], NAMES)
+    assert tracker.result(NAMES).track_ids.tolist() != first
+    # neither track was matched twice, so nothing was counted
+    assert tracker.counts == {}
+
+
+def test_ids_stay_stable_across_keyframes():
+    calls = []
+
+    def detect(frame):
+        x = 4.0 * len(calls)
+        calls.append(x)
+        return FakePrediction([[x, 10, x + 20, 30], [60, 10, 80, 30]], [0, 1], [0.9, 0.8])
+
+    tracking = TrackingDetector(detect, keyframe_interval=3)
+    frame = np.zeros((64, 128, 3), np.uint8)
+    results = [tracking(frame) for _ in range(9)]
+    ids = [r.track_ids.tolist() for r in results]
+
+    assert all(i == ids[0] for i in ids) and len(set(ids[0])) == 2
+    assert tracking.detector_calls == 3
+    assert tracking.tracker.counts == {"freshapples": 1, "rottenapples": 1}
+    # between keyframes the moving box is carried forward by its velocity
+    assert results[-1].xyxy[0, 0] > calls[-1]
+    assert results[-1].xyxy[1, 0] == 60
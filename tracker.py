@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+
+import metrics
+from detection import boxes_to_arrays
+
+# Tracking settings (override with env vars when deploying)
+TRACK_KEYFRAME_INTERVAL = int(os.getenv("TRACK_KEYFRAME_INTERVAL", "5"))
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "2"))
+TRACK_COUNT_HITS = int(os.getenv("TRACK_COUNT_HITS", "2"))
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes -> (N, M)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def greedy_match(iou, threshold):
+    """Match rows to columns by descending IoU; returns [(row, col)] pairs above `threshold`."""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_r, used_c = set(), set()
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r in used_r or c in used_c:
+            continue
+        used_r.add(r)
+        used_c.add(c)
+        pairs.append((r, c))
+    return pairs
+
+
+class Tracks:
+    """Tracker output; `boxes_to_arrays` and `process_prediction` accept it like a prediction."""
+
+    __slots__ = ("xyxy", "cls", "conf", "track_ids", "names")
+
+    def __init__(self, xyxy, cls, conf, track_ids, names):
+        self.xyxy = xyxy
+        self.cls = cls
+        self.conf = conf
+        self.track_ids = track_ids
+        self.names = names
+
+    def __len__(self):
+        return len(self.track_ids)
+
+
+class Tracker:
+    """SORT-style IoU tracker with a constant-velocity motion model (NumPy only).
+
+    `update()` associates keyframe detections with existing tracks by IoU
+    (greedy), `predict()` advances every track by its velocity on frames where
+    the detector doesn't run. Confidences are smoothed with an EMA, each track
+    keeps a stable id, and a track is counted once per label (`counts`) after
+    `count_hits` matched keyframes.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_age=TRACK_MAX_AGE,
+                 count_hits=TRACK_COUNT_HITS, conf_smoothing=0.6):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.count_hits = count_hits
+        self.conf_smoothing = conf_smoothing
+        self.counts = {}
+        self._next_id = 1
+        self.frame = 0
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.velocity = np.empty((0, 4), dtype=np.float32)
+        self.last_box = np.empty((0, 4), dtype=np.float32)
+        self.last_frame = np.empty((0,), dtype=np.int64)
+        self.cls = np.empty((0,), dtype=np.int64)
+        self.conf = np.empty((0,), dtype=np.float32)
+        self.ids = np.empty((0,), dtype=np.int64)
+        self.hits = np.empty((0,), dtype=np.int64)
+        self.misses = np.empty((0,), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def predict(self):
+        """Advance all tracks one frame."""
+        self.frame += 1
+        self.boxes = self.boxes + self.velocity
+
+    def update(self, xyxy, cls, conf, names):
+        """Advance one frame and correct the tracks with this frame's detections."""
+        self.predict()
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        cls = np.asarray(cls, dtype=np.int64)
+        conf = np.asarray(conf, dtype=np.float32)
+
+        pairs = greedy_match(iou_matrix(self.boxes, xyxy), self.iou_threshold)
+        t_idx = np.array([p[0] for p in pairs], dtype=np.int64)
+        d_idx = np.array([p[1] for p in pairs], dtype=np.int64)
+
+        if len(pairs):
+            elapsed = np.maximum(self.frame - self.last_frame[t_idx], 1)[:, None]
+            measured = (xyxy[d_idx] - self.last_box[t_idx]) / elapsed
+            self.velocity[t_idx] = 0.5 * self.velocity[t_idx] + 0.5 * measured
+            self.boxes[t_idx] = xyxy[d_idx]
+            self.last_box[t_idx] = xyxy[d_idx]
+            self.last_frame[t_idx] = self.frame
+            self.cls[t_idx] = cls[d_idx]
+            a = self.conf_smoothing
+            self.conf[t_idx] = a * self.conf[t_idx] + (1 - a) * conf[d_idx]
+            self.hits[t_idx] += 1
+            self.misses[t_idx] = 0
+            for i in t_idx[self.hits[t_idx] == self.count_hits].tolist():
+                label = names[int(self.cls[i])]
+                self.counts[label] = self.counts.get(label, 0) + 1
+
+        unmatched = np.ones(len(self.ids), dtype=bool)
+        unmatched[t_idx] = False
+        self.misses[unmatched] += 1
+        keep = self.misses <= self.max_age
+        for name in ("boxes", "velocity", "last_box", "last_frame", "cls", "conf", "ids", "hits", "misses"):
+            setattr(self, name, getattr(self, name)[keep])
+
+        new = np.ones(len(xyxy), dtype=bool)
+        new[d_idx] = False
+        n = int(new.sum())
+        if n:
+            self.boxes = np.concatenate([self.boxes, xyxy[new]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((n, 4), dtype=np.float32)])
+            self.last_box = np.concatenate([self.last_box, xyxy[new]])
+            self.last_frame = np.concatenate([self.last_frame, np.full(n, self.frame, dtype=np.int64)])
+            self.cls = np.concatenate([self.cls, cls[new]])
+            self.conf = np.concatenate([self.conf, conf[new]])
+            self.ids = np.concatenate([self.ids, np.arange(self._next_id, self._next_id + n, dtype=np.int64)])
+            self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int64)])
+            self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int64)])
+            self._next_id += n
+            if self.count_hits <= 1:
+                for c in cls[new].tolist():
+                    self.counts[names[c]] = self.counts.get(names[c], 0) + 1
+
+    def lost(self, shape):
+        """True if a track missed its last keyframe or has drifted out of a frame of `shape`."""
+        if not len(self.ids):
+            return False
+        h, w = shape[:2]
+        cx = (self.boxes[:, 0] + self.boxes[:, 2]) / 2
+        cy = (self.boxes[:, 1] + self.boxes[:, 3]) / 2
+        outside = (cx < 0) | (cx > w) | (cy < 0) | (cy > h)
+        return bool(outside.any() or (self.misses > 0).any())
+
+    def result(self, names):
+        """Current tracks (those seen on the last keyframe) as a `Tracks` object."""
+        live = self.misses == 0
+        return Tracks(self.boxes[live].copy(), self.cls[live].copy(), self.conf[live].copy(),
+                      self.ids[live].copy(), names)
+
+
+class TrackingDetector:
+    """Run `detect(frame)` only on keyframes and track boxes in between.
+
+    The detector runs every `keyframe_interval` frames, and also early when a
+    track was lost, so it is called roughly `keyframe_interval` times less
+    often. Calling the instance returns a `Tracks` result for every frame.
+    """
+
+    def __init__(self, detect, keyframe_interval=TRACK_KEYFRAME_INTERVAL, tracker=None):
+        self.detect = detect
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.tracker = tracker or Tracker()
+        self.frames = 0
+        self.detector_calls = 0
+        self.names = {}
+        self._since_key = None
+
+    def __call__(self, frame):
+        self.frames += 1
+        if (self._since_key is None or self._since_key + 1 >= self.keyframe_interval
+                or self.tracker.lost(frame.shape)):
+            pred = self.detect(frame)
+            self.names = pred.names
+            xyxy, cls, conf = boxes_to_arrays(pred)
+            self.tracker.update(xyxy, cls, conf, self.names)
+            self.detector_calls += 1
+            self._since_key = 0
+        else:
+            self.tracker.predict()
+            self._since_key += 1
+        metrics.set_gauge("fruit_tracker_detector_fraction", self.detector_calls / self.frames)
+        return self.tracker.result(self.names)
+
+    def snapshot(self):
+        return {
+            "frames": self.frames,
+            "detector_calls": self.detector_calls,
+            "tracks": len(self.tracker),
+            "counts": dict(self.tracker.counts),
+        }
@@ -1,39 +1,153 @@
-from ultralytics import YOLO
+import argparse
+
 import cv2
+import backends
+import metrics
+from detection import process_prediction
+from pipeline import FramePipeline, FrameRing, MultiCameraPipeline, format_multi_stats, format_stats, open_source
+import scheduler
+from scheduler import MotionGate, gated
+import tracker
+from tracker import TrackingDetector
+
+
+def run_serial(infer, cap):
+    ring = FrameRing(1)  # released before the next read
+    while True:
+        frame = ring.read(cap, flip=True)
+        if frame is None:
+            break
+
+        pred = infer(frame)
+
+        process_prediction(frame, pred, font_scale=0.9)
+        metrics.inc("fruit_webcam_frames_total")
+
+        cv2.imshow("Rotten or Not", frame)
+        ring.release(frame)
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+
+def run_pipelined(infer, cap):
+    pipe = FramePipeline(cap, infer).start()
+    try:
+        for i, packet in enumerate(pipe.results()):
+            frame = packet["frame"]
+            process_prediction(frame, packet["pred"], font_scale=0.9)
+            cv2.imshow("Rotten or Not", frame)
+            if i % 30 == 0:
+                print(format_stats(pipe.snapshot()))
+                metrics.record_pipeline(pipe)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        pipe.stop()
+    print(format_stats(pipe.snapshot()))
+
+
+def run_multi(model, sources, gate_factory=None, imgsz=640):
+    """Show every source in its own window, with one batched predict per tick for all of them."""
+    caps = [open_source(src, device_api=cv2.CAP_DSHOW) for src in sources]
+
+    def predict_batch(frames):
+        with metrics.timed("predict"):
+            return model.predict(frames, conf=0.5, imgsz=imgsz, verbose=False)
+
+    gates = [gate_factory() if gate_factory else None for _ in sources]
+    pipe = MultiCameraPipeline(caps, predict_batch, names=[str(s) for s in sources], gates=gates).start()
+    try:
+        for i, packets in enumerate(pipe.results()):
+            for packet in packets:
+                frame = packet["frame"]
+                if packet["pred"] is not None:
+                    process_prediction(frame, packet["pred"], font_scale=0.9)
+                cv2.imshow(f"Rotten or Not [{packet['name']}]", frame)
+            if i % 30 == 0:
+                print(format_multi_stats(pipe.snapshot()))
+                pipe.record_metrics()
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        pipe.stop()
+        for cap in caps:
+            cap.release()
+    if pipe.error:
+        print(pipe.error)
+    print(format_multi_stats(pipe.snapshot()))
+
 
-model = YOLO("best1.pt")
-cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+def main():
+    parser = argparse.ArgumentParser(description="Live fresh/rotten fruit detection from a webcam")
+    parser.add_argument("--serial", action="store_true",
+                        help="capture, infer and render one frame at a time instead of pipelining")
+    parser.add_argument("--backend", default=backends.INFERENCE_BACKEND,
+                        choices=("auto",) + backends.BACKENDS, help="inference backend")
+    parser.add_argument("--threads", type=int, default=backends.INFERENCE_THREADS,
+                        help="CPU threads used for inference")
+    parser.add_argument("--imgsz", type=int, default=backends.INFERENCE_IMGSZ,
+                        help="model input size (see evaluate.py for the speed/accuracy trade-off)")
+    parser.add_argument("--int8", action="store_true", default=backends.INFERENCE_INT8,
+                        help="use the INT8-quantized export (onnx/openvino backends)")
+    parser.add_argument("--no-motion-gate", action="store_true",
+                        help="run the detector on every frame even when the scene is static")
+    parser.add_argument("--motion-threshold", type=float, default=scheduler.MOTION_THRESHOLD,
+                        help="mean abs pixel difference (0-255) that counts as motion")
+    parser.add_argument("--every-n", type=int, default=scheduler.MOTION_EVERY_N,
+                        help="while the scene moves, run the detector on every Nth frame")
+    parser.add_argument("--max-skip", type=int, default=scheduler.MOTION_MAX_SKIP,
+                        help="re-run the detector after this many skipped frames (0 = never)")
+    parser.add_argument("--no-track", action="store_true",
+                        help="detect on every frame instead of tracking between keyframes")
+    parser.add_argument("--keyframe-interval", type=int, default=tracker.TRACK_KEYFRAME_INTERVAL,
+                        help="run the detector every K frames and track in between")
+    parser.add_argument("--sources", nargs="+",
+                        help="camera indices and/or video files to process together with one batched "
+                             "model (motion gating applies per source; tracking is single-camera only)")
+    args = parser.parse_args()
 
-while True:
-    ret, frame = cap.read()
-    frame = cv2.flip(frame, 1)
-    if not ret:
-        break
+    if metrics.ENABLED:
+        metrics.start_http_server()
 
-    results = model.predict(frame, conf=0.5, verbose=False)
-    pred = results[0]
+    model, backend = backends.load_model("best1.pt", backend=args.backend, imgsz=args.imgsz,
+                                         threads=args.threads, int8=args.int8)
+    print(f"Using {backend} backend")
 
-    if pred.boxes is not None:
-        for box in pred.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
+    def make_gate():
+        return MotionGate(threshold=args.motion_threshold, every_n=args.every_n, max_skip=args.max_skip)
 
-            label = pred.names[cls_id]
-            text = f"{label} {conf:.2f}"
+    if args.sources:
+        try:
+            run_multi(model, args.sources, None if args.no_motion_gate else make_gate, imgsz=args.imgsz)
+        finally:
+            cv2.destroyAllWindows()
+        return
 
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+    gate = None if args.no_motion_gate else make_gate()
+    def predict_frame(frame):
+        with metrics.timed("predict"):
+            return model.predict(frame, conf=0.5, imgsz=args.imgsz, verbose=False)[0]
 
-            cv2.putText(
-                frame, text, (x1, y1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.9,
-                (0, 255, 0), 2
-            )
+    infer = gated(predict_frame, gate)
+    tracked = None
+    if not args.no_track:
+        infer = tracked = TrackingDetector(infer, keyframe_interval=args.keyframe_interval)
 
-    cv2.imshow("Rotten or Not", frame)
+    try:
+        if args.serial:
+            run_serial(infer, cap)
+        else:
+            run_pipelined(infer, cap)
+    finally:
+        cap.release()
+        cv2.destroyAllWindows()
+        if gate is not None:
+            print(f"Motion gate: {gate.snapshot()}")
+        if tracked is not None:
+            print(f"Tracker: {tracked.snapshot()}")
 
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
 
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+if __name__ == "__main__":
+    main()